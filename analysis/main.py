@@ -6,7 +6,7 @@ Date: 2024-12-07
 
 TODO:
 - DONE - fix day time.... a single day can run through till 5am I suspect
-- pull every bit of odds, schedule and results at midnight just to confirm all data afterwards
+- DONE - pull every bit of odds, schedule and results at midnight just to confirm all data afterwards (reconcile.py)
 
 
 """
@@ -29,6 +29,10 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir) 
 
 from mongodb_handler import MongoDBHandler
+from trigger.filter import RuleSet, load_rule_set, favourite_features, snapshot_prices
+
+# the backtested rule set, pinned so TAB_RULE_SET or a change to the rules file's `active` entry doesn't move it
+ANALYSIS_RULE_SET = "favourite_place"
 
 logging.basicConfig(
     level=logging.INFO,  # Set the logging level
@@ -161,12 +165,15 @@ def field_extractor(data: list, time: str, field: str):
         return_data.append(d[time][field])
     return return_data
 
-def top_1_placing_analysis(data: List[Dict[str, Any]], time_delta=5) -> int:
+def top_1_placing_analysis(data: List[Dict[str, Any]], time_delta=5, rule_set: Optional[RuleSet] = None) -> int:
     """
     Searching to find the the peoples favourites (win), and betting on them to place.
 
-    Betting $1 on each to keep things simple
+    Betting $1 on each to keep things simple. Races are filtered with `rule_set`
+    (default: ANALYSIS_RULE_SET from trigger/filter_rules.json).
     """
+    if rule_set is None:
+        rule_set = load_rule_set(ANALYSIS_RULE_SET)
     stats = RaceStats()
     stats.total_races = len(data)
 
@@ -261,7 +268,11 @@ def top_1_placing_analysis(data: List[Dict[str, Any]], time_delta=5) -> int:
         #  or favourite_plc_before < 1.1 improves a little
         # favourite_ffwin_before >= 2.0
         #  or favourite_win_before > 4.1 improves a litte
-        if favourite_ffwin_before >= 1.7 or favourite_odds_before["tote_fixed_win_ratio"] < 1.5 or favourite_odds_before["tote_fixed_win_ratio"] > 6 or favourite_plc_before < 1.05:
+        features = favourite_features([
+            snapshot_prices(find_entry_before_race(race_time, e["odds"], seconds_delta=time_delta))
+            for e in sorted_entries
+        ])
+        if not rule_set.evaluate(features):
             stats.race_filtered += 1
             continue 
 
@@ -602,6 +613,52 @@ def top_1_placing_analysis(data: List[Dict[str, Any]], time_delta=5) -> int:
 
     return stats.profit
 
+def build_feature_frame(data: List[Dict[str, Any]], time_delta=5) -> pd.DataFrame:
+    """
+    One row per resulted race: the filter feature vector before the jump plus the
+    favourite's outcome, so rule sets can be backtested with RuleSet.evaluate_frame.
+    """
+    rows = []
+    for race in data:
+        if not race.get("got_results"):
+            continue
+        race_time = race["norm_time"]
+        priced = []
+        for entry in race["entries"].values():
+            if entry.get("scratched") or entry.get("is_scratched") or not entry.get("odds"):
+                continue
+            before = find_entry_before_race(race_time, entry["odds"], seconds_delta=time_delta)
+            if not before or before.get("scr"):
+                continue
+            priced.append((snapshot_prices(before), entry))
+
+        features = favourite_features([prices for prices, _ in priced])
+        if features is None:
+            continue
+        _, favourite = min(
+            ((prices, entry) for prices, entry in priced if prices["ffwin"]),
+            key=lambda pair: pair[0]["ffwin"],
+        )
+        after = snapshot_prices(find_latest_entry(favourite["odds"]))
+        features["race_id"] = race["_id"]
+        features["placed"] = favourite.get("results_rank") in (1, 2)
+        features["after_plc"] = after["plc"] if after["plc"] else after["ffplc"]
+        rows.append(features)
+    return pd.DataFrame(rows)
+
+def backtest_rule_set(frame: pd.DataFrame, rule_set: RuleSet) -> Dict[str, float]:
+    """Vectorised $1 place-bet backtest of `rule_set` over a build_feature_frame() frame."""
+    bet = rule_set.evaluate_frame(frame)
+    bets = frame[bet]
+    profit = (bets["after_plc"].where(bets["placed"], 0) - 1).sum()
+    return {
+        "rule_set": rule_set.name,
+        "races": len(frame),
+        "bets": len(bets),
+        "wins": int(bets["placed"].sum()),
+        "profit": float(profit),
+    }
+
 def find_latest_race_of_day(d):
     time_list = []
     for race in d:  
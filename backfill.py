@@ -0,0 +1,226 @@
+"""Backfill past days from the API, e.g. to fill the gap left by an outage.
+
+For each day in a date range, the day's schedule is fetched with
+get_schedule_data(date=...) and every race's event once, for its results and
+final odds. Requests go through one RequestScheduler drained by a pool of
+workers under a shared rate limit, and the race updates through the
+RacePipeline into MongoDBHandler.bulk_update (upserts), several days at a
+time.
+
+Races already complete in Mongo (results, or retired without) are not fetched
+again, and days finished are recorded in a checkpoint file, so an interrupted
+backfill picks up where it stopped:
+
+  python backfill.py --start 2026-05-01 --end 2026-05-31
+
+Backfilled races carry `backfilled_at`. Runners without live odds get a single
+snapshot timestamped at the race start: the odds the API reports after the
+race, not a series sampled before the jump.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import main as scraper
+from mongodb_handler import MongoDBHandler
+from race_index import index_races
+from race_pipeline import RacePipeline
+from request_scheduler import Priority, RequestScheduler
+from tab_data_extractor import TabDataExtractor
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_WORKERS = 8
+BACKFILL_RATE_PER_SECOND = 20.0
+DAYS_PER_BATCH = 7  # days fetched through one pipeline between checkpoints
+CHECKPOINT_FILE = os.getenv("TAB_BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+
+
+def date_range(start: str, end: str) -> List[str]:
+    first = datetime.strptime(start, scraper.DATE_FORMAT)
+    last = datetime.strptime(end, scraper.DATE_FORMAT)
+    return [(first + timedelta(days=i)).strftime(scraper.DATE_FORMAT) for i in range((last - first).days + 1)]
+
+
+def load_checkpoint(path: str = CHECKPOINT_FILE) -> List[str]:
+    """Days already backfilled."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("done", [])
+    except (OSError, ValueError):
+        return []
+
+
+def save_checkpoint(done: List[str], path: str = CHECKPOINT_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"done": sorted(set(done))}, f)
+    os.replace(tmp, path)
+
+
+def race_complete(race: Dict[str, Any]) -> bool:
+    return bool(race.get("got_results") or race.get("results_abandoned"))
+
+
+def apply_backfill_event(race: Dict[str, Any], event: Dict[str, Any], now: datetime):
+    """Final state of a past race from one event: status, results and, where missing, final odds."""
+    scraper.apply_results_event(race, event, now)
+    scraper.add_odds_snapshot(race, event, race.get("norm_time") or now.strftime(scraper.DATETIME_FORMAT),
+                              only_new=True)
+    if not race.get("got_results"):
+        # past days get no later polls
+        race["results_abandoned"] = True
+    race.pop("results_next_poll", None)
+    race["backfilled_at"] = now.strftime(scraper.DATETIME_FORMAT)
+
+
+class Backfill:
+    """Fetches and writes a batch of past days through one scheduler and pipeline."""
+
+    def __init__(self, mongodb: MongoDBHandler, data_extractor: TabDataExtractor,
+                 workers: int = BACKFILL_WORKERS, rate_per_second: float = BACKFILL_RATE_PER_SECOND):
+        self.mongodb = mongodb
+        self.data_extractor = data_extractor
+        self.workers = workers
+        self.rate_per_second = rate_per_second
+
+    def _scheduler(self) -> RequestScheduler:
+        # no deadline or queue bound: a backfill runs until everything is fetched
+        return RequestScheduler(rate_per_second=self.rate_per_second, burst=self.workers,
+                                max_depth={priority: None for priority in Priority})
+
+    def fetch_schedules(self, days: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        scheduler = self._scheduler()
+        requests = {day: scheduler.submit(Priority.SCHEDULE, self.data_extractor.get_schedule_data, day)
+                    for day in days}
+        scheduler.run(self.workers)
+        return {day: request.result for day, request in requests.items()}
+
+    def load_races(self, day: str, schedule: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, str]]:
+        """(races still to backfill, their before-images, their collections) for `day`.
+
+        The schedule is merged into what Mongo has; races missing from Mongo go to their meeting day's collection.
+        """
+        collection_name = scraper.convert_date_to_collection_format(day)
+        existing = {}
+        if self.mongodb.check_collection_in_db(collection_name):
+            self.mongodb.set_collection(collection_name)
+            existing = scraper.reformat_collection_format(self.mongodb.get_all_documents() or []) or {}
+
+        races, snapshots, collection_of = {}, {}, {}
+        for _id, race in {**scraper.extract_schedule_data(schedule, day), **existing}.items():
+            if race_complete(race):
+                continue
+            # a race missing from Mongo is written whole: its before-image is empty
+            snapshots[_id] = scraper.race_snapshot(race if _id in existing else {"_id": _id})
+            collection_of[_id] = collection_name if _id in existing else scraper.race_collection(race)
+            races[_id] = race
+        return races, snapshots, collection_of
+
+    def run(self, days: List[str]) -> List[str]:
+        """Backfill `days`; returns those now complete."""
+        start = time.perf_counter()
+        now = scraper.now_utc()
+        schedules = self.fetch_schedules(days)
+
+        races: Dict[str, Any] = {}
+        snapshots: Dict[str, Any] = {}
+        collection_of: Dict[str, str] = {}
+        day_of: Dict[str, str] = {}
+        for day, schedule in schedules.items():
+            if not schedule:
+                logger.warning(f"No schedule for {day}, will retry next run")
+                continue
+            day_races, day_snapshots, day_collections = self.load_races(day, schedule)
+            races.update(day_races)
+            snapshots.update(day_snapshots)
+            collection_of.update(day_collections)
+            day_of.update((_id, day) for _id in day_races)
+            logger.info(f"{day}: {len(day_races)} races to backfill")
+
+        index_races(self.mongodb.client, races.values(), collection_of)
+
+        scheduler = self._scheduler()
+        race_of = {}
+        for _id in races:
+            race_of[scheduler.submit(Priority.BACKFILL, self.data_extractor.get_event_data, _id).seq] = _id
+
+        failed = set()
+
+        def transform(request):
+            _id = race_of[request.seq]
+            if request.result is None:
+                failed.add(day_of[_id])
+                return None
+            apply_backfill_event(races[_id], request.result, now)
+            return _id, scraper.race_update_ops(races[_id], snapshots[_id])
+
+        def write_batch(updates):
+            by_collection: Dict[str, list] = {}
+            for update in updates:
+                by_collection.setdefault(collection_of[update[0]], []).append(update)
+            written = 0
+            for collection_name, batch in by_collection.items():
+                result = self.mongodb.bulk_update(batch, collection_name=collection_name, upsert=True)
+                if result is None:
+                    failed.update(day_of[_id] for _id, _ in batch)
+                    continue
+                written += result
+            return written
+
+        pipeline = RacePipeline(transform, write_batch)
+        pipeline.run(scheduler, self.workers)
+        logger.info(pipeline.report())
+        scheduler.log_stats()
+
+        done = [day for day, schedule in schedules.items() if schedule and day not in failed]
+        elapsed = time.perf_counter() - start
+        logger.info(f"Backfilled {len(races)} races over {len(days)} days in {elapsed:.1f}s "
+                    f"({len(races) / max(elapsed, 1e-9):.1f} races/s) | {len(days) - len(done)} days to retry")
+        return done
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    yesterday = (scraper.now_utc() - timedelta(days=1)).strftime(scraper.DATE_FORMAT)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", required=True, help="First day, YYYY-MM-DD")
+    parser.add_argument("--end", default=yesterday, help="Last day, YYYY-MM-DD (default yesterday)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE_PER_SECOND, help="API requests per second")
+    parser.add_argument("--days-per-batch", type=int, default=DAYS_PER_BATCH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--force", action="store_true", help="Ignore the checkpoint")
+    args = parser.parse_args()
+
+    if args.end >= scraper.today_utc_str():
+        parser.error("today belongs to the live scraper, backfill up to yesterday")
+    # per-race status and results lines from main.py
+    scraper.logger.setLevel(logging.WARNING)
+
+    done = [] if args.force else load_checkpoint(args.checkpoint)
+    days = [day for day in date_range(args.start, args.end) if day not in done]
+    logger.info(f"Backfilling {len(days)} days ({len(done)} already done)")
+    if not days:
+        return
+
+    mongodb = MongoDBHandler(database_name="tab")
+    if not mongodb.connect():
+        logger.error("Failed to connect to MongoDB")
+        return
+    try:
+        # no memo: every event is fetched once anyway
+        backfill = Backfill(mongodb, TabDataExtractor(memo_ttl=0), args.workers, args.rate)
+        for i in range(0, len(days), args.days_per_batch):
+            done.extend(backfill.run(days[i:i + args.days_per_batch]))
+            save_checkpoint(done, args.checkpoint)
+    finally:
+        mongodb.close_connection()
+
+
+if __name__ == '__main__':
+    main()
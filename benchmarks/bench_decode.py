@@ -0,0 +1,135 @@
+"""
+Benchmarks JSON decoding of schedule and event payloads: stdlib json, orjson
+and msgspec full decodes against the msgspec field-pruned decode used by
+TabDataExtractor.
+
+Runs on payloads recorded with `tab_api_stub.py record`, or on synthetic
+payloads padded with the kind of fields the live API sends but the scraper
+never reads. Also checks the pruned decode produces the same race documents.
+
+Usage:
+  python benchmarks/bench_decode.py --recording recordings/2026-05-20
+  python benchmarks/bench_decode.py
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import logging
+import argparse
+import statistics
+from typing import Callable, Dict, List
+
+#HACK: TODO: make this pip installable
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import payload_decoder
+from payload_decoder import SCHEDULE, EVENT
+from main import extract_schedule_data, set_clock, system_utc
+from tab_api_stub import RECORDING_FILE, SCHEDULE_PATH, EVENT_PATH_PREFIX, synthetic_day
+
+# Unused fields added to synthetic payloads, roughly the weight of the live ones
+RUNNER_PADDING = {
+    "silk_url": "https://static.tab.co.nz/silks/000000.png",
+    "form": "x2341-12x3",
+    "comment": "Consistent sort, drawn to get a good run and rates a chance here. " * 3,
+    "sire": "Sire Name", "dam": "Dam Name", "dam_sire": "Dam Sire",
+    "age": 4, "sex": "G", "colour": "B",
+    "owners": "A Owner, B Owner, C Owner & D Owner",
+    "last_starts": [{"date": "2026-05-01", "position": 3, "field": 12, "track": "Ellerslie", "distance": 1400}] * 6,
+    "flucs": [{"time": "2026-05-20T01:00:00Z", "price": 5.5}] * 10,
+}
+RACE_PADDING = {
+    "description": "Rating 65 Handicap",
+    "prize_money": {"total": 40000, "first": 24000, "second": 7600, "third": 3800},
+    "pools": [{"type": t, "amount": 12345.6} for t in ("WIN", "PLC", "QLA", "TFA", "FF")],
+    "comment": "A competitive handicap over a middle distance. " * 4,
+}
+
+
+def padded_synthetic(meetings: int = 40, races: int = 10, runners: int = 14) -> Dict[str, List[bytes]]:
+    day = synthetic_day(meetings, races, runners)
+    for meeting in day["schedule"]["meetings"]:
+        for race in meeting["races"]:
+            race.update(RACE_PADDING)
+    events = []
+    for event in day["events"].values():
+        event["race"].update(RACE_PADDING)
+        for runner in event["runners"]:
+            runner.update(RUNNER_PADDING)
+        events.append(json.dumps({"data": event}).encode())
+    return {SCHEDULE: [json.dumps({"data": day["schedule"]}).encode()], EVENT: events}
+
+
+def recorded(recording_dir: str) -> Dict[str, List[bytes]]:
+    payloads = {SCHEDULE: [], EVENT: []}
+    with open(os.path.join(recording_dir, RECORDING_FILE), "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry["status"] != 200 or entry["body"] is None:
+                continue
+            body = json.dumps(entry["body"]).encode()
+            if entry["path"] == SCHEDULE_PATH:
+                payloads[SCHEDULE].append(body)
+            elif entry["path"].startswith(EVENT_PATH_PREFIX):
+                payloads[EVENT].append(body)
+    return payloads
+
+
+def decoders(kind: str) -> Dict[str, Callable[[bytes], object]]:
+    options = {"json": json.loads}
+    if payload_decoder.orjson is not None:
+        options["orjson"] = payload_decoder.orjson.loads
+    if payload_decoder.msgspec is not None:
+        options["msgspec"] = payload_decoder.msgspec.json.decode
+        options["msgspec pruned"] = lambda content: payload_decoder.decode(content, kind)
+    return options
+
+
+def bench(payloads: List[bytes], fn: Callable[[bytes], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for content in payloads:
+            fn(content)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def check_schedule(payloads: List[bytes]):
+    """Pruned and full decodes must give identical race documents."""
+    if payload_decoder.msgspec is None or not payloads:
+        return
+    set_clock(lambda: system_utc())
+    full = extract_schedule_data(json.loads(payloads[-1])["data"])
+    pruned = extract_schedule_data(payload_decoder.decode(payloads[-1], SCHEDULE)["data"])
+    print(f"  schedule documents match: {full == pruned}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload decoding benchmarks")
+    parser.add_argument("--recording", help="Directory written by tab_api_stub.py record")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    payloads = recorded(args.recording) if args.recording else padded_synthetic()
+    print(f"Decoder backend in use: {payload_decoder.backend()}")
+    for kind, contents in payloads.items():
+        if not contents:
+            continue
+        size_mb = sum(len(c) for c in contents) / 1e6
+        print(f"{kind}: {len(contents)} payloads, {size_mb:.1f}MB")
+        baseline = None
+        for name, fn in decoders(kind).items():
+            elapsed = bench(contents, fn, args.repeat)
+            baseline = baseline or elapsed
+            print(f"  {name:<16} {elapsed * 1000:9.2f}ms  {baseline / elapsed:5.1f}x  {size_mb / elapsed:7.1f}MB/s")
+    check_schedule(payloads[SCHEDULE])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+Benchmarks for the scraper and analysis hot paths on synthetic days.
+
+Scales run from a quiet Tuesday to Melbourne Cup day. The clock behind
+main.now_utc is faked so the odds/results windows hit the same races every
+run, event fetches come from memory, and MongoDB is mongomock (default) or a
+local mongod (--mongo mongod, uses the MONGODB_* env vars).
+
+Ticks run the live path, update_race_data_local through the RequestScheduler
+and RacePipeline. With mongod they also write through bulk_update;
+mongomock cannot run pymongo's bulk_write, so there the pipeline only
+collects the updates.
+
+Results are written to benchmarks/results/<timestamp>_<commit>.json and
+compared against the previous run. With --compare the run fails (exit 1)
+when a benchmark's min time exceeds the baseline's by more than --threshold.
+The baseline is the latest results file, or the given one.
+
+Usage:
+  python benchmarks/bench_hot_paths.py
+  python benchmarks/bench_hot_paths.py --scale quiet_tuesday --repeat 3
+  python benchmarks/bench_hot_paths.py --compare --threshold 1.3
+  python benchmarks/bench_hot_paths.py --compare benchmarks/results/20261101_120000_abc1234.json --no-save
+"""
+import os
+import sys
+import copy
+import json
+import time
+import inspect
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+#HACK: TODO: make this pip installable
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+import main as scraper
+from mongodb_handler import MongoDBHandler
+from request_scheduler import Priority, RequestScheduler
+from tab_api_stub import synthetic_day, finish_synthetic_race
+
+RESULTS_DIR = os.path.join(currentdir, "results")
+REGRESSION_THRESHOLD = 1.2  # flag anything 20% slower than the previous run
+MIN_COMPARABLE_SECONDS = 0.001  # sub-millisecond timings are mostly noise, not compared
+
+# meetings x races x runners, and odds snapshots already stored per runner
+SCALES = {
+    "quiet_tuesday": {"meetings": 12, "races": 8, "runners": 10, "snapshots": 30},
+    "saturday": {"meetings": 40, "races": 9, "runners": 12, "snapshots": 60},
+    "melbourne_cup": {"meetings": 80, "races": 10, "runners": 16, "snapshots": 60},
+}
+
+DAY_START = datetime(2026, 11, 3, 0, 0, 0)
+TICK_BURST = 10 ** 9  # no rate limit: fetches come from memory
+
+
+class InMemoryExtractor:
+    """Serves a synthetic day's events without HTTP, same interface as TabDataExtractor."""
+
+    def __init__(self, day: Dict[str, Any]):
+        self.day = day
+
+    def get_schedule_data(self, date: str = "today") -> Optional[Dict]:
+        return self.day["schedule"]
+
+    def get_event_data(self, race_id: str, hedge: bool = False) -> Optional[Dict]:
+        return self.day["events"].get(race_id)
+
+
+class Fixture:
+    """One synthetic day at a given scale, in every shape the benchmarks need."""
+
+    def __init__(self, meetings: int, races: int, runners: int, snapshots: int):
+        self.day = synthetic_day(meetings, races, runners, start=DAY_START)
+        self.extractor = InMemoryExtractor(self.day)
+        scraper.set_clock(lambda: DAY_START)
+        self.schedule_docs = scraper.extract_schedule_data(self.day["schedule"])
+        self.documents = [self._with_history(doc, snapshots) for doc in self.schedule_docs.values()]
+
+        finished = copy.deepcopy(self.day)
+        for event in finished["events"].values():
+            finish_synthetic_race(event)
+        self.finished_extractor = InMemoryExtractor(finished)
+        self.legacy_documents = [self._legacy(doc) for doc in self.documents]
+
+        times = sorted(doc["norm_time"] for doc in self.documents)
+        self.mid_day = datetime.strptime(times[len(times) // 2], scraper.DATETIME_FORMAT)
+        self.end_of_day = datetime.strptime(times[-1], scraper.DATETIME_FORMAT) + timedelta(minutes=10)
+
+    def _with_history(self, doc: Dict[str, Any], snapshots: int) -> Dict[str, Any]:
+        """A race document as it looks after `snapshots` ticks of 10 seconds before the jump."""
+        doc = copy.deepcopy(doc)
+        race_time = datetime.strptime(doc["norm_time"], scraper.DATETIME_FORMAT)
+        event = self.day["events"][doc["_id"]]
+        for runner in event["runners"]:
+            odds = {}
+            for i in range(snapshots):
+                ts = (race_time - timedelta(seconds=10 * (snapshots - i))).strftime(scraper.DATETIME_FORMAT)
+                odds[ts] = dict(runner["odds"])
+            doc["entries"][str(runner["runner_number"])] = {
+                "runner_number": runner["runner_number"],
+                "name": runner["name"],
+                "is_scratched": runner["is_scratched"],
+                "results_plc": False,
+                "odds": odds,
+            }
+        return doc
+
+    def _legacy(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Pre-migration document shape analysis/main.py reads (win/plc/ffwin/ffplc snapshots)."""
+        doc = copy.deepcopy(doc)
+        doc["got_results"] = True
+        for rank, entry in enumerate(doc["entries"].values(), start=1):
+            entry["scratched"] = entry.pop("is_scratched")
+            entry["results_rank"] = rank
+            for ts, odds in entry["odds"].items():
+                entry["odds"][ts] = {
+                    "scr": False,
+                    "win": round(odds["fixed_win"] * 1.6, 2),
+                    "plc": round(odds["fixed_place"] * 1.3, 2),
+                    "ffwin": odds["fixed_win"],
+                    "ffplc": odds["fixed_place"],
+                }
+        return doc
+
+
+def make_mongodb(backend: str) -> MongoDBHandler:
+    mongodb = MongoDBHandler(database_name="tab_benchmark")
+    if backend == "mongod":
+        if not mongodb.connect():
+            raise RuntimeError("Cannot connect to local mongod")
+    else:
+        import mongomock
+        mongodb.client = mongomock.MongoClient()
+        mongodb.db = mongodb.client[mongodb.database_name]
+    mongodb.db.drop_collection("_bench")
+    mongodb.set_collection("_bench")
+    return mongodb
+
+
+def run_tick(extractor, data: Dict[str, Any], write_batch=None):
+    """One live tick (update_race_data_local) over `data`, unthrottled."""
+    request_scheduler = RequestScheduler(burst=TICK_BURST, max_depth={priority: None for priority in Priority})
+    return scraper.update_race_data_local(request_scheduler, extractor, data, write_batch)
+
+
+def bench(name: str, fn: Callable[[Any], Any], setup: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Time fn(setup()) `repeat` times, excluding setup."""
+    timings = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    result = {"min_s": min(timings), "median_s": statistics.median(timings), "repeat": repeat}
+    print(f"  {name:<40} min {result['min_s'] * 1000:9.2f}ms  median {result['median_s'] * 1000:9.2f}ms")
+    return result
+
+
+def run_scale(fixture: Fixture, repeat: int, mongo_backend: str) -> Dict[str, Dict[str, float]]:
+    results = {}
+    docs_map = lambda: scraper.reformat_collection_format(copy.deepcopy(fixture.documents))
+
+    results["extract_schedule_data"] = bench(
+        "extract_schedule_data", scraper.extract_schedule_data, lambda: fixture.day["schedule"], repeat)
+    results["reformat_collection_format"] = bench(
+        "reformat_collection_format", scraper.reformat_collection_format,
+        lambda: copy.deepcopy(fixture.documents), repeat)
+
+    scraper.set_clock(lambda: fixture.mid_day)
+    results["tick_odds"] = bench(
+        "update_race_data_local (mid-day tick)", lambda data: run_tick(fixture.extractor, data), docs_map, repeat)
+
+    scraper.set_clock(lambda: fixture.end_of_day)
+    results["tick_results"] = bench(
+        "update_race_data_local (end-of-day tick)", lambda data: run_tick(fixture.finished_extractor, data),
+        docs_map, repeat)
+
+    mongodb = make_mongodb(mongo_backend)
+
+    if mongo_backend == "mongod":
+        def stored_day():
+            mongodb.collection.delete_many({})
+            mongodb.collection.insert_many(copy.deepcopy(fixture.documents))
+            return docs_map()
+
+        scraper.set_clock(lambda: fixture.mid_day)
+        results["tick_odds_bulk_update"] = bench(
+            "mid-day tick + bulk_update", lambda data: run_tick(fixture.extractor, data, mongodb.bulk_update),
+            stored_day, repeat)
+
+    def write_all(docs: List[Dict[str, Any]]):
+        mongodb.collection.delete_many({})
+        for doc in docs:
+            mongodb.post_data(doc)
+
+    results["mongodb.post_data"] = bench("mongodb.post_data (day)", write_all,
+                                         lambda: copy.deepcopy(fixture.documents), repeat)
+    results["mongodb.get_all_documents"] = bench("mongodb.get_all_documents", lambda _: mongodb.get_all_documents(),
+                                                 lambda: None, repeat)
+    results["mongodb.replace_document"] = bench(
+        "mongodb.replace_document (day)",
+        lambda docs: [mongodb.replace_document(doc["_id"], doc) for doc in docs],
+        lambda: copy.deepcopy(fixture.documents), repeat)
+    mongodb.db.drop_collection("_bench")
+    mongodb.close_connection()
+
+    try:
+        from analysis import main as analysis
+    except ImportError as e:
+        print(f"  skipping analysis benchmarks: {e}")
+        return results
+
+    entries = [(doc["norm_time"], entry["odds"]) for doc in fixture.legacy_documents for entry in doc["entries"].values()]
+    results["find_entry_before_race"] = bench(
+        "find_entry_before_race (all entries)",
+        lambda items: [analysis.find_entry_before_race(t, odds, 5) for t, odds in items],
+        lambda: entries, repeat)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # plots land in output_plots/
+        try:
+            results["top_1_placing_analysis"] = bench(
+                "top_1_placing_analysis", lambda data: analysis.top_1_placing_analysis(data, 5),
+                lambda: copy.deepcopy(fixture.legacy_documents), max(1, repeat // 2))
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=parentdir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results(path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Results file `path`, by default the latest in RESULTS_DIR. None if there is none."""
+    if path is None:
+        if not os.path.isdir(RESULTS_DIR):
+            return None
+        files = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith(".json"))
+        if not files:
+            return None
+        path = os.path.join(RESULTS_DIR, files[-1])
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def report_regressions(current: Dict[str, Any], previous: Optional[Dict[str, Any]],
+                       threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Print each benchmark's min time relative to `previous`; returns the "scale/name" of regressions."""
+    if previous is None:
+        print("\nNo previous results to compare with")
+        return []
+    if previous.get("mongo") != current["mongo"]:
+        print(f"\nNot comparing: previous run used {previous.get('mongo')}, this one {current['mongo']}")
+        return []
+    print(f"\nCompared with {previous['commit']} ({previous['timestamp']}), threshold {threshold:.2f}x:")
+    regressions = []
+    for scale, benches in current["scales"].items():
+        for name, result in benches.items():
+            before = previous["scales"].get(scale, {}).get(name)
+            if not before or before["min_s"] < MIN_COMPARABLE_SECONDS:
+                continue
+            ratio = result["min_s"] / before["min_s"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{scale}/{name}")
+            print(f"  {scale:<14} {name:<32} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scraper and analysis hot path benchmarks")
+    parser.add_argument("--scale", choices=sorted(SCALES), action="append")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--mongo", choices=["mongomock", "mongod"], default="mongomock")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", nargs="?", const="", metavar="RESULTS_FILE",
+                        help="Fail on regressions against RESULTS_FILE (default: the latest saved run)")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Slowdown ratio of min time counted as a regression")
+    args = parser.parse_args()
+    if args.compare and not os.path.isfile(args.compare):
+        parser.error(f"no such results file: {args.compare}")
+    # read before this run is saved, so the default baseline is the run before it
+    previous = previous_results(args.compare or None)
+
+    logging.disable(logging.INFO)
+    current = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "mongo": args.mongo,
+        "scales": {},
+    }
+    try:
+        for scale in args.scale or list(SCALES):
+            print(f"{scale}: {SCALES[scale]}")
+            fixture = Fixture(**SCALES[scale])
+            current["scales"][scale] = run_scale(fixture, args.repeat, args.mongo)
+    finally:
+        scraper.set_clock(None)
+        logging.disable(logging.NOTSET)
+
+    regressions = report_regressions(current, previous, args.threshold)
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{current['commit']}.json"
+        with open(os.path.join(RESULTS_DIR, name), "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=4)
+        print(f"\nSaved {name}")
+    if args.compare is not None and regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
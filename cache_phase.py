@@ -0,0 +1,246 @@
+"""Alignment of scraper ticks to the Affiliates v1 30-second response cache.
+
+The API serves cached responses for 30 seconds, so a poll only sees new odds
+if a cache refresh happened since the previous poll. CachePhaseEstimator
+learns where in each 30 second period the refresh lands, from the `Age`
+response header when the CDN sends one, and otherwise from the points where
+a payload changes between polls. AlignedTicker then starts each tick just
+after the estimated refresh.
+
+A change only pins the refresh down when the two polls are close together,
+and aligned ticks poll each URL exactly one period apart, so under --loop they
+teach the estimator nothing. PhaseProbe fills the gap: from a random point in
+the period it polls one frequently changing URL twice, a few seconds apart,
+and a change between the two places the refresh within that short window.
+
+Tick targets are absolute wall-clock boundaries (phase + k * period), waited
+on with the monotonic clock, so a late or slow tick never shifts later ones.
+"""
+import os
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_PERIOD_SECONDS = float(os.getenv("TAB_CACHE_PERIOD_SECONDS", "30"))
+POLL_OFFSET_SECONDS = 1.0  # start this long after the estimated refresh
+PHASE_SAMPLES = 200
+PHASE_MIN_SAMPLES = 5
+PHASE_MIN_CONFIDENCE = 0.6  # mean resultant length of the samples, 1.0 = all agree
+PHASE_PROBE_GAP_SECONDS = 6.0  # spacing of a probe's two polls; also its sample's max error (x2)
+PHASE_PROBE_EVERY = 10  # once confident, probe every this many periods to follow drift
+CACHE_PHASE_FILE = os.getenv("TAB_CACHE_PHASE_FILE", "/tmp/tab_cache_phase.json")
+
+
+class CachePhaseEstimator:
+    """Estimates the cache refresh phase (seconds past each period boundary)."""
+
+    def __init__(self, period: float = CACHE_PERIOD_SECONDS, wall: Callable[[], float] = time.time):
+        self.period = period
+        self._wall = wall
+        self.samples = deque(maxlen=PHASE_SAMPLES)
+        self._last_seen: Dict[str, Tuple[str, float]] = {}
+        self._changed: Dict[str, float] = {}  # url -> when its payload last changed
+        self._lock = threading.Lock()  # samples are added from fetch workers and the probe thread
+
+    def add_refresh(self, refreshed_at: float):
+        """Record a wall-clock time at which the cache is believed to have refreshed."""
+        with self._lock:
+            self.samples.append(refreshed_at % self.period)
+
+    def observe(self, url: str, response):
+        """TabDataExtractor response hook: learn from headers and payload changes."""
+        received = self._wall()
+        age = response.headers.get("Age")
+        if age is not None:
+            try:
+                self.add_refresh(received - float(age))
+            except ValueError:
+                pass
+
+        fingerprint = hashlib.blake2b(response.content, digest_size=8).hexdigest()
+        previous = self._last_seen.get(url)
+        if age is None and previous is not None and previous[0] != fingerprint:
+            # refresh happened between the two polls; only a short gap pins it down
+            if received - previous[1] <= self.period / 2:
+                self.add_refresh((previous[1] + received) / 2)
+            self._changed.pop(url, None)
+            self._changed[url] = received
+        self._last_seen[url] = (fingerprint, received)
+
+    def probe_url(self, prefix: str = "") -> Optional[str]:
+        """Most recently changed URL starting with `prefix`, worth re-polling mid-period."""
+        cutoff = self._wall() - 2 * self.period
+        for url in reversed(list(self._changed)):
+            if url.startswith(prefix) and self._changed[url] >= cutoff:
+                return url
+        return None
+
+    def estimate(self) -> Tuple[Optional[float], float]:
+        """(phase, confidence) from the circular mean of the samples; phase is None when unsure."""
+        with self._lock:
+            samples = list(self.samples)
+        if len(samples) < PHASE_MIN_SAMPLES:
+            return None, 0.0
+        angles = [2 * math.pi * s / self.period for s in samples]
+        x = sum(math.cos(a) for a in angles) / len(angles)
+        y = sum(math.sin(a) for a in angles) / len(angles)
+        confidence = math.hypot(x, y)
+        if confidence < PHASE_MIN_CONFIDENCE:
+            return None, confidence
+        phase = (math.atan2(y, x) / (2 * math.pi) * self.period) % self.period
+        return phase, confidence
+
+    def phase(self) -> float:
+        """Best phase estimate, 0 (the period boundary) until one is learned."""
+        phase, _ = self.estimate()
+        return 0.0 if phase is None else phase
+
+    def summary(self) -> str:
+        phase, confidence = self.estimate()
+        shown = "unknown" if phase is None else f"{phase:.1f}s"
+        return f"Cache phase: {shown} (confidence {confidence:.2f}, {len(self.samples)} samples, period {self.period:.0f}s)"
+
+    def save(self, path: str = CACHE_PHASE_FILE):
+        """Persist samples and recent fingerprints so cron-launched ticks keep learning."""
+        cutoff = self._wall() - 2 * self.period
+        with self._lock:
+            samples = list(self.samples)
+        state = {
+            "period": self.period,
+            "samples": samples,
+            "last_seen": {url: seen for url, seen in self._last_seen.items() if seen[1] >= cutoff},
+        }
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError as e:
+            logger.warning(f"Could not save cache phase to {path}: {e}")
+
+    @classmethod
+    def load(cls, path: str = CACHE_PHASE_FILE, wall: Callable[[], float] = time.time) -> "CachePhaseEstimator":
+        estimator = cls(wall=wall)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return estimator
+        if state.get("period") != estimator.period:
+            return estimator
+        estimator.samples.extend(state.get("samples", []))
+        estimator._last_seen = {url: tuple(seen) for url, seen in state.get("last_seen", {}).items()}
+        return estimator
+
+
+class PhaseProbe:
+    """Brackets cache refreshes with pairs of closely spaced polls, in a background thread."""
+
+    def __init__(self, estimator: CachePhaseEstimator, fetch: Callable[[str], Any], prefix: str = "",
+                 gap: float = PHASE_PROBE_GAP_SECONDS, every: int = PHASE_PROBE_EVERY,
+                 wall: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep,
+                 rng: Optional[random.Random] = None):
+        """
+        Args:
+            estimator: Estimator to feed; also supplies the URL to poll (probe_url)
+            fetch: Returns the decoded payload of a URL, None on failure
+            prefix: Only probe URLs starting with this (e.g. the event endpoint)
+            gap: Seconds between the two polls of a pair
+            every: Periods between pairs once the phase is known (one per period before)
+        """
+        self.estimator = estimator
+        self.fetch = fetch
+        self.prefix = prefix
+        self.gap = gap
+        self.every = every
+        self._wall = wall
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self.pairs = 0
+        self.hits = 0
+
+    def probe_once(self) -> bool:
+        """Poll one URL twice, `gap` apart, from a random point in the period; True if a refresh fell between."""
+        url = self.estimator.probe_url(self.prefix)
+        if url is None:
+            return False
+        self._sleep(self._rng.uniform(0, self.estimator.period))
+        started = self._wall()
+        first = self.fetch(url)
+        self._sleep(self.gap)
+        second = self.fetch(url)
+        finished = self._wall()
+        if first is None or second is None:
+            return False
+        self.pairs += 1
+        if first == second:
+            return False
+        # the pair starts at a random offset, so its midpoint is an unbiased sample within gap/2 of the refresh
+        self.hits += 1
+        self.estimator.add_refresh((started + finished) / 2)
+        return True
+
+    def run(self):
+        period = self.estimator.period
+        while True:
+            cycle_start = self._wall()
+            phase, _ = self.estimator.estimate()
+            try:
+                self.probe_once()
+            except Exception as e:
+                logger.warning(f"Cache phase probe failed: {e}")
+            cycle = period if phase is None else period * self.every
+            self._sleep(max(0.0, cycle_start + cycle - self._wall()))
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run, name="cache-phase-probe", daemon=True)
+        thread.start()
+        return thread
+
+
+class AlignedTicker:
+    """Waits until just after each estimated cache refresh, without accumulating drift."""
+
+    def __init__(self, estimator: CachePhaseEstimator, offset: float = POLL_OFFSET_SECONDS,
+                 wall: Callable[[], float] = time.time, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.estimator = estimator
+        self.offset = offset
+        self._wall = wall
+        self._clock = clock
+        self._sleep = sleep
+        self.ticks = 0
+        self.skipped = 0
+        self._last_target: Optional[float] = None
+
+
+    def next_target(self, now: float) -> float:
+        """Next wall-clock time of the form phase + offset + k * period after `now`."""
+        period = self.estimator.period
+        base = self.estimator.phase() + self.offset
+        return base + (math.floor((now - base) / period) + 1) * period
+
+    def wait(self) -> float:
+        """Sleep until the next target and return how late the wake-up was (seconds)."""
+        now = self._wall()
+        target = self.next_target(now)
+        if self._last_target is not None:
+            # a tick that overran its period makes us skip the boundaries it covered
+            self.skipped += max(0, round((target - self._last_target) / self.estimator.period) - 1)
+        self._last_target = target
+
+        # wait on the monotonic clock; wall-clock steps (NTP) only move the next target
+        wake_at = self._clock() + (target - now)
+        while True:
+            remaining = wake_at - self._clock()
+            if remaining <= 0:
+                break
+            self._sleep(min(remaining, 1.0))
+        self.ticks += 1
+        return self._wall() - target
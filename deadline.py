@@ -0,0 +1,65 @@
+"""Per-tick deadline shared by the odds, results and schedule paths.
+
+Each main.py tick has a fixed budget (the cron cadence is 10 seconds). Requests
+take the remaining budget as their timeout, and work that cannot finish before
+the deadline is deferred to the next tick instead of being started, so one slow
+tick never overlaps the next launch.
+"""
+import time
+import logging
+from collections import Counter
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_ESTIMATE = 1.0  # seconds a single API request is expected to take
+
+
+class Deadline:
+    """A monotonic deadline with per-path counters of deferred work."""
+
+    def __init__(self, budget_seconds: float, reserve_seconds: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            budget_seconds: Total time available from now
+            reserve_seconds: Tail of the budget kept back for writes and cleanup;
+                new work is not started inside it
+            clock: Monotonic clock, injectable for tests and replay
+        """
+        self.budget = budget_seconds
+        self.reserve = reserve_seconds
+        self._clock = clock
+        self._expires_at = clock() + budget_seconds
+        self.deferred = Counter()
+        self.started = Counter()
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - self._clock())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for the next request: the remaining budget, at most `cap`."""
+        return min(cap, self.remaining())
+
+    def can_start(self, path: str, estimate: float = DEFAULT_REQUEST_ESTIMATE) -> bool:
+        """Whether `estimate` seconds of work on `path` fits before the reserve.
+
+        Counts the outcome so truncation rates can be reported per path.
+        """
+        if self.remaining() - self.reserve < estimate:
+            self.deferred[path] += 1
+            return False
+        self.started[path] += 1
+        return True
+
+    @property
+    def truncated(self) -> bool:
+        return sum(self.deferred.values()) > 0
+
+    def summary(self) -> str:
+        paths = sorted(set(self.deferred) | set(self.started))
+        counts = " ".join(f"{p}={self.started[p]}/{self.deferred[p]}" for p in paths) or "none"
+        return f"Deadline: {self.remaining():.2f}s left of {self.budget:.1f}s | started/deferred {counts} | truncated {self.truncated}"
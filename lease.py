@@ -0,0 +1,119 @@
+"""Single-writer leases stored in MongoDB.
+
+A scraper tick takes the scraper lease before reading any race documents, so
+an overrunning tick and the next cron launch never both run
+read -> mutate -> write on the same races (a tick spans neighbouring days). Leases expire on their
+own (ttl), so a crashed tick does not block the ones after it.
+
+Lease documents live in the `tab_control` database:
+  {_id: lease name, owner, acquired_at, expires_at}
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CONTROL_DATABASE = "tab_control"
+LEASE_COLLECTION = "leases"
+LEASE_POLL_SECONDS = 0.2
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def default_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class MongoLease:
+    """A named, expiring lease held by at most one owner at a time."""
+
+    def __init__(self, client, name: str, ttl_seconds: float, owner: Optional[str] = None,
+                 database: str = CONTROL_DATABASE, now: Callable[[], datetime] = utc_now):
+        """
+        Args:
+            client: Connected MongoClient
+            name: Lease name, e.g. scraper:_20260520
+            ttl_seconds: How long the lease holds without renew()
+            owner: Owner id, unique per process by default
+            now: Clock for lease expiry (all writers share the host clock)
+        """
+        self.collection = client[database][LEASE_COLLECTION]
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner = owner or default_owner()
+        self._now = now
+        self.held = False
+        self.wait_seconds = 0.0
+        self.attempts = 0
+
+    def try_acquire(self) -> bool:
+        """One attempt: take the lease if it is free, expired or already ours."""
+        self.attempts += 1
+        now = self._now()
+        try:
+            self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "acquired_at": now, "expires_at": now + self.ttl}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # lease exists and is held by someone else: the upsert collided with it
+            return False
+        except PyMongoError as e:
+            logger.warning(f"Lease {self.name}: acquire failed: {e}")
+            return False
+        self.held = True
+        return True
+
+    def acquire(self, wait_seconds: float = 0.0) -> bool:
+        """Take the lease, polling for up to `wait_seconds` while another owner holds it."""
+        start = time.monotonic()
+        while True:
+            if self.try_acquire():
+                break
+            if time.monotonic() - start + LEASE_POLL_SECONDS > wait_seconds:
+                break
+            time.sleep(LEASE_POLL_SECONDS)
+        self.wait_seconds = time.monotonic() - start
+        return self.held
+
+    def renew(self) -> bool:
+        """Extend a held lease by its ttl. False if it expired and was taken over."""
+        now = self._now()
+        try:
+            result = self.collection.update_one(
+                {"_id": self.name, "owner": self.owner},
+                {"$set": {"expires_at": now + self.ttl}},
+            )
+        except PyMongoError as e:
+            logger.warning(f"Lease {self.name}: renew failed: {e}")
+            return False
+        self.held = result.matched_count == 1
+        return self.held
+
+    def release(self):
+        if not self.held:
+            return
+        try:
+            self.collection.delete_one({"_id": self.name, "owner": self.owner})
+        except PyMongoError as e:
+            logger.warning(f"Lease {self.name}: release failed (expires on its own): {e}")
+        self.held = False
+
+    def holder(self) -> Optional[str]:
+        doc = self.collection.find_one({"_id": self.name})
+        if doc is None or doc.get("expires_at") is None or doc["expires_at"] < self._now():
+            return None
+        return doc.get("owner")
+
+    def summary(self) -> str:
+        state = "held" if self.held else "not acquired"
+        return f"Lease {self.name}: {state} after {self.wait_seconds * 1000:.0f}ms wait ({self.attempts} attempts)"
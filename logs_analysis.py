@@ -47,6 +47,44 @@ def extract_execution_times(log_file_path):
     
     return result
 
+def extract_deadline_truncations(log_file_path):
+    """
+    Count how often the per-tick deadline truncated work.
+
+    Args:
+        log_file_path (str): Path to the log file
+
+    Returns:
+        dict: Tick count, truncated tick count and deferred work per path
+    """
+    summary_pattern = re.compile(r'Deadline: .*\| started/deferred (.*) \| truncated (True|False)')
+    path_pattern = re.compile(r'(\w+)=(\d+)/(\d+)')
+
+    ticks = 0
+    truncated = 0
+    deferred = {}
+    try:
+        with open(log_file_path, 'r') as file:
+            for line in file:
+                match = summary_pattern.search(line)
+                if not match:
+                    continue
+                ticks += 1
+                if match.group(2) == 'True':
+                    truncated += 1
+                for path, _, count in path_pattern.findall(match.group(1)):
+                    deferred[path] = deferred.get(path, 0) + int(count)
+    except FileNotFoundError:
+        print(f"Error: File {log_file_path} not found.")
+        return None
+
+    return {
+        'ticks': ticks,
+        'truncated_ticks': truncated,
+        'truncated_percent': truncated / ticks * 100 if ticks else 0,
+        'deferred': deferred,
+    }
+
 # Example usage
 def main():
     log_file_path = 'logs.txt'
@@ -67,5 +105,13 @@ def main():
         print(f"Average time: {results['average']:.4f} seconds")
         print(f"Median time: {results['median']:.4f} seconds")
 
+    truncations = extract_deadline_truncations(log_file_path)
+    if truncations:
+        print("Deadline Truncation Analysis:")
+        print(f"Ticks: {truncations['ticks']}")
+        print(f"Truncated ticks: {truncations['truncated_ticks']} ({truncations['truncated_percent']:.1f}%)")
+        for path, count in sorted(truncations['deferred'].items()):
+            print(f"Deferred {path}: {count}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -14,11 +14,22 @@ Author: k.hitchcock (enhanced by Claude)
 """
 import gc
 import time
+import argparse
 import psutil
 import logging
 import time as timer
 from datetime import datetime, timedelta, timezone
-from typing import Dict, Optional, List, Any
+from functools import partial
+from typing import Callable, Dict, Optional, List, Any, Tuple
+from cache_phase import AlignedTicker, CachePhaseEstimator, PhaseProbe
+from deadline import Deadline
+from lease import CONTROL_DATABASE, MongoLease
+from race_index import DAYS_COLLECTION, index_races
+from sharding import SHARDING_ENABLED, ShardCoordinator
+from spool import Spool, SpoolingWriter
+from race_pipeline import FETCH_WORKERS, RacePipeline
+from raw_archive import ARCHIVE_ENABLED, RawArchive
+from request_scheduler import Priority, RequestScheduler, ScheduledRequest
 from tab_data_extractor import TabDataExtractor
 from mongodb_handler import MongoDBHandler
 
@@ -26,11 +37,24 @@ DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 DATE_FORMAT = '%Y-%m-%d'
 
 
-def now_utc() -> datetime:
+def system_utc() -> datetime:
     """Naive UTC datetime — keeps comparisons consistent regardless of container TZ."""
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
+_clock: Callable[[], datetime] = system_utc
+
+
+def set_clock(clock: Optional[Callable[[], datetime]] = None):
+    """Swap the clock behind now_utc() (e.g. a fake clock for benchmarks or replay). None restores it."""
+    global _clock
+    _clock = clock or system_utc
+
+
+def now_utc() -> datetime:
+    return _clock()
+
+
 def today_utc_str() -> str:
     return now_utc().strftime(DATE_FORMAT)
 
@@ -39,6 +63,41 @@ MEMORY_WARNING_THRESHOLD = 300  # 300MB - start warning
 MEMORY_CRITICAL_THRESHOLD = 400  # 400MB - skip non-essential operations
 MEMORY_EMERGENCY_THRESHOLD = 450  # 450MB - force cleanup and skip cycle
 
+# Tick budget - cron launches a tick every 10 seconds
+TICK_BUDGET_SECONDS = 9.0
+TICK_WRITE_RESERVE_SECONDS = 1.5  # kept back for Mongo writes and cleanup
+LOOP_TICK_MARGIN_SECONDS = 2.0  # --loop: tick budget is the cache period minus this
+LEASE_SLACK_SECONDS = 5.0  # lease ttl is the tick budget plus this
+LEASE_WAIT_SECONDS = 1.0  # how long a tick waits for an overrunning one before skipping
+MONGO_TIMEOUT_MS = 3000  # fail over to the spool instead of stalling the tick
+SCHEDULE_CACHE_MAX_AGE = timedelta(minutes=10)  # schedule re-pulled this often while Mongo is down
+SCHEDULE_REFRESH_INTERVAL = timedelta(hours=1)  # today's and tomorrow's schedules re-pulled for new races
+SCHEDULE_DAYS_AHEAD = 1  # tomorrow's races are stored before its first tick
+
+# Results polling, relative to each race's start time
+RESULTS_FIRST_POLL_DELAY = timedelta(minutes=2)
+RESULTS_BACKOFF_BASE_SECONDS = 60
+RESULTS_BACKOFF_MAX_SECONDS = 30 * 60
+RESULTS_GIVE_UP = timedelta(hours=12)
+RESULTS_READ_WINDOW = RESULTS_GIVE_UP + timedelta(hours=1)  # ticks read races this far back, so they can be retired
+
+# Odds sampling window, relative to each race's advertised start time
+ODDS_WINDOW_BEFORE = timedelta(minutes=5)
+ODDS_WINDOW_AFTER = timedelta(minutes=5)  # only used until the event reports a status
+ODDS_MAX_DELAY = timedelta(minutes=30)  # keep following an open race this far past its start
+IMMINENT_ODDS_WINDOW = timedelta(seconds=60)  # odds fetched ahead of everything else this close to the jump
+HEDGE_WINDOW = timedelta(seconds=30)  # odds fetches this close to the jump send a hedge request when slow
+
+EVENT_STATUSES = {
+    "open": "open",
+    "closed": "closed",
+    "interim": "interim",
+    "final": "final",
+    "paying": "final",
+    "resulted": "final",
+    "abandoned": "abandoned",
+}
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -106,114 +165,336 @@ def iso_utc_to_str(iso_str: str) -> str:
     return dt.astimezone(timezone.utc).replace(tzinfo=None).strftime(DATETIME_FORMAT)
 
 
-def update_odds_data_local(data_extractor: TabDataExtractor, formatted_data: Dict[str, Any]) -> tuple:
-    """For each race within ±5min of start time, fetch event endpoint and append odds snapshot."""
-    now = now_utc()
-    timestamp = now.strftime(DATETIME_FORMAT)
-    need_update_schedule = False
+def event_status(event: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Normalised race status (open/closed/interim/final/abandoned) from an event payload."""
+    if not event:
+        return None
+    race_info = event.get("race") or {}
+    raw = race_info.get("status") or event.get("status")
+    if not raw:
+        return None
+    return EVENT_STATUSES.get(str(raw).strip().lower())
 
-    for _id, race in formatted_data.items():
-        norm_time = race.get("norm_time")
-        if not norm_time:
-            continue
+
+def in_odds_window(race: Dict[str, Any], race_time: datetime, now: datetime) -> bool:
+    """Whether a race should be sampled for odds at `now`.
+
+    Sampling starts ODDS_WINDOW_BEFORE the advertised start. While the event
+    reports itself open it keeps going past the start (delayed jumps) up to
+    ODDS_MAX_DELAY; once betting closes it stops. Races with no status yet
+    fall back to the fixed ODDS_WINDOW_AFTER.
+    """
+    if race.get("odds_closed") or now < race_time - ODDS_WINDOW_BEFORE:
+        return False
+    if race.get("status") == "open":
+        return now <= race_time + ODDS_MAX_DELAY
+    return now <= race_time + ODDS_WINDOW_AFTER
+
+
+def apply_event_status(race: Dict[str, Any], event: Dict[str, Any], now: datetime):
+    """Record the event's status and follow any change to its advertised start time."""
+    status = event_status(event)
+    if status:
+        if status != race.get("status"):
+            logger.info(f"Race {race.get('_id')} status: {race.get('status')} -> {status}")
+        race["status"] = status
+        if status != "open":
+            race["odds_closed"] = True
+            race.setdefault("odds_closed_at", now.strftime(DATETIME_FORMAT))
+
+    start_iso = (event.get("race") or {}).get("start_time") or event.get("start_time")
+    if start_iso:
         try:
-            race_time = datetime.strptime(norm_time, DATETIME_FORMAT)
+            norm_time = iso_utc_to_str(start_iso)
         except (TypeError, ValueError):
-            continue
+            return
+        if norm_time != race.get("norm_time"):
+            logger.info(f"Race {race.get('_id')} start moved: {race.get('norm_time')} -> {norm_time}")
+            race["norm_time"] = norm_time
+
+
+def race_start(race: Dict[str, Any]) -> Optional[datetime]:
+    norm_time = race.get("norm_time")
+    if not norm_time:
+        return None
+    try:
+        return datetime.strptime(norm_time, DATETIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def select_odds_races(formatted_data: Dict[str, Any], now: datetime) -> List[str]:
+    """Ids of races currently in their odds window (see in_odds_window)."""
+    selected = []
+    for _id, race in formatted_data.items():
+        race_time = race_start(race)
+        if race_time is not None and in_odds_window(race, race_time, now):
+            selected.append(_id)
+    return selected
+
+
+def should_hedge(race: Dict[str, Any], now: datetime) -> bool:
+    """Hedge the last snapshots before the jump, which are the most valuable."""
+    race_time = race_start(race)
+    return race_time is not None and race_time - now <= HEDGE_WINDOW
 
-        if now < race_time - timedelta(minutes=5) or now > race_time + timedelta(minutes=5):
+
+def odds_priority(race: Dict[str, Any], now: datetime) -> Priority:
+    """Races within IMMINENT_ODDS_WINDOW of the jump (or past it) get the most urgent class."""
+    race_time = race_start(race)
+    if race_time is not None and race_time - now <= IMMINENT_ODDS_WINDOW:
+        return Priority.IMMINENT_ODDS
+    return Priority.ODDS
+
+
+def apply_odds_event(race: Dict[str, Any], event: Dict[str, Any], now: datetime):
+    """Record the event status and append an odds snapshot for every unscratched runner."""
+    apply_event_status(race, event, now)
+    if race.get("odds_closed"):
+        # betting has closed, the previous snapshot was the last before the jump
+        return
+    add_odds_snapshot(race, event, now.strftime(DATETIME_FORMAT))
+
+
+def new_entry(runner: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored entry for an event runner, before any odds or results."""
+    return {
+        "runner_number": runner.get("runner_number"),
+        "name": runner.get("name"),
+        "is_scratched": runner.get("is_scratched", False),
+        "barrier": runner.get("barrier"),
+        "jockey": runner.get("jockey"),
+        "trainer_name": runner.get("trainer_name"),
+        "weight": runner.get("weight"),
+        "results_plc": False,
+        "odds": {},
+    }
+
+
+def add_odds_snapshot(race: Dict[str, Any], event: Dict[str, Any], timestamp: str, only_new: bool = False):
+    """Store the event's odds under `timestamp` for every unscratched runner, adding runners as needed.
+
+    With `only_new`, runners that already have snapshots are left alone.
+    """
+    entries = race.setdefault("entries", {})
+    for runner in event.get("runners") or []:
+        num_int = runner.get("runner_number")
+        if num_int is None:
             continue
+        num = str(num_int)
 
-        logger.info(f"Updating race: {_id}")
-        event = data_extractor.get_event_data(_id)
-        if event is None:
+        entry = entries.get(num)
+        if entry is None:
+            entry = entries[num] = new_entry(runner)
+
+        if entry.get("is_scratched") or entry.get("scratched") or (only_new and entry.get("odds")):
             continue
 
-        entries = race.setdefault("entries", {})
-        for runner in event.get("runners") or []:
-            num_int = runner.get("runner_number")
-            if num_int is None:
-                continue
-            num = str(num_int)
-
-            entry = entries.get(num)
-            if entry is None:
-                entry = {
-                    "runner_number": num_int,
-                    "name": runner.get("name"),
-                    "is_scratched": runner.get("is_scratched", False),
-                    "barrier": runner.get("barrier"),
-                    "jockey": runner.get("jockey"),
-                    "trainer_name": runner.get("trainer_name"),
-                    "weight": runner.get("weight"),
-                    "results_plc": False,
-                    "odds": {},
-                }
-                entries[num] = entry
-
-            if entry.get("is_scratched") or entry.get("scratched"):
-                continue
+        entry.setdefault("odds", {})[timestamp] = {
+            "fixed_win": runner.get("odds", {}).get("fixed_win"),
+            "fixed_place": runner.get("odds", {}).get("fixed_place"),
+        }
 
-            entry["odds"][timestamp] = {
-                "fixed_win": runner.get("odds", {}).get("fixed_win"),
-                "fixed_place": runner.get("odds", {}).get("fixed_place"),
-            }
 
-    return formatted_data, need_update_schedule
+def results_backoff(attempts: int) -> timedelta:
+    """Exponential delay before the next results poll after `attempts` misses."""
+    seconds = RESULTS_BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, RESULTS_BACKOFF_MAX_SECONDS))
 
 
-def update_results_data_local(data_extractor: TabDataExtractor, formatted_data: Dict[str, Any]) -> Dict[str, Any]:
-    """For each race past start time without results, fetch event and persist data.results[]."""
-    now = now_utc()
+def select_results_races(formatted_data: Dict[str, Any], now: datetime) -> tuple:
+    """Races due a results poll at `now`.
 
+    A race is first due RESULTS_FIRST_POLL_DELAY after start, then whenever its
+    results_next_poll passes. Races still without results after RESULTS_GIVE_UP
+    are retired here with results_abandoned.
+    Returns (due ids, ids retired).
+    """
+    due = []
+    retired = set()
     for _id, race in formatted_data.items():
-        if race.get("got_results"):
+        if race.get("got_results") or race.get("results_abandoned"):
             continue
 
-        norm_time = race.get("norm_time")
-        if not norm_time:
-            continue
-        try:
-            race_time = datetime.strptime(norm_time, DATETIME_FORMAT)
-        except (TypeError, ValueError):
+        race_time = race_start(race)
+        if race_time is None or now < race_time + RESULTS_FIRST_POLL_DELAY:
             continue
 
-        if now < race_time:
+        next_poll = race.get("results_next_poll")
+        if next_poll and now < datetime.strptime(next_poll, DATETIME_FORMAT):
             continue
 
-        event = data_extractor.get_event_data(_id)
-        if event is None:
+        if now > race_time + RESULTS_GIVE_UP:
+            logger.warning(f"Giving up on results for race: {_id}")
+            race["results_abandoned"] = True
+            retired.add(_id)
             continue
 
-        results = event.get("results") or []
-        if not results:
+        due.append(_id)
+    return due, retired
+
+
+def apply_results_event(race: Dict[str, Any], event: Optional[Dict[str, Any]], now: datetime):
+    """Apply one results poll: store final results, or schedule the next poll with backoff."""
+    attempts = race.get("results_attempts", 0) + 1
+    race["results_attempts"] = attempts
+
+    if event is not None:
+        apply_event_status(race, event, now)
+    status = race.get("status")
+    if status == "abandoned":
+        logger.info(f"Race {race.get('_id')} abandoned, no results to poll")
+        race["results_abandoned"] = True
+        return
+
+    # interim results can still change, keep polling until final
+    results = (event or {}).get("results") or []
+    if not results or status == "interim":
+        race["results_next_poll"] = (now + results_backoff(attempts)).strftime(DATETIME_FORMAT)
+        return
+
+    apply_results(race, results)
+    logger.info(f"Results for race {race.get('_id')} after {attempts} polls")
+
+
+def apply_results(race: Dict[str, Any], results: List[Dict[str, Any]]):
+    """Store final placings on the race's entries and mark it got_results."""
+    entries = race.setdefault("entries", {})
+    for placed in results:
+        num_int = placed.get("runner_number")
+        if num_int is None:
             continue
+        num = str(num_int)
+
+        entry = entries.get(num)
+        if entry is None:
+            entry = {
+                "runner_number": num_int,
+                "name": placed.get("name"),
+                "is_scratched": False,
+                "results_plc": False,
+                "odds": {},
+            }
+            entries[num] = entry
 
-        entries = race.setdefault("entries", {})
-        for placed in results:
-            num_int = placed.get("runner_number")
-            if num_int is None:
-                continue
-            num = str(num_int)
+        entry["results_rank"] = placed.get("position")
+        entry["results_margin"] = placed.get("margin_length")
+        entry["results_plc"] = True
 
-            entry = entries.get(num)
-            if entry is None:
-                entry = {
-                    "runner_number": num_int,
-                    "name": placed.get("name"),
-                    "is_scratched": False,
-                    "results_plc": False,
-                    "odds": {},
-                }
-                entries[num] = entry
+    race["got_results"] = True
+    race.pop("results_next_poll", None)
 
-            entry["results_rank"] = placed.get("position")
-            entry["results_margin"] = placed.get("margin_length")
-            entry["results_plc"] = True
 
-        race["got_results"] = True
+def race_snapshot(race: Dict[str, Any]) -> Dict[str, Any]:
+    """Cheap before-image of a race for race_update_ops: top-level fields, entry fields and odds timestamps."""
+    return {
+        "fields": {k: v for k, v in race.items() if k not in ("_id", "entries")},
+        "entries": {
+            num: ({k: v for k, v in entry.items() if k != "odds"}, set(entry.get("odds") or {}))
+            for num, entry in (race.get("entries") or {}).items()
+        },
+    }
 
-    return formatted_data
+
+def race_update_ops(race: Dict[str, Any], snapshot: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Targeted update turning the snapshotted race into `race`, None if nothing changed.
+
+    Only changed fields and new odds snapshots are $set, and fields dropped from
+    the race or one of its entries are $unset, so concurrent writers of other
+    snapshots or races cannot overwrite each other.
+    """
+    set_ops = {}
+    fields = snapshot["fields"]
+    for key, value in race.items():
+        if key in ("_id", "entries", "_version"):
+            continue
+        if key not in fields or fields[key] != value:
+            set_ops[key] = value
+    unset_ops = {key: "" for key in fields if key not in race and key != "_version"}
+
+    before_entries = snapshot["entries"]
+    for num, entry in (race.get("entries") or {}).items():
+        if num not in before_entries:
+            set_ops[f"entries.{num}"] = entry
+            continue
+        before_fields, before_odds = before_entries[num]
+        for key, value in entry.items():
+            if key != "odds" and (key not in before_fields or before_fields[key] != value):
+                set_ops[f"entries.{num}.{key}"] = value
+        for key in before_fields.keys() - entry.keys():
+            # e.g. results_rank of a placing lost on protest (reconcile.reconcile_race)
+            unset_ops[f"entries.{num}.{key}"] = ""
+        odds = entry.get("odds") or {}
+        for timestamp in odds.keys() - before_odds:
+            set_ops[f"entries.{num}.odds.{timestamp}"] = odds[timestamp]
+
+    if not set_ops and not unset_ops:
+        return None
+    update = {"$set": set_ops, "$inc": {"_version": 1}}
+    if unset_ops:
+        update["$unset"] = unset_ops
+    return update
+
+
+def versioned_update(_id: str, race: Dict[str, Any], update: Optional[Dict[str, Any]]) -> Tuple:
+    """(id, update, _version read) for MongoDBHandler.bulk_update's compare-and-set.
+
+    The local _version moves on with the update, so a second update of the race
+    in the same tick expects the version the first one wrote.
+    """
+    seen = race.get("_version", 0)
+    if update:
+        race["_version"] = seen + 1
+    return _id, update, seen
+
+
+def update_race_data_local(request_scheduler: RequestScheduler, data_extractor: TabDataExtractor,
+                           formatted_data: Dict[str, Any], write_batch=None,
+                           fetch_workers: int = FETCH_WORKERS, results: bool = True) -> RacePipeline:
+    """One tick of odds and results through the priority request scheduler and the update pipeline.
+
+    Imminent odds are fetched first, then other odds, then results; whatever
+    the scheduler sheds is picked up again next tick. Each fetched event is
+    applied to `formatted_data` and, given `write_batch` (e.g.
+    MongoDBHandler.bulk_update), written as a targeted update in batches.
+    With `results` off only odds are polled.
+    Returns the pipeline, whose `changed` holds the ids of races that changed.
+    """
+    now = now_utc()
+    kinds = {}
+
+    for _id in select_odds_races(formatted_data, now):
+        request = request_scheduler.submit(
+            odds_priority(formatted_data[_id], now),
+            data_extractor.get_event_data, _id, should_hedge(formatted_data[_id], now),
+        )
+        kinds[request.seq] = ("odds", _id)
+    due, retired = select_results_races(formatted_data, now) if results else ([], [])
+    for _id in due:
+        request = request_scheduler.submit(Priority.RESULTS, data_extractor.get_event_data, _id)
+        kinds[request.seq] = ("results", _id)
+
+    def transform(request):
+        if request.seq not in kinds:
+            return None  # queued by someone else on the tick's scheduler, e.g. a schedule fetch
+        kind, _id = kinds[request.seq]
+        race = formatted_data[_id]
+        if kind == "odds" and request.result is None:
+            return None
+        snapshot = race_snapshot(race)
+        if kind == "odds":
+            apply_odds_event(race, request.result, now)
+        else:
+            apply_results_event(race, request.result, now)
+        return versioned_update(_id, race, race_update_ops(race, snapshot))
+
+    pipeline = RacePipeline(transform, write_batch)
+    retirements = [
+        versioned_update(_id, formatted_data[_id], {"$set": {"results_abandoned": True}, "$inc": {"_version": 1}})
+        for _id in retired
+    ]
+    pipeline.run(request_scheduler, fetch_workers, updates=retirements)
+    return pipeline
 
 
 def reformat_collection_format(documents: List[Dict[str, Any]]):
@@ -224,39 +505,122 @@ def reformat_collection_format(documents: List[Dict[str, Any]]):
         return None
 
 
-def extract_and_update_results(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, collection_name: str):
-    mongodb.set_collection(collection_name)
-    existing_data = mongodb.get_all_documents()
-    formatted_data = reformat_collection_format(existing_data)
-    if not formatted_data:
-        return
+def read_owned_races(mongodb: MongoDBHandler, coordinator: Optional[ShardCoordinator],
+                     query: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """The collection's races matching `query`, or with sharding only those of meetings this worker owns."""
+    conditions = [query] if query else []
+    if coordinator is not None:
+        meeting_codes = mongodb.get_distinct("meeting_code")
+        owned = coordinator.owned_meetings(meeting_codes)
+        logger.info(coordinator.summary(len(owned), len(meeting_codes)))
+        if not owned:
+            return []
+        conditions.append({"meeting_code": {"$in": owned}})
+    if not conditions:
+        return mongodb.get_all_documents()
+    return mongodb.find_documents(conditions[0] if len(conditions) == 1 else {"$and": conditions})
+
 
-    updated_data = update_results_data_local(data_extractor, formatted_data)
+def active_window_query(now: datetime) -> Dict[str, Any]:
+    """Races a tick can act on at `now`: near their odds window, or still owed results.
 
-    for _id, data in updated_data.items():
-        mongodb.replace_document(_id, data)
+    norm_time is a sortable "%Y-%m-%d %H:%M:%S" string, so the window is a range scan on its index.
+    """
+    odds_from = (now - ODDS_MAX_DELAY).strftime(DATETIME_FORMAT)
+    return {"$or": [
+        {"norm_time": {"$gte": odds_from, "$lte": (now + ODDS_WINDOW_BEFORE).strftime(DATETIME_FORMAT)}},
+        {
+            "norm_time": {"$gte": (now - RESULTS_READ_WINDOW).strftime(DATETIME_FORMAT), "$lt": odds_from},
+            "got_results": {"$ne": True},
+            "results_abandoned": {"$ne": True},
+        },
+    ]}
+
+
+def active_collections(mongodb: MongoDBHandler, now: datetime) -> List[str]:
+    """Day collections that can hold races running around `now`: yesterday's, today's and tomorrow's."""
+    existing = set(mongodb.get_all_collections())
+    names = [convert_date_to_collection_format((now + timedelta(days=offset)).strftime(DATE_FORMAT))
+             for offset in (-1, 0, 1)]
+    return [name for name in names if name in existing]
+
+
+def read_active_races(mongodb: MongoDBHandler, now: datetime,
+                      coordinator: Optional[ShardCoordinator] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """(races a tick at `now` can act on, the collection of each), across neighbouring day collections."""
+    formatted_data: Dict[str, Any] = {}
+    collection_of: Dict[str, str] = {}
+    query = active_window_query(now)
+    for collection_name in active_collections(mongodb, now):
+        mongodb.set_collection(collection_name)
+        for _id, race in (reformat_collection_format(read_owned_races(mongodb, coordinator, query)) or {}).items():
+            formatted_data[_id] = race
+            collection_of[_id] = collection_name
+    return formatted_data, collection_of
 
 
-def extract_and_update_odds(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, collection_name: str) -> bool:
-    mongodb.set_collection(collection_name)
-    existing_data = mongodb.get_all_documents()
-    formatted_data = reformat_collection_format(existing_data)
+def routed_writer(collection_of: Dict[str, str], writer_for: Callable[[str], Callable]) -> Callable:
+    """Pipeline write_batch that splits each batch by the collection of its races.
+
+    `writer_for(collection)` makes the write_batch for one collection; each is made once and reused.
+    """
+    writers: Dict[str, Callable] = {}
+
+    def write_batch(updates):
+        by_collection: Dict[str, list] = {}
+        for update in updates:
+            by_collection.setdefault(collection_of[update[0]], []).append(update)
+        written = 0
+        for collection_name, batch in by_collection.items():
+            if collection_name not in writers:
+                writers[collection_name] = writer_for(collection_name)
+            written += writers[collection_name](batch) or 0
+        return written
+
+    return write_batch
+
+
+def extract_and_update_races(mongodb: MongoDBHandler, data_extractor: TabDataExtractor,
+                             request_scheduler: RequestScheduler,
+                             coordinator: Optional[ShardCoordinator] = None,
+                             writer_for: Optional[Callable[[str], Callable]] = None) -> Optional[RacePipeline]:
+    """Read the races around now once, update odds and results, and write back only what changed.
+
+    Races come from yesterday's, today's and tomorrow's collections, limited to the tick's time window
+    (active_window_query), and each is written back to its own collection.
+    With a shard `coordinator`, only races of meetings this worker owns are touched.
+    `writer_for(collection)` gives the write_batch of a collection, by default mongodb.bulk_update on it.
+    Returns the tick's pipeline (for its report), None if there was nothing to update.
+    """
+    formatted_data, collection_of = read_active_races(mongodb, now_utc(), coordinator)
     if not formatted_data:
-        return False
+        return None
+
+    writer_for = writer_for or (lambda collection_name: partial(mongodb.bulk_update, collection_name=collection_name))
+    return update_race_data_local(request_scheduler, data_extractor, formatted_data,
+                                  routed_writer(collection_of, writer_for))
 
-    updated_data, need_update_schedule = update_odds_data_local(data_extractor, formatted_data)
 
-    for _id, data in updated_data.items():
-        mongodb.replace_document(_id, data)
+def meeting_date(meeting: Dict[str, Any], date: Optional[str] = None) -> str:
+    """Racing day of a meeting: the date the schedule gives it, else the date the schedule was pulled for."""
+    value = meeting.get("date")
+    if isinstance(value, str) and len(value) >= 10:
+        return value[:10]
+    return date or today_utc_str()
 
-    return need_update_schedule
 
+def race_collection(race: Dict[str, Any]) -> str:
+    """Day collection a race is stored in: its meeting's racing day, even for races after midnight UTC."""
+    return convert_date_to_collection_format(race.get("meeting_date") or today_utc_str())
 
-def extract_schedule_data(schedule_data: Dict[str, Any]) -> Dict[str, Any]:
+
+def extract_schedule_data(schedule_data: Dict[str, Any], date: Optional[str] = None) -> Dict[str, Any]:
+    """Race documents of a schedule, each with its meeting's racing day (`date` if the schedule has none)."""
     formatted_data: Dict[str, Any] = {}
     meetings = (schedule_data or {}).get("meetings") or []
 
     for idx, meeting in enumerate(meetings, start=1):
+        racing_day = meeting_date(meeting, date)
         for race in meeting.get("races") or []:
             race_id = race.get("id")
             if not race_id:
@@ -273,6 +637,7 @@ def extract_schedule_data(schedule_data: Dict[str, Any]) -> Dict[str, Any]:
                 "meeting_name": meeting.get("name"),
                 "meeting_number": idx,
                 "meeting_code": meeting.get("meeting"),
+                "meeting_date": racing_day,
                 "race_name": race.get("name"),
                 "norm_time": norm_time,
                 "race_number": race.get("race_number"),
@@ -287,34 +652,138 @@ def extract_schedule_data(schedule_data: Dict[str, Any]) -> Dict[str, Any]:
     return formatted_data
 
 
-def update_schedule_missing_races(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, collection_name: str):
-    schedule_data = data_extractor.get_schedule_data()
-    formatted_data = extract_schedule_data(schedule_data)
+def load_schedule(mongodb: MongoDBHandler, schedule_data: Dict[str, Any], date: str) -> Optional[int]:
+    """Store the races of `date`'s fetched schedule that Mongo does not have yet.
 
-    mongodb.set_collection(collection_name)
-    existing = mongodb.get_all_documents()
-    existing_map = reformat_collection_format(existing) or {}
+    Each race goes to its meeting day's collection ($setOnInsert upserts, one bulk write per collection),
+    so stored races are left alone and this can be repeated to pick up added races.
+    Returns the number of races in the schedule, None if it could not be stored.
+    """
+    formatted_data = extract_schedule_data(schedule_data, date)
 
-    for _id, data in formatted_data.items():
-        if _id not in existing_map:
-            mongodb.post_data(data)
+    collection_of = {_id: race_collection(race) for _id, race in formatted_data.items()}
+    inserts: Dict[str, list] = {}
+    for _id, race in formatted_data.items():
+        doc = {key: value for key, value in race.items() if key != "_id"}
+        inserts.setdefault(collection_of[_id], []).append((_id, {"$setOnInsert": doc}))
+    for collection_name, batch in inserts.items():
+        mongodb.ensure_index("norm_time", collection_name)
+        if mongodb.bulk_update(batch, collection_name=collection_name, upsert=True) is None:
+            return None
+    index_races(mongodb.client, formatted_data.values(), collection_of)
+
+    mongodb.client[CONTROL_DATABASE][DAYS_COLLECTION].update_one(
+        {"_id": convert_date_to_collection_format(date)},
+        {"$set": {"schedule_pulled_at": now_utc()}},
+        upsert=True,
+    )
+    logger.info(f"Schedule {date}: {len(formatted_data)} races in {sorted(inserts)}")
+    return len(formatted_data)
+
+
+def schedules_due(mongodb: MongoDBHandler, now: datetime) -> List[str]:
+    """Dates from today to SCHEDULE_DAYS_AHEAD whose schedule was never pulled, or not for SCHEDULE_REFRESH_INTERVAL."""
+    days = mongodb.client[CONTROL_DATABASE][DAYS_COLLECTION]
+    due = []
+    for offset in range(SCHEDULE_DAYS_AHEAD + 1):
+        date = (now + timedelta(days=offset)).strftime(DATE_FORMAT)
+        pulled_at = (days.find_one({"_id": convert_date_to_collection_format(date)}) or {}).get("schedule_pulled_at")
+        if pulled_at is None or now - pulled_at >= SCHEDULE_REFRESH_INTERVAL:
+            due.append(date)
+    return due
+
+
+PendingSchedule = Tuple[str, MongoLease, ScheduledRequest]  # (date, its schedule lease, its fetch)
+
+
+def submit_schedules(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, request_scheduler: RequestScheduler,
+                     dates: List[str], lease_seconds: float) -> List[PendingSchedule]:
+    """Queue the schedule fetches of `dates` at Priority.SCHEDULE; store them with store_schedules once run.
+
+    With several workers only the one holding a day's schedule lease fetches it.
+    """
+    pending = []
+    for date in dates:
+        lease = MongoLease(mongodb.client, f"schedule:{convert_date_to_collection_format(date)}", lease_seconds)
+        if lease.try_acquire():
+            pending.append((date, lease, request_scheduler.submit(Priority.SCHEDULE, data_extractor.get_schedule_data,
+                                                                  date)))
+    return pending
+
+
+def store_schedules(mongodb: MongoDBHandler, pending: List[PendingSchedule]):
+    """Store the schedules fetched for submit_schedules and release their leases."""
+    for date, lease, request in pending:
+        try:
+            # shed, failed or not run before the tick ended: all retried next tick
+            if request.result is None or load_schedule(mongodb, request.result, date) is None:
+                logger.warning(f"Could not load the schedule for {date}, retrying next tick")
+        except Exception as e:
+            logger.error(f"Error loading the schedule for {date}: {e}", exc_info=True)
+        finally:
+            lease.release()
 
 
-def pull_schedule_and_create_collection(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, collection_name: str):
-    mongodb.create_collection(collection_name)
+def refresh_schedules(mongodb: MongoDBHandler, data_extractor: TabDataExtractor, request_scheduler: RequestScheduler,
+                      dates: List[str], lease_seconds: float):
+    """Fetch and store the schedules of `dates` now, through `request_scheduler`."""
+    pending = submit_schedules(mongodb, data_extractor, request_scheduler, dates, lease_seconds)
+    request_scheduler.run()
+    store_schedules(mongodb, pending)
 
-    schedule_data = data_extractor.get_schedule_data()
-    formatted_data = extract_schedule_data(schedule_data)
 
-    mongodb.set_collection(collection_name)
-    for _, data in formatted_data.items():
-        mongodb.post_data(data)
+def degraded_races(data_extractor: TabDataExtractor, spool: Spool, collection_name: str) -> Optional[Dict[str, Any]]:
+    """The day's races without Mongo: the schedule cached in the spool, or pulled from the API.
+
+    A freshly pulled schedule is also spooled, so the races' documents are created on replay,
+    each in its meeting day's collection.
+    """
+    formatted_data = spool.load_schedule(collection_name, SCHEDULE_CACHE_MAX_AGE.total_seconds())
+    if formatted_data is None:
+        today = today_utc_str()
+        formatted_data = extract_schedule_data(data_extractor.get_schedule_data(today), today)
+        if not formatted_data:
+            return None
+        spool.save_schedule(collection_name, formatted_data)
+        by_collection: Dict[str, list] = {}
+        for race in formatted_data.values():
+            by_collection.setdefault(race_collection(race), []).append(race)
+        for races_collection, races in by_collection.items():
+            spool.append_inserts(races_collection, races)
+    return formatted_data
 
 
-def pull_tab_data_robust(memory_monitor: MemoryMonitor):
-    """Robust TAB data pulling with memory monitoring."""
+def run_degraded_tick(data_extractor: TabDataExtractor, spool: Spool, collection_name: str, deadline: Deadline):
+    """Keep collecting odds into the spool while Mongo is unreachable; results wait for Mongo."""
+    formatted_data = degraded_races(data_extractor, spool, collection_name)
+    if not formatted_data:
+        logger.error("No schedule available, nothing to collect")
+        return
+    collection_of = {_id: race_collection(race) for _id, race in formatted_data.items()}
+    request_scheduler = RequestScheduler(deadline=deadline)
+    pipeline = update_race_data_local(
+        request_scheduler, data_extractor, formatted_data,
+        routed_writer(collection_of, lambda collection: partial(spool.append_updates, collection)), results=False,
+    )
+    logger.info(pipeline.report())
+    request_scheduler.log_stats()
+
+
+def pull_tab_data_robust(memory_monitor: MemoryMonitor, budget_seconds: float = TICK_BUDGET_SECONDS,
+                         phase_estimator: Optional[CachePhaseEstimator] = None,
+                         archive: Optional[RawArchive] = None):
+    """Robust TAB data pulling with memory monitoring.
+
+    `phase_estimator`, if given, learns the API cache refresh phase from this tick's responses.
+    `archive`, if given, stores every raw schedule and event response.
+    """
     start_time = timer.time()
     mongodb = None
+    lease = None
+    flusher = None
+    pending_schedules: List[PendingSchedule] = []
+    spool = None
+    deadline = Deadline(budget_seconds, reserve_seconds=TICK_WRITE_RESERVE_SECONDS)
 
     try:
         status, memory_mb = memory_monitor.check_memory_status()
@@ -331,38 +800,74 @@ def pull_tab_data_robust(memory_monitor: MemoryMonitor):
         if status == 'warning':
             logger.warning(f"WARNING: Memory at {memory_mb:.1f}MB")
 
-        data_extractor = TabDataExtractor()
+        # one memo for the whole tick: odds and results polls of a race share a fetch
+        data_extractor = TabDataExtractor(deadline=deadline, memo_ttl=budget_seconds)
+        if phase_estimator is not None:
+            data_extractor.response_hooks.append(phase_estimator.observe)
+        if archive is not None:
+            data_extractor.response_hooks.append(archive.observe)
         mongodb = MongoDBHandler(database_name="tab")
+        collection_name = convert_date_to_collection_format(today_utc_str())
+        logger.info(f"Current date: {collection_name}")
+        spool = Spool()
 
-        if not mongodb.connect():
-            logger.error("Failed to connect to MongoDB")
+        if not mongodb.connect(timeout_ms=MONGO_TIMEOUT_MS):
+            logger.error("Failed to connect to MongoDB, collecting odds into the spool")
+            if status != 'critical':
+                run_degraded_tick(data_extractor, spool, collection_name, deadline)
             return
 
-        collection_name = convert_date_to_collection_format(today_utc_str())
-        logger.info(f"Current date: {collection_name}")
+        coordinator = None
+        lease_name = "scraper"
+        if SHARDING_ENABLED:
+            coordinator = ShardCoordinator(mongodb.client)
+            if not coordinator.heartbeat():
+                return
+            lease_name += f":{coordinator.worker_id}"
+
+        # single writer (or one per worker's shard): an overrunning tick keeps the lease until it finishes
+        lease = MongoLease(mongodb.client, lease_name, budget_seconds + LEASE_SLACK_SECONDS)
+        acquired = lease.acquire(LEASE_WAIT_SECONDS)
+        logger.info(lease.summary())
+        if not acquired:
+            logger.warning(f"Skipping tick, {lease_name} is held by {lease.holder()}")
+            return
 
-        if not mongodb.check_collection_in_db(collection_name):
+        request_scheduler = RequestScheduler(deadline=deadline)
+        schedules = schedules_due(mongodb, now_utc())
+        if today_utc_str() in schedules and not mongodb.check_collection_in_db(collection_name):
+            # cold start: nothing was prefetched and this tick needs today's races
             logger.info("Today's collection missing — pulling schedule")
-            pull_schedule_and_create_collection(mongodb, data_extractor, collection_name)
+            refresh_schedules(mongodb, data_extractor, request_scheduler, [schedules.pop(0)], budget_seconds)
+        # tomorrow's races (and today's added ones): fetched after this tick's odds and results, stored below
+        pending_schedules = submit_schedules(mongodb, data_extractor, request_scheduler, schedules, budget_seconds)
 
-        logger.info(f"Current collection: {collection_name}")
+        if spool.pending():
+            # replay what earlier ticks spooled alongside this tick's fetches
+            flusher = spool.start_flush(mongodb.bulk_update, deadline, mongodb.existing_ids)
 
         if status != 'critical':
-            logger.info("Updating odds")
-            update_schedule = extract_and_update_odds(mongodb, data_extractor, collection_name)
-            if update_schedule:
-                logger.info("Updating schedule with missing races")
-                update_schedule_missing_races(mongodb, data_extractor, collection_name)
-        else:
-            logger.warning("Skipping odds update due to memory pressure")
+            logger.info("Updating odds and results")
 
-        now = now_utc()
-        if now.minute == 0 and 0 <= now.second <= 10:
-            if status != 'critical':
-                logger.info("Updating results")
-                extract_and_update_results(mongodb, data_extractor, collection_name)
-            else:
-                logger.warning("Skipping results update due to memory pressure")
+            def writer_for(races_collection):
+                # a failing or slow Mongo diverts the rest of the tick's writes to the spool
+                return SpoolingWriter(partial(mongodb.bulk_update, collection_name=races_collection),
+                                      spool, races_collection)
+
+            pipeline = extract_and_update_races(mongodb, data_extractor, request_scheduler, coordinator, writer_for)
+            if pipeline is not None:
+                logger.info(pipeline.report())
+            logger.info(mongodb.write_summary())
+        else:
+            logger.warning("Skipping odds and results update due to memory pressure")
+        # schedule fetches the pipeline did not drain (nothing to update, or memory pressure)
+        request_scheduler.run()
+        store_schedules(mongodb, pending_schedules)
+        pending_schedules = []
+        request_scheduler.log_stats()
+        logger.info(data_extractor.hedge_report())
+        logger.info(data_extractor.coalesce_report())
+        logger.info(data_extractor.failure_report())
 
         logger.info("Done for now")
 
@@ -370,6 +875,17 @@ def pull_tab_data_robust(memory_monitor: MemoryMonitor):
         logger.error(f"Error in pull_tab_data_robust: {e}", exc_info=True)
 
     finally:
+        if flusher is not None:
+            flusher.join(max(deadline.remaining(), 0.0))
+            if flusher.is_alive():
+                logger.warning("Spool flush still running, closing Mongo under it (resumes next tick)")
+
+        for _, schedule_lease, _ in pending_schedules:
+            schedule_lease.release()  # the tick failed before storing them, retried next tick
+
+        if lease is not None:
+            lease.release()
+
         if mongodb:
             try:
                 mongodb.close_connection()
@@ -379,23 +895,69 @@ def pull_tab_data_robust(memory_monitor: MemoryMonitor):
 
         gc.collect()
 
+        if spool is not None:
+            logger.info(spool.summary())
+        if archive is not None:
+            logger.info(archive.summary())
+        logger.info(deadline.summary())
         execution_time = timer.time() - start_time
         final_status, final_memory = memory_monitor.check_memory_status()
         logger.info(f"Execution time: {execution_time:.2f}s | Final memory: {final_memory:.1f}MB ({final_status})")
 
 
+def run_aligned_loop(memory_monitor: MemoryMonitor, archive: Optional[RawArchive] = None):
+    """Run ticks back to back, each starting just after the API cache refreshes (see cache_phase)."""
+    estimator = CachePhaseEstimator.load()
+    ticker = AlignedTicker(estimator)
+    budget = estimator.period - LOOP_TICK_MARGIN_SECONDS
+    # ticks poll each race once per period, too far apart to learn the phase from; the probe's
+    # closely spaced polls run alongside them
+    probe_extractor = TabDataExtractor()
+    probe = PhaseProbe(estimator, probe_extractor.fetch_json_data,
+                       prefix=probe_extractor.base_url + probe_extractor.endpoints["event"].split("{")[0])
+    probe.start()
+    logger.info(f"Aligned loop: {estimator.period:.0f}s ticks | {estimator.summary()}")
+
+    while True:
+        lateness = ticker.wait()
+        logger.info("=" * 60)
+        logger.info(f"Tick {ticker.ticks} | woke {lateness * 1000:.0f}ms late | skipped {ticker.skipped} | {estimator.summary()}")
+        try:
+            pull_tab_data_robust(memory_monitor, budget, estimator, archive)
+        except Exception as e:
+            logger.error(f"Fatal error in tick: {e}", exc_info=True)
+        estimator.save()
+
+
 def main():
+    parser = argparse.ArgumentParser(description="TAB odds and results scraper")
+    parser.add_argument("--loop", action="store_true",
+                        help="Stay running and tick once per API cache period instead of once per cron launch")
+    args = parser.parse_args()
+
     logger.info("=" * 60)
     logger.info("Starting robust TAB scraper")
 
     memory_monitor = MemoryMonitor()
     memory_monitor.log_memory_stats()
 
+    # one archive for the whole run, so its dedup index is loaded once per day
+    archive = RawArchive(now=now_utc) if ARCHIVE_ENABLED else None
+
+    if args.loop:
+        run_aligned_loop(memory_monitor, archive)
+        return
+
+    # cron ticks are not aligned, but still feed the shared phase estimate
+    estimator = CachePhaseEstimator.load()
     try:
-        pull_tab_data_robust(memory_monitor)
+        pull_tab_data_robust(memory_monitor, phase_estimator=estimator, archive=archive)
     except Exception as e:
         logger.error(f"Fatal error in main: {e}", exc_info=True)
     finally:
+        estimator.save()
+        if archive is not None:
+            archive.close()
         memory_monitor.log_memory_stats()
         logger.info("=" * 60)
 
@@ -41,11 +41,14 @@ Remember to never commit sensitive information like connection strings directly
 """
 import os
 import logging
+import threading
+import uuid
+from collections import Counter
 from datetime import datetime
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, OperationFailure
 
 logging.basicConfig(
     level=logging.INFO,  # Set the logging level
@@ -56,6 +59,31 @@ logging.basicConfig(
 # Create a logger
 logger = logging.getLogger(__name__)
 
+def _version_filter(document_id, expected_version: int) -> Dict[str, Any]:
+    """Filter matching the document only while its _version is still `expected_version`."""
+    if expected_version:
+        return {"_id": document_id, "_version": expected_version}
+    return {"_id": document_id, "_version": {"$in": [0, None]}}
+
+
+def _leaf_update(update: Dict[str, Any]) -> Dict[str, Any]:
+    """`update` with whole-entry $sets split into per-field and per-odds-snapshot paths.
+
+    A conflict retry must not replace an entry the other writer added odds to.
+    """
+    sets = {}
+    for path, value in (update.get("$set") or {}).items():
+        if path.startswith("entries.") and path.count(".") == 1 and isinstance(value, dict):
+            for key, field in value.items():
+                if key == "odds" and isinstance(field, dict):
+                    sets.update({f"{path}.odds.{timestamp}": odds for timestamp, odds in field.items()})
+                else:
+                    sets[f"{path}.{key}"] = field
+        else:
+            sets[path] = value
+    return dict(update, **{"$set": sets})
+
+
 class MongoDBHandler:
     def __init__(self, database_name, collection_name=None):
         # Load environment variables from .env file
@@ -68,6 +96,8 @@ class MongoDBHandler:
         self.client = None
         self.db = None
         self.collection = None
+        self.write_stats = Counter()  # compare-and-set outcomes of versioned bulk updates
+        self._stats_lock = threading.Lock()
         
 
     def _get_connection_string(self) -> str:
@@ -93,11 +123,19 @@ class MongoDBHandler:
             return None
         self.collection = self.db[self.collection_name]
     
-    def connect(self) -> bool:
-        """Establish connection to MongoDB database."""
+    def connect(self, timeout_ms: Optional[int] = None) -> bool:
+        """Establish connection to MongoDB database.
+
+        Args:
+            timeout_ms: Server selection and socket timeout, so an unreachable or
+                hung server fails fast instead of after pymongo's 30s default
+        """
         try:
             connection_string = self._get_connection_string()
-            self.client = MongoClient(connection_string)
+            options = {}
+            if timeout_ms is not None:
+                options = {"serverSelectionTimeoutMS": timeout_ms, "socketTimeoutMS": timeout_ms}
+            self.client = MongoClient(connection_string, **options)
             self.db = self.client[self.database_name]
             self.connect_to_collection()
 
@@ -185,6 +223,43 @@ class MongoDBHandler:
             logger.error(f"Error retrieving documents: {e}")
             return []
 
+    def find_documents(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Retrieve the documents matching `query`, [] on error."""
+        try:
+            documents = list(self.collection.find(query))
+            logger.info(f"Retrieved {len(documents)} documents")
+            return documents
+        except Exception as e:
+            logger.error(f"Error retrieving documents: {e}")
+            return []
+
+    def get_distinct(self, field: str) -> List[Any]:
+        """Distinct values of `field` across the collection, [] on error."""
+        try:
+            return self.collection.distinct(field)
+        except Exception as e:
+            logger.error(f"Error retrieving distinct {field}: {e}")
+            return []
+
+    def existing_ids(self, ids: List[Any], collection_name: Optional[str] = None) -> Optional[set]:
+        """Which of `ids` have a document in the collection, None on error."""
+        collection = self.db[collection_name] if collection_name else self.collection
+        try:
+            return {doc["_id"] for doc in collection.find({"_id": {"$in": ids}}, {"_id": 1})}
+        except Exception as e:
+            logger.error(f"Error looking up document ids: {e}")
+            return None
+
+    def ensure_index(self, field: str, collection_name: Optional[str] = None) -> bool:
+        """Create an ascending index on `field` if missing (e.g. norm_time, for the tick's time window query)."""
+        collection = self.db[collection_name] if collection_name else self.collection
+        try:
+            collection.create_index(field)
+            return True
+        except Exception as e:
+            logger.error(f"Error creating index on {field}: {e}")
+            return False
+
     def post_data(self, data: Dict[str, Any]) -> bool:
         """
         Post JSON data to MongoDB.
@@ -230,6 +305,103 @@ class MongoDBHandler:
             return None
         
         
+    def bulk_update(self, updates: List[Tuple], collection_name: Optional[str] = None,
+                    upsert: bool = False) -> Optional[int]:
+        """
+        Apply many targeted updates in one unordered bulk write
+
+        An update given as (document_id, update, expected_version) is a compare-and-set:
+        it applies only while the document's `_version` is still expected_version
+        (documents written before versioning count as 0). A miss means another writer
+        updated the race since it was read; each batch stamps its versioned writes with a
+        `_write_id`, so the misses are known exactly. They are counted in write_stats["conflicts"] and
+        applied again without the check: updates only $set changed leaf fields and new
+        odds snapshots, so the two writers' changes merge instead of one being lost.
+
+        Args:
+            updates: (document_id, update operators) pairs, e.g. ("id", {"$set": {...}}),
+                or (document_id, update operators, expected_version) triples
+            collection_name: Collection to write to, default the current one
+            upsert: Insert documents that don't exist (unversioned updates only)
+
+        Returns:
+            Number of documents matched or upserted, None on error
+        """
+        if not updates:
+            return 0
+        collection = self.db[collection_name] if collection_name else self.collection
+        versioned = {update[0]: update for update in updates if len(update) > 2}
+        write_id = uuid.uuid4().hex  # tags this batch's versioned writes, to tell them from another writer's
+        requests = []
+        for update in updates:
+            if update[0] in versioned:
+                operators = dict(update[1], **{"$set": dict(update[1].get("$set") or {}, _write_id=write_id)})
+                requests.append(UpdateOne(_version_filter(update[0], update[2]), operators))
+            else:
+                requests.append(UpdateOne({"_id": update[0]}, update[1], upsert=upsert))
+        try:
+            result = collection.bulk_write(requests, ordered=False)
+            matched = result.matched_count + result.upserted_count
+            if versioned and matched < len(updates):
+                matched += self._retry_conflicts(collection, versioned, write_id)
+            with self._stats_lock:
+                self.write_stats["versioned"] += len(versioned)
+            return matched
+        except BulkWriteError as e:
+            logger.error(f"Bulk update partly failed: {len(e.details.get('writeErrors', []))} errors")
+            return e.details.get("nMatched", 0) + e.details.get("nUpserted", 0)
+        except Exception as e:
+            logger.error(f"Bulk update failed: {e}")
+            return None
+
+    def _retry_conflicts(self, collection, versioned: Dict[Any, Tuple], write_id: str) -> int:
+        """Re-apply, unchecked, the versioned updates another writer beat. Returns how many matched."""
+        # documents still missing are not conflicts; the caller sees them as unmatched
+        missed = [
+            versioned[doc["_id"]]
+            for doc in collection.find({"_id": {"$in": list(versioned)}, "_write_id": {"$ne": write_id}}, {"_id": 1})
+        ]
+        if not missed:
+            return 0
+        with self._stats_lock:
+            self.write_stats["conflicts"] += len(missed)
+        logger.warning(f"{len(missed)} race updates lost a compare-and-set to another writer, re-applying")
+        result = collection.bulk_write([UpdateOne({"_id": u[0]}, _leaf_update(u[1])) for u in missed], ordered=False)
+        return result.matched_count
+
+    def write_summary(self) -> str:
+        with self._stats_lock:
+            versioned, conflicts = self.write_stats["versioned"], self.write_stats["conflicts"]
+        rate = 100.0 * conflicts / versioned if versioned else 0.0
+        return f"Race writes: {versioned} compare-and-set | {conflicts} conflicts ({rate:.2f}%)"
+
+    def bulk_replace(self, documents: List[Dict[str, Any]], collection_name: Optional[str] = None) -> Optional[int]:
+        """
+        Upsert whole documents (by _id) in one unordered bulk write
+
+        Args:
+            documents: Documents to write, each with an _id
+            collection_name: Collection to write to, default the current one
+
+        Returns:
+            Number of documents written, None on error
+        """
+        if not documents:
+            return 0
+        collection = self.db[collection_name] if collection_name else self.collection
+        try:
+            result = collection.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in documents],
+                ordered=False,
+            )
+            return result.matched_count + result.upserted_count
+        except BulkWriteError as e:
+            logger.error(f"Bulk replace partly failed: {len(e.details.get('writeErrors', []))} errors")
+            return e.details.get("nMatched", 0) + e.details.get("nUpserted", 0)
+        except Exception as e:
+            logger.error(f"Bulk replace failed: {e}")
+            return None
+
     def append_to_existing_document(
         self, document_id: str, updated_data: Dict[str, Any]
     ) -> bool:
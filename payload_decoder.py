@@ -0,0 +1,138 @@
+"""Fast, field-pruned decoding of Affiliates v1 payloads.
+
+The schedule and event payloads carry far more than the scraper reads (form,
+silks, comments, exotic pools...). With msgspec installed, payloads are decoded
+against typed structs listing only the fields main.py and the trigger
+scheduler use; everything else is skipped by the parser and never becomes a
+Python object. Without msgspec, orjson (or the stdlib json module) decodes the
+full payload.
+
+A payload that is valid JSON but does not fit the structs (the API changed a
+field's type) is decoded in full instead: the data is there, only the schema
+is stale, so retrying the request would not help.
+
+Pruned payloads are plain dicts of the same shape as the full ones, with
+missing or null fields left out, so `.get()` based readers work unchanged.
+"""
+import json
+import logging
+from typing import Any, List, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE = "schedule"
+EVENT = "event"
+
+if msgspec is not None:
+    # Leaf values are typed Any so an unexpected type from the API (e.g. a
+    # string weight) is passed through rather than failing the whole payload
+
+    class Odds(msgspec.Struct, omit_defaults=True):
+        fixed_win: Any = None
+        fixed_place: Any = None
+
+    class Runner(msgspec.Struct, omit_defaults=True):
+        runner_number: Any = None
+        name: Any = None
+        is_scratched: Any = None
+        barrier: Any = None
+        jockey: Any = None
+        trainer_name: Any = None
+        weight: Any = None
+        odds: Optional[Odds] = None
+
+    class Placing(msgspec.Struct, omit_defaults=True):
+        runner_number: Any = None
+        name: Any = None
+        position: Any = None
+        margin_length: Any = None
+
+    class RaceInfo(msgspec.Struct, omit_defaults=True):
+        id: Any = None
+        start_time: Any = None
+        status: Any = None
+
+    class Event(msgspec.Struct, omit_defaults=True):
+        race: Optional[RaceInfo] = None
+        status: Any = None
+        start_time: Any = None
+        runners: Optional[List[Runner]] = None
+        results: Optional[List[Placing]] = None
+
+    class ScheduleRace(msgspec.Struct, omit_defaults=True):
+        id: Any = None
+        name: Any = None
+        race_number: Any = None
+        start_time: Any = None
+        distance: Any = None
+        track_condition: Any = None
+        weather: Any = None
+
+    class Meeting(msgspec.Struct, omit_defaults=True):
+        name: Any = None
+        meeting: Any = None
+        date: Any = None
+        races: Optional[List[ScheduleRace]] = None
+
+    class Schedule(msgspec.Struct, omit_defaults=True):
+        meetings: Optional[List[Meeting]] = None
+
+    class EventEnvelope(msgspec.Struct, omit_defaults=True):
+        data: Optional[Event] = None
+
+    class ScheduleEnvelope(msgspec.Struct, omit_defaults=True):
+        data: Optional[Schedule] = None
+
+    _PRUNED_DECODERS = {
+        SCHEDULE: msgspec.json.Decoder(ScheduleEnvelope),
+        EVENT: msgspec.json.Decoder(EventEnvelope),
+    }
+    _FULL_DECODER = msgspec.json.Decoder()
+
+
+def backend() -> str:
+    """Name of the decoder in use: msgspec, orjson or json."""
+    if msgspec is not None:
+        return "msgspec"
+    if orjson is not None:
+        return "orjson"
+    return "json"
+
+
+def decode_full(content: bytes) -> Any:
+    """Decode a whole JSON document with the fastest available parser."""
+    if orjson is not None:
+        return orjson.loads(content)
+    if msgspec is not None:
+        return _FULL_DECODER.decode(content)
+    return json.loads(content)
+
+
+def decode(content: bytes, kind: Optional[str] = None, prune: bool = True) -> Any:
+    """Decode an API response body.
+
+    Args:
+        content: Raw response bytes
+        kind: SCHEDULE or EVENT to decode only the fields the scraper reads;
+            None decodes everything
+        prune: Set False to always decode the full payload
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    if prune and kind is not None and msgspec is not None:
+        try:
+            return msgspec.to_builtins(_PRUNED_DECODERS[kind].decode(content))
+        except msgspec.ValidationError as e:
+            logger.warning(f"{kind} payload does not match the pruned schema ({e}), decoding in full")
+    return decode_full(content)
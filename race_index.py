@@ -0,0 +1,90 @@
+"""Which day collection each race is stored in.
+
+Races are stored in the collection of their meeting's racing day (the
+meeting date the schedule gives), not the UTC day they happen to run on, so a
+late race can sit in the previous day's collection. tab_control.race_index
+maps race ids to collections, so a race is found with one index lookup
+instead of scanning neighbouring days:
+
+  {_id: race id, collection: "_20260520", meeting_date, meeting_code, norm_time}
+
+The index is written whenever a schedule is loaded (see main.load_schedule).
+Look a race up with:
+
+  python race_index.py <race id>
+"""
+import sys
+import json
+import logging
+from typing import Any, Dict, Iterable, Optional
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from lease import CONTROL_DATABASE
+from mongodb_handler import MongoDBHandler
+
+logger = logging.getLogger(__name__)
+
+RACE_INDEX_COLLECTION = "race_index"
+DAYS_COLLECTION = "days"  # per day collection: schedule_pulled_at, reconciled_at, complete, coverage
+RACE_DATABASE = "tab"
+
+
+def index_races(client, races: Iterable[Dict[str, Any]], collection_of: Dict[str, str]) -> Optional[int]:
+    """Record the collection of each race. Returns how many were indexed, None on error."""
+    ops = [
+        UpdateOne(
+            {"_id": race["_id"]},
+            {"$set": {
+                "collection": collection_of[race["_id"]],
+                "meeting_date": race.get("meeting_date"),
+                "meeting_code": race.get("meeting_code"),
+                "norm_time": race.get("norm_time"),
+            }},
+            upsert=True,
+        )
+        for race in races
+    ]
+    if not ops:
+        return 0
+    try:
+        result = client[CONTROL_DATABASE][RACE_INDEX_COLLECTION].bulk_write(ops, ordered=False)
+    except PyMongoError as e:
+        logger.error(f"Could not index races: {e}")
+        return None
+    return result.matched_count + result.upserted_count
+
+
+def locate_race(client, race_id: str) -> Optional[str]:
+    """Collection holding `race_id`, None if it is not indexed."""
+    doc = client[CONTROL_DATABASE][RACE_INDEX_COLLECTION].find_one({"_id": race_id}, {"collection": 1})
+    return doc.get("collection") if doc else None
+
+
+def find_race(client, race_id: str, database: str = RACE_DATABASE) -> Optional[Dict[str, Any]]:
+    """The stored race document, wherever it is."""
+    collection_name = locate_race(client, race_id)
+    if collection_name is None:
+        return None
+    return client[database][collection_name].find_one({"_id": race_id})
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) != 2:
+        sys.exit("usage: python race_index.py <race id>")
+    mongodb = MongoDBHandler(database_name=RACE_DATABASE)
+    if not mongodb.connect():
+        sys.exit("Failed to connect to MongoDB")
+    try:
+        race = find_race(mongodb.client, sys.argv[1])
+        if race is None:
+            sys.exit(f"Race {sys.argv[1]} is not indexed")
+        summary = {k: v for k, v in race.items() if k != "entries"}
+        summary["runners"] = len(race.get("entries") or {})
+        print(f"{locate_race(mongodb.client, sys.argv[1])}: {json.dumps(summary, default=str, indent=2)}")
+    finally:
+        mongodb.close_connection()
+
+
+if __name__ == '__main__':
+    main()
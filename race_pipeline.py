@@ -0,0 +1,200 @@
+"""Staged race update pipeline: fetch -> transform -> batched write.
+
+Fetch workers (RequestScheduler.run on several threads) hand each completed
+request to a single transform thread through a bounded queue. The transform
+turns it into a targeted MongoDB update and passes that to a batching writer
+through a second bounded queue. A full queue blocks the stage feeding it, so
+a slow Mongo holds the fetchers back instead of piling up payloads in memory,
+while network and database latency overlap instead of adding up.
+
+With a tick deadline on the request scheduler, the pipeline gives up
+PIPELINE_GRACE_SECONDS after it: a stage still blocked on a stuck Mongo drops
+its item (counted as failed) and run() returns instead of hanging the tick.
+"""
+import time
+import queue
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from request_scheduler import RequestScheduler, ScheduledRequest
+
+logger = logging.getLogger(__name__)
+
+FETCH_WORKERS = 4
+QUEUE_SIZE = 32
+WRITE_BATCH_SIZE = 50
+WRITE_BATCH_WAIT_SECONDS = 0.05  # how long a partial batch waits for more updates
+PIPELINE_GRACE_SECONDS = 1.0  # past the scheduler's deadline before stages give up
+
+Update = Tuple  # (document id, update operators), optionally + the _version read (compare-and-set)
+
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    busy_seconds: float = 0.0
+    blocked_seconds: float = 0.0  # waiting for room in the next stage's queue
+    max_queue_depth: int = 0
+    failed: int = 0
+
+    def throughput(self) -> float:
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class RacePipeline:
+    """Runs one tick of fetches through transform and batched writes."""
+
+    def __init__(self, transform: Callable[[ScheduledRequest], Optional[Update]],
+                 write_batch: Optional[Callable[[List[Update]], Optional[int]]] = None,
+                 queue_size: int = QUEUE_SIZE, batch_size: int = WRITE_BATCH_SIZE,
+                 batch_wait: float = WRITE_BATCH_WAIT_SECONDS):
+        """
+        Args:
+            transform: Applies a completed request to the local race state and
+                returns the update to write, or None if nothing changed
+            write_batch: Writes a batch of updates and returns how many matched
+                (None on failure); without it updates are only collected
+            queue_size: Capacity of each inter-stage queue
+            batch_size: Most updates per write
+            batch_wait: Longest a partial batch waits to fill
+        """
+        self._transform = transform
+        self._write_batch = write_batch
+        self._transform_queue = queue.Queue(maxsize=queue_size)
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.stats = {name: StageStats() for name in ("fetch", "transform", "write")}
+        self.write_batches = 0
+        self.changed = set()
+        self._give_up_at: Optional[float] = None  # perf_counter time, set by run() from the scheduler deadline
+
+    def _remaining(self) -> Optional[float]:
+        if self._give_up_at is None:
+            return None
+        return max(0.0, self._give_up_at - time.perf_counter())
+
+    def _put(self, target: queue.Queue, item, stats: StageStats) -> bool:
+        """Put `item`, waiting at most until the pipeline gives up. Returns False if it was dropped."""
+        start = time.perf_counter()
+        try:
+            target.put(item, timeout=self._remaining())
+        except queue.Full:
+            stats.failed += 1
+            return False
+        finally:
+            stats.blocked_seconds += time.perf_counter() - start
+        stats.max_queue_depth = max(stats.max_queue_depth, target.qsize())
+        return True
+
+    def submit(self, request: ScheduledRequest):
+        """Fetch stage output (RequestScheduler on_done hook); blocks while the transform is behind."""
+        self._put(self._transform_queue, request, self.stats["fetch"])
+
+    def submit_update(self, update: Update):
+        """Queue an update computed outside the transform stage; needs the writer running (see run)."""
+        if self._put(self._write_queue, update, self.stats["transform"]):
+            self.changed.add(update[0])
+
+    def _transform_loop(self):
+        stats = self.stats["transform"]
+        while True:
+            request = self._transform_queue.get()
+            if request is _DONE:
+                break
+            start = time.perf_counter()
+            try:
+                update = self._transform(request)
+            except Exception as e:
+                stats.failed += 1
+                logger.error(f"Transform failed: {e}", exc_info=True)
+                update = None
+            stats.items += 1
+            stats.busy_seconds += time.perf_counter() - start
+            if update is not None and update[1]:
+                self.submit_update(update)
+        self._write_queue.put(_DONE)  # the writer stops at the deadline without it, see run()
+
+    def _next_batch(self) -> Tuple[List[Update], bool]:
+        """Block for one update, then gather more for up to batch_wait. Returns (batch, finished)."""
+        try:
+            first = self._write_queue.get(timeout=self._remaining())
+        except queue.Empty:
+            return [], True
+        if first is _DONE:
+            return [], True
+        batch = [first]
+        flush_at = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                update = self._write_queue.get(timeout=max(0.0, flush_at - time.perf_counter()))
+            except queue.Empty:
+                break
+            if update is _DONE:
+                return batch, True
+            batch.append(update)
+        return batch, False
+
+    def _write_loop(self):
+        stats = self.stats["write"]
+        finished = False
+        while not finished:
+            batch, finished = self._next_batch()
+            if not batch or self._write_batch is None:
+                continue
+            start = time.perf_counter()
+            try:
+                matched = self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"Write batch failed: {e}", exc_info=True)
+                matched = None
+            stats.busy_seconds += time.perf_counter() - start
+            stats.items += len(batch)
+            self.write_batches += 1
+            if matched is None or matched < len(batch):
+                stats.failed += len(batch) - (matched or 0)
+
+    def run(self, request_scheduler: RequestScheduler, fetch_workers: int = FETCH_WORKERS,
+            updates: Iterable[Update] = (), grace: float = PIPELINE_GRACE_SECONDS) -> int:
+        """Drain `request_scheduler` through all stages and wait for the last write. Returns requests executed.
+
+        `updates` computed outside the transform (e.g. retirements) are written
+        alongside; they are queued once the writer runs, so any number fits
+        through the bounded queue. With a scheduler deadline, run() returns at
+        most `grace` seconds after it even if Mongo never answers.
+        """
+        deadline = request_scheduler.deadline
+        if deadline is not None:
+            self._give_up_at = time.perf_counter() + deadline.remaining() + grace
+        transformer = threading.Thread(target=self._transform_loop, name="transform", daemon=True)
+        writer = threading.Thread(target=self._write_loop, name="writer", daemon=True)
+        transformer.start()
+        writer.start()
+
+        start = time.perf_counter()
+        try:
+            for update in updates:
+                self.submit_update(update)
+            executed = request_scheduler.run(fetch_workers, on_done=self.submit)
+        finally:
+            fetch = self.stats["fetch"]
+            fetch.busy_seconds = time.perf_counter() - start
+            fetch.items = sum(s.executed for s in request_scheduler.stats.values())
+            self._put(self._transform_queue, _DONE, self.stats["fetch"])
+            transformer.join(self._remaining())
+            writer.join(self._remaining())
+            if transformer.is_alive() or writer.is_alive():
+                logger.warning("Pipeline still writing at its deadline, leaving its queued updates unwritten")
+        return executed
+
+    def report(self) -> str:
+        parts = []
+        for name, stats in self.stats.items():
+            parts.append(
+                f"{name} {stats.items} ({stats.throughput():.0f}/s, blocked {stats.blocked_seconds * 1000:.0f}ms, "
+                f"max queue {stats.max_queue_depth}, failed {stats.failed})"
+            )
+        return f"Pipeline: {' | '.join(parts)} | {self.write_batches} write batches, {len(self.changed)} races changed"
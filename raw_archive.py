@@ -0,0 +1,355 @@
+"""Compressed archive of raw API responses.
+
+The race documents keep only the fields a tick copies (add_odds_snapshot), so
+nothing else in a payload can be recovered later. With TAB_ARCHIVE_DIR set,
+every schedule and event response body is also archived as received:
+
+  <dir>/20260520/segment-0000.zst   each distinct payload once, one zstd frame each
+  <dir>/20260520/index.jsonl        one line per response received:
+      {"t": "2026-05-20 03:14:30", "kind": "event", "race": "<race id>",
+       "hash": "<blake2b>", "seg": 0, "off": 81234, "len": 2210, "size": 14876}
+      (schedules have "race": null and the requested "date")
+
+Bodies are deduplicated by content hash: the API caches for 30 seconds, so
+most polls of a race return a payload that is already stored and only cost
+an index line. Without the zstandard package, segments are zlib compressed
+(segment-NNNN.zlib) and read back the same way.
+
+One archive directory per scraper worker; it must not be shared. To inspect:
+
+  python raw_archive.py report
+  python raw_archive.py show <race id> --day 2026-05-20 --out /tmp/race
+"""
+import os
+import json
+import zlib
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("TAB_ARCHIVE_DIR", "")
+ARCHIVE_ENABLED = bool(ARCHIVE_DIR)
+CLI_ARCHIVE_DIR = ARCHIVE_DIR or "api_archive"  # not archive/, which holds retired scraper code
+INDEX_FILE = "index.jsonl"
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024  # start a new segment file past this
+ZSTD_LEVEL = 6
+ZLIB_LEVEL = 6
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EVENT_PATH = "/racing/events/"
+SCHEDULE_PATH = "/racing/meetings"
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def day_key(day: str) -> str:
+    """Archive directory name for `day` (YYYYMMDD, YYYY-MM-DD or a _YYYYMMDD collection name)."""
+    return day.replace("-", "").lstrip("_")
+
+
+def classify(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """(kind, race id) of an API URL; the race id is None for schedules, kind None for anything else."""
+    parsed = urlparse(url)
+    if EVENT_PATH in parsed.path:
+        return "event", parsed.path.split(EVENT_PATH, 1)[1].strip("/") or None
+    if parsed.path.endswith(SCHEDULE_PATH):
+        return "schedule", None
+    return None, None
+
+
+class _Codec:
+    """zstd when available, otherwise zlib; the segment extension records which."""
+
+    def __init__(self, extension: str):
+        self.extension = extension
+        if extension == "zst":
+            if zstandard is None:
+                raise RuntimeError("Archive segment is zstd compressed, install zstandard to read it")
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+            self._decompressor = zstandard.ZstdDecompressor()
+
+    @classmethod
+    def default(cls) -> "_Codec":
+        return cls("zst" if zstandard is not None else "zlib")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.extension == "zst":
+            return self._compressor.compress(data)
+        return zlib.compress(data, ZLIB_LEVEL)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.extension == "zst":
+            return self._decompressor.decompress(data)
+        return zlib.decompress(data)
+
+
+class RawArchive:
+    """Append-only, deduplicated per-day archive of raw API responses."""
+
+    def __init__(self, directory: str = ARCHIVE_DIR, now: Callable[[], datetime] = utc_now,
+                 segment_max_bytes: int = SEGMENT_MAX_BYTES):
+        """
+        Args:
+            directory: Archive root, one subdirectory per UTC day
+            now: Clock stamping each response (and choosing its day)
+            segment_max_bytes: Segment size after which a new one is started
+        """
+        self.directory = directory
+        self._now = now
+        self.segment_max_bytes = segment_max_bytes
+        self.codec = _Codec.default()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._day: Optional[str] = None
+        self._known: Dict[str, Dict[str, int]] = {}
+        self._segment = None
+        self._segment_no = 0
+        self._index = None
+
+    # ------------------------------------------------------------------ write
+
+    def _segment_path(self, day: str, number: int, extension: Optional[str] = None) -> str:
+        return os.path.join(self.directory, day, f"segment-{number:04d}.{extension or self.codec.extension}")
+
+    def _open_day(self, day: str):
+        """Switch to `day`, reloading its index so payloads stored by an earlier run are not stored again."""
+        self.close()
+        os.makedirs(os.path.join(self.directory, day), exist_ok=True)
+        self._known = {}
+        for entry in iter_index(self.directory, day):
+            self._known.setdefault(entry["hash"], {k: entry[k] for k in ("seg", "off", "len", "size")})
+        segments = sorted(
+            (int(name[8:12]), name.rsplit(".", 1)[1])
+            for name in os.listdir(os.path.join(self.directory, day)) if name.startswith("segment-")
+        )
+        self._segment_no = 0
+        if segments:
+            number, extension = segments[-1]
+            # never mix codecs in one segment number (zstandard installed or removed since)
+            self._segment_no = number if extension == self.codec.extension else number + 1
+        self._segment = open(self._segment_path(day, self._segment_no), "ab")
+        self._index = open(os.path.join(self.directory, day, INDEX_FILE), "a", encoding="utf-8")
+        self._day = day
+
+    def _store(self, content: bytes) -> Dict[str, int]:
+        if self._segment.tell() >= self.segment_max_bytes:
+            self._segment.close()
+            self._segment_no += 1
+            self._segment = open(self._segment_path(self._day, self._segment_no), "ab")
+        frame = self.codec.compress(content)
+        offset = self._segment.tell()
+        self._segment.write(frame)
+        self._segment.flush()  # before the index line that points at it
+        self.stats["stored_bytes"] += len(frame)
+        return {"seg": self._segment_no, "off": offset, "len": len(frame), "size": len(content)}
+
+    def add(self, kind: str, content: bytes, race_id: Optional[str] = None, date: Optional[str] = None) -> bool:
+        """Archive one response body (`date`: a schedule's requested date). Returns True if it was new today."""
+        now = self._now()
+        digest = content_hash(content)
+        with self._lock:
+            day = now.strftime("%Y%m%d")
+            if day != self._day:
+                self._open_day(day)
+            ref = self._known.get(digest)
+            new = ref is None
+            if new:
+                ref = self._store(content)
+                self._known[digest] = ref
+            entry = {"t": now.strftime(DATETIME_FORMAT), "kind": kind, "race": race_id, "hash": digest, **ref}
+            if date is not None:
+                entry["date"] = date
+            self._index.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._index.flush()
+            self.stats["responses"] += 1
+            self.stats["new" if new else "duplicate"] += 1
+            self.stats["raw_bytes"] += len(content)
+        return new
+
+    def observe(self, url: str, response):
+        """TabDataExtractor response hook: archive schedule and event bodies."""
+        kind, race_id = classify(url)
+        if kind is None:
+            return
+        date = None
+        if kind == "schedule":
+            # the hook's url has no query string; the schedule date is only on the response
+            date = (parse_qs(urlparse(getattr(response, "url", "") or "").query).get("date") or [None])[0]
+        self.add(kind, response.content, race_id, date)
+
+    def close(self):
+        for f in (self._segment, self._index):
+            if f is not None:
+                f.close()
+        self._segment = self._index = None
+        self._day = None
+
+    def summary(self) -> str:
+        s = self.stats
+        dedup = 100.0 * s["duplicate"] / s["responses"] if s["responses"] else 0.0
+        ratio = s["raw_bytes"] / s["stored_bytes"] if s["stored_bytes"] else 0.0
+        return (
+            f"Archive: {s['responses']} responses | {s['new']} new, {dedup:.1f}% duplicates | "
+            f"stored {s['stored_bytes'] / 1024:.0f}KB ({ratio:.1f}x compression on new payloads)"
+        )
+
+
+# ------------------------------------------------------------------ read
+
+def iter_index(directory: str, day: str) -> Iterator[Dict[str, Any]]:
+    """Index entries of `day` in the order they were received."""
+    path = os.path.join(directory, day_key(day), INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break  # partial last line of a crashed writer
+            yield json.loads(line)
+
+
+def archived_days(directory: str = ARCHIVE_DIR) -> List[str]:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(d for d in os.listdir(directory) if d.isdigit() and len(d) == 8)
+
+
+class ArchiveReader:
+    """Index lookups and payload reads for one archived day."""
+
+    def __init__(self, day: str, directory: str = ARCHIVE_DIR):
+        self.directory = directory
+        self.day = day_key(day)
+        self.entries = list(iter_index(directory, self.day))
+        self.by_race: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for entry in self.entries:
+            self.by_race.setdefault(entry["race"], []).append(entry)
+        self._codecs: Dict[str, _Codec] = {}
+        self._files: Dict[int, Any] = {}
+
+    def race(self, race_id: str, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Index entries of a race, optionally limited to start <= t <= end (DATETIME_FORMAT strings)."""
+        return [
+            e for e in self.by_race.get(race_id, [])
+            if (start is None or e["t"] >= start) and (end is None or e["t"] <= end)
+        ]
+
+    def schedules(self) -> List[Dict[str, Any]]:
+        return [e for e in self.entries if e["kind"] == "schedule"]
+
+    def _locate(self, seg: int) -> Tuple[Any, _Codec]:
+        for extension in ("zst", "zlib"):
+            path = os.path.join(self.directory, self.day, f"segment-{seg:04d}.{extension}")
+            if os.path.exists(path):
+                if extension not in self._codecs:
+                    self._codecs[extension] = _Codec(extension)
+                if seg not in self._files:
+                    self._files[seg] = open(path, "rb")
+                return self._files[seg], self._codecs[extension]
+        raise FileNotFoundError(f"Archive segment {seg} of {self.day} is missing")
+
+    def read(self, entry: Dict[str, Any]) -> bytes:
+        """Raw response body of an index entry."""
+        f, codec = self._locate(entry["seg"])
+        f.seek(entry["off"])
+        return codec.decompress(f.read(entry["len"]))
+
+    def payload(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return json.loads(self.read(entry))
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+def disk_report(directory: str = ARCHIVE_DIR, days: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Per-day counts and disk use of the archive."""
+    report = []
+    for day in days or archived_days(directory):
+        day = day_key(day)
+        path = os.path.join(directory, day)
+        entries = list(iter_index(directory, day))
+        unique = {e["hash"]: e for e in entries}
+        segment_bytes = sum(
+            os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.startswith("segment-")
+        )
+        raw_bytes = sum(e["size"] for e in entries)
+        report.append({
+            "day": day,
+            "responses": len(entries),
+            "unique": len(unique),
+            "races": len({e["race"] for e in entries if e["kind"] == "event"}),
+            "raw_bytes": raw_bytes,
+            "unique_raw_bytes": sum(e["size"] for e in unique.values()),
+            "segment_bytes": segment_bytes,
+            "index_bytes": os.path.getsize(os.path.join(path, INDEX_FILE)) if entries else 0,
+        })
+    return report
+
+
+def format_report(report: List[Dict[str, Any]]) -> str:
+    lines = [f"{'day':<10} {'responses':>9} {'unique':>7} {'races':>6} {'raw MB':>8} {'disk MB':>8} {'saved':>6}"]
+    for r in report:
+        disk = r["segment_bytes"] + r["index_bytes"]
+        saved = 100.0 * (1 - disk / r["raw_bytes"]) if r["raw_bytes"] else 0.0
+        lines.append(
+            f"{r['day']:<10} {r['responses']:>9} {r['unique']:>7} {r['races']:>6} "
+            f"{r['raw_bytes'] / 1e6:>8.1f} {disk / 1e6:>8.2f} {saved:>5.1f}%"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=CLI_ARCHIVE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report = sub.add_parser("report", help="Per-day responses and disk use")
+    report.add_argument("--day", action="append", help="YYYY-MM-DD, repeatable (default: all days)")
+
+    show = sub.add_parser("show", help="List a race's archived responses, optionally writing them out")
+    show.add_argument("race_id")
+    show.add_argument("--day", required=True)
+    show.add_argument("--start")
+    show.add_argument("--end")
+    show.add_argument("--out", help="Write each payload to <out>/<time>.json")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print(format_report(disk_report(args.dir, args.day)))
+        return
+
+    reader = ArchiveReader(args.day, args.dir)
+    entries = reader.race(args.race_id, args.start, args.end)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    for entry in entries:
+        print(f"{entry['t']}  {entry['hash']}  {entry['size']:>7} bytes")
+        if args.out:
+            name = entry["t"].replace(" ", "T").replace(":", "")
+            with open(os.path.join(args.out, f"{name}.json"), "wb") as f:
+                f.write(reader.read(entry))
+    logger.info(f"{len(entries)} responses, {len({e['hash'] for e in entries})} distinct")
+
+
+if __name__ == '__main__':
+    main()
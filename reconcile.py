@@ -0,0 +1,286 @@
+"""Nightly reconciliation: re-pull a finished day and patch what the live ticks missed.
+
+Once a day's last race is RECONCILE_DELAY past its start, every race event is
+fetched again (concurrently, under a rate limit) along with the day's
+schedule. Each stored race is compared with its event: status, runners and
+scratchings, and final placings are corrected, and races missing from Mongo
+are added. Only what differs is written, as targeted bulk updates. The day is
+then marked reconciled in tab_control.days with a coverage report (races
+without results, runners without odds snapshots).
+
+The tab-reconciler service (`reconcile.py --loop`) reconciles each UTC day
+once it has finished. By hand:
+
+  python reconcile.py --day 2026-05-20
+  python reconcile.py --day 2026-05-20 --report-only
+"""
+import time
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+import main as scraper
+from lease import CONTROL_DATABASE, MongoLease
+from mongodb_handler import MongoDBHandler
+from race_index import DAYS_COLLECTION, index_races
+from race_pipeline import RacePipeline
+from request_scheduler import Priority, RequestScheduler
+from tab_data_extractor import TabDataExtractor
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_DELAY = timedelta(hours=1)  # after the last race's start, so results have settled
+RECONCILE_WORKERS = 4
+RECONCILE_RATE_PER_SECOND = 5.0  # shares the API with the live scraper
+RECONCILE_CHECK_SECONDS = 600  # how often --loop looks for a day to reconcile
+RECONCILE_LEASE_SECONDS = 3600
+COVERAGE_EXAMPLES = 20
+
+
+def reconcile_race(race: Dict[str, Any], event: Dict[str, Any], now: datetime) -> List[str]:
+    """Correct a stored race from a fresh event. Returns what was corrected."""
+    corrected = []
+    status = race.get("status")
+    scraper.apply_event_status(race, event, now)
+    if race.get("status") != status:
+        corrected.append("status")
+
+    entries = race.setdefault("entries", {})
+    for runner in event.get("runners") or []:
+        if runner.get("runner_number") is None:
+            continue
+        num = str(runner["runner_number"])
+        entry = entries.get(num)
+        if entry is None:
+            entries[num] = scraper.new_entry(runner)
+            corrected.append("runners")
+        elif bool(entry.get("is_scratched")) != bool(runner.get("is_scratched", False)):
+            entry["is_scratched"] = runner.get("is_scratched", False)
+            corrected.append("scratchings")
+
+    results = event.get("results") or []
+    if race.get("status") == "abandoned":
+        if not race.get("results_abandoned"):
+            race["results_abandoned"] = True
+            corrected.append("abandoned")
+    elif results and race.get("status") != "interim":
+        before = {num: (e.get("results_rank"), e.get("results_margin"), e.get("results_plc"))
+                  for num, e in entries.items()}
+        placed = {str(p.get("runner_number")) for p in results}
+        for num, entry in entries.items():
+            if entry.get("results_plc") and num not in placed:
+                # placing lost on protest or correction
+                entry["results_plc"] = False
+                entry.pop("results_rank", None)
+                entry.pop("results_margin", None)
+        had_results = race.get("got_results")
+        scraper.apply_results(race, results)
+        after = {num: (e.get("results_rank"), e.get("results_margin"), e.get("results_plc"))
+                 for num, e in entries.items()}
+        if not had_results:
+            corrected.append("results_missing")
+        elif after != before:
+            corrected.append("results_changed")
+    race.pop("results_next_poll", None)
+    return sorted(set(corrected))
+
+
+def coverage_report(races: Dict[str, Any]) -> Dict[str, Any]:
+    """Races without results and unscratched runners without odds snapshots."""
+    no_results = [_id for _id, race in races.items()
+                  if not race.get("got_results") and not race.get("results_abandoned")]
+    runners = snapshots = 0
+    no_snapshots = []
+    for _id, race in races.items():
+        for num, entry in (race.get("entries") or {}).items():
+            if entry.get("is_scratched") or entry.get("scratched"):
+                continue
+            runners += 1
+            count = len(entry.get("odds") or {})
+            snapshots += count
+            if not count:
+                no_snapshots.append(f"{_id}#{num}")
+    return {
+        "races": len(races),
+        "with_results": sum(1 for race in races.values() if race.get("got_results")),
+        "abandoned": sum(1 for race in races.values() if race.get("results_abandoned")),
+        "without_results": len(no_results),
+        "runners": runners,
+        "runners_without_snapshots": len(no_snapshots),
+        "snapshots_per_runner": round(snapshots / runners, 1) if runners else 0.0,
+        "examples_without_results": no_results[:COVERAGE_EXAMPLES],
+        "examples_without_snapshots": no_snapshots[:COVERAGE_EXAMPLES],
+    }
+
+
+def format_coverage(day: str, coverage: Dict[str, Any]) -> str:
+    return (
+        f"Coverage {day}: {coverage['with_results']}/{coverage['races']} races with results, "
+        f"{coverage['abandoned']} abandoned, {coverage['without_results']} without | "
+        f"{coverage['runners_without_snapshots']}/{coverage['runners']} runners without odds snapshots, "
+        f"{coverage['snapshots_per_runner']} snapshots per runner"
+    )
+
+
+def is_reconciled(client, collection_name: str) -> bool:
+    doc = client[CONTROL_DATABASE][DAYS_COLLECTION].find_one({"_id": collection_name})
+    return bool(doc and doc.get("complete"))
+
+
+def day_finished(mongodb: MongoDBHandler, collection_name: str, now: datetime) -> bool:
+    """Whether the day's last race started at least RECONCILE_DELAY ago."""
+    mongodb.set_collection(collection_name)
+    starts = [scraper.race_start({"norm_time": t}) for t in mongodb.get_distinct("norm_time")]
+    starts = [t for t in starts if t is not None]
+    return bool(starts) and max(starts) + RECONCILE_DELAY <= now
+
+
+class Reconciler:
+    """Re-fetches one stored day and patches it in bulk."""
+
+    def __init__(self, mongodb: MongoDBHandler, data_extractor: TabDataExtractor,
+                 workers: int = RECONCILE_WORKERS, rate_per_second: float = RECONCILE_RATE_PER_SECOND):
+        self.mongodb = mongodb
+        self.data_extractor = data_extractor
+        self.workers = workers
+        self.rate_per_second = rate_per_second
+
+    def run(self, day: str, write: bool = True) -> Dict[str, Any]:
+        """Reconcile `day` (YYYY-MM-DD). Returns the coverage report, plus what was corrected."""
+        start = time.perf_counter()
+        now = scraper.now_utc()
+        collection_name = scraper.convert_date_to_collection_format(day)
+        self.mongodb.set_collection(collection_name)
+        races = scraper.reformat_collection_format(self.mongodb.get_all_documents() or []) or {}
+        snapshots = {_id: scraper.race_snapshot(race) for _id, race in races.items()}
+
+        corrections = Counter()
+        schedule = self.data_extractor.get_schedule_data(day)
+        added = []
+        for _id, race in scraper.extract_schedule_data(schedule, day).items():
+            if _id not in races and scraper.race_collection(race) == collection_name:
+                # missing from Mongo altogether: written whole
+                races[_id] = race
+                snapshots[_id] = scraper.race_snapshot({"_id": _id})
+                added.append(race)
+                corrections["races_added"] += 1
+        if added and write:
+            index_races(self.mongodb.client, added, {race["_id"]: collection_name for race in added})
+
+        scheduler = RequestScheduler(rate_per_second=self.rate_per_second, burst=self.workers,
+                                     max_depth={priority: None for priority in Priority})
+        race_of = {}
+        for _id in races:
+            race_of[scheduler.submit(Priority.BACKFILL, self.data_extractor.get_event_data, _id).seq] = _id
+        unfetched = []
+
+        def transform(request):
+            _id = race_of[request.seq]
+            if request.result is None:
+                unfetched.append(_id)
+                return None
+            corrections.update(reconcile_race(races[_id], request.result, now))
+            return _id, scraper.race_update_ops(races[_id], snapshots[_id])
+
+        def write_batch(updates):
+            if not write:
+                return len(updates)
+            return self.mongodb.bulk_update(updates, collection_name=collection_name, upsert=True)
+
+        pipeline = RacePipeline(transform, write_batch)
+        pipeline.run(scheduler, self.workers)
+        logger.info(pipeline.report())
+
+        coverage = coverage_report(races)
+        coverage.update(
+            corrections=dict(corrections),
+            races_patched=len(pipeline.changed),
+            unfetched=len(unfetched),
+            write_failures=pipeline.stats["write"].failed,
+            seconds=round(time.perf_counter() - start, 1),
+        )
+        complete = not unfetched and not pipeline.stats["write"].failed and schedule is not None
+        if write:
+            self.mongodb.client[CONTROL_DATABASE][DAYS_COLLECTION].update_one(
+                {"_id": collection_name},
+                {"$set": {"reconciled_at": now, "complete": complete, "coverage": coverage}},
+                upsert=True,
+            )
+        logger.info(f"Reconciled {day}: {len(pipeline.changed)} races patched {dict(corrections)} | "
+                    f"{len(unfetched)} events not fetched | {'complete' if complete else 'incomplete, rerun'}")
+        logger.info(format_coverage(day, coverage))
+        return coverage
+
+
+def reconcile_previous_day():
+    """Reconcile yesterday (UTC) if it is finished and not reconciled yet; one worker does it."""
+    now = scraper.now_utc()
+    day = (now - timedelta(days=1)).strftime(scraper.DATE_FORMAT)
+    collection_name = scraper.convert_date_to_collection_format(day)
+    mongodb = MongoDBHandler(database_name="tab")
+    if not mongodb.connect(timeout_ms=scraper.MONGO_TIMEOUT_MS):
+        return
+    lease = None
+    try:
+        if not mongodb.check_collection_in_db(collection_name) or is_reconciled(mongodb.client, collection_name):
+            return
+        if not day_finished(mongodb, collection_name, now):
+            return
+        lease = MongoLease(mongodb.client, f"reconcile:{collection_name}", RECONCILE_LEASE_SECONDS)
+        if not lease.try_acquire():
+            return
+        Reconciler(mongodb, TabDataExtractor(memo_ttl=0)).run(day)
+    except Exception as e:
+        logger.error(f"Reconciliation of {day} failed: {e}", exc_info=True)
+    finally:
+        if lease is not None:
+            lease.release()
+        mongodb.close_connection()
+
+
+def run_nightly_loop():
+    """Reconcile each day once it has finished; runs as its own service next to the scraper."""
+    while True:
+        reconcile_previous_day()
+        time.sleep(RECONCILE_CHECK_SECONDS)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    yesterday = (scraper.now_utc() - timedelta(days=1)).strftime(scraper.DATE_FORMAT)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--day", default=yesterday, help="YYYY-MM-DD (default yesterday)")
+    parser.add_argument("--loop", action="store_true", help="Stay running and reconcile each finished day")
+    parser.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    parser.add_argument("--rate", type=float, default=RECONCILE_RATE_PER_SECOND, help="API requests per second")
+    parser.add_argument("--report-only", action="store_true", help="Coverage report of the stored day, no fetching")
+    parser.add_argument("--dry-run", action="store_true", help="Fetch and compare, but write nothing")
+    args = parser.parse_args()
+    scraper.logger.setLevel(logging.WARNING)
+    if args.loop:
+        run_nightly_loop()
+        return
+
+    mongodb = MongoDBHandler(database_name="tab")
+    if not mongodb.connect():
+        logger.error("Failed to connect to MongoDB")
+        return
+    try:
+        collection_name = scraper.convert_date_to_collection_format(args.day)
+        if not mongodb.check_collection_in_db(collection_name):
+            logger.error(f"No collection {collection_name}; use backfill.py for days never scraped")
+            return
+        if args.report_only:
+            mongodb.set_collection(collection_name)
+            races = scraper.reformat_collection_format(mongodb.get_all_documents() or []) or {}
+            logger.info(format_coverage(args.day, coverage_report(races)))
+            return
+        Reconciler(mongodb, TabDataExtractor(memo_ttl=0), args.workers, args.rate).run(args.day, not args.dry_run)
+    finally:
+        mongodb.close_connection()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""Rebuild day collections from the raw response archive (see raw_archive.py).
+
+A day's archived responses are replayed in time order through the same code
+as a live tick: extract_schedule_data builds the day from its first archived
+schedule, and each tick runs update_race_data_local with main.py's clock set
+to the tick's time and the archive standing in for the API. A race gets the
+payload archived for it in that tick, or nothing (a failed fetch) if the live
+scraper did not poll it then. Nothing sleeps or touches the network, so a day
+replays at CPU speed; days are replayed in parallel worker processes (each
+needs its own clock) and written with bulk upserts.
+
+Races are routed as live: each schedule is read for the date it was requested
+for, and a race belongs to its meeting's racing day (main.race_collection).
+A racing day's schedule is pulled the day before and its races run across UTC
+midnight, so replaying a day reads the archive days either side of it too and
+keeps only the races routed to that day; each replay writes and validates
+exactly one collection.
+
+Ticks are recovered from the index: responses less than TICK_GAP_SECONDS
+apart belong to the same tick. A race archived twice within a tick keeps its
+latest response rather than starting a new tick.
+
+  python replay.py --archive api_archive --day 2026-05-20 --validate
+  python replay.py --archive api_archive --all --workers 4 --target-suffix ""   # overwrite live collections
+
+--validate compares the rebuilt races with the live-written collection.
+Odds timestamps are tick start times, so they can differ from live by the few
+seconds a tick spent fetching: snapshots are compared by count and by the
+final prices, not by timestamp.
+"""
+import os
+import time
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import main as scraper
+import payload_decoder
+from mongodb_handler import MongoDBHandler
+from raw_archive import ARCHIVE_DIR, CLI_ARCHIVE_DIR, ArchiveReader, archived_days, day_key
+from request_scheduler import Priority, RequestScheduler
+from tab_data_extractor import PRUNE_PAYLOADS, TabDataExtractor
+
+logger = logging.getLogger(__name__)
+
+TICK_GAP_SECONDS = 5  # responses further apart than this start a new tick
+TARGET_SUFFIX = "_replay"  # rebuilt day _20260520 is written to _20260520_replay
+WRITE_BATCH_SIZE = 1000
+REPLAY_BURST = 10 ** 9  # effectively no rate limit: nothing is fetched
+MISMATCH_EXAMPLES = 5
+
+
+Tick = Tuple[datetime, Dict[str, Dict[str, Any]], List[Dict[str, Any]]]
+
+
+def iter_ticks(entries: List[Dict[str, Any]]) -> Iterator[Tick]:
+    """Group time-ordered index entries into ticks: (tick time, event entry per race, schedule entries).
+
+    A race repeated within a tick keeps its latest entry.
+    """
+    start = last = None
+    events: Dict[str, Dict[str, Any]] = {}
+    schedules: List[Dict[str, Any]] = []
+    for entry in entries:
+        t = datetime.strptime(entry["t"], scraper.DATETIME_FORMAT)
+        if start is not None and (t - last).total_seconds() > TICK_GAP_SECONDS:
+            yield start, events, schedules
+            start, events, schedules = None, {}, []
+        if start is None:
+            start = t
+        last = t
+        if entry["kind"] == "schedule":
+            schedules.append(entry)
+        elif entry["race"]:
+            events[entry["race"]] = entry
+    if start is not None:
+        yield start, events, schedules
+
+
+class ArchiveExtractor:
+    """Stands in for TabDataExtractor, serving the payloads archived for the tick being replayed."""
+
+    def __init__(self, readers: List[ArchiveReader], prune_payloads: bool = PRUNE_PAYLOADS):
+        self.readers = {reader.day: reader for reader in readers}
+        self.prune_payloads = prune_payloads
+        self.tick_events: Dict[str, Dict[str, Any]] = {}
+        self.schedule_entry: Optional[Dict[str, Any]] = None
+        self.stats = Counter()
+
+    def _decode(self, entry: Dict[str, Any], kind: str) -> Optional[Dict]:
+        reader = self.readers[day_key(entry["t"][:10])]  # archived under the UTC day it was received
+        try:
+            payload = payload_decoder.decode(reader.read(entry), kind, self.prune_payloads)
+        except ValueError as e:
+            self.stats["undecodable"] += 1
+            logger.warning(f"Archived {kind} at {entry['t']} is not valid JSON: {e}")
+            return None
+        return TabDataExtractor._unwrap(payload)
+
+    def get_event_data(self, race_id: str, hedge: bool = False) -> Optional[Dict]:
+        entry = self.tick_events.get(race_id)
+        if entry is None:
+            self.stats["not_polled"] += 1
+            return None
+        self.stats["events"] += 1
+        return self._decode(entry, payload_decoder.EVENT)
+
+    def get_schedule_data(self, date: str = "today") -> Optional[Dict]:
+        if self.schedule_entry is None:
+            return None
+        return self._decode(self.schedule_entry, payload_decoder.SCHEDULE)
+
+
+def schedule_date(entry: Dict[str, Any], tick_time: datetime) -> str:
+    """Date an archived schedule was requested for (the API's "today" is the tick's UTC date)."""
+    date = entry.get("date")
+    if not date or date == "today":
+        return tick_time.strftime(scraper.DATE_FORMAT)
+    return date
+
+
+def replay_races(readers: List[ArchiveReader], collection_name: str,
+                 prune_payloads: bool = PRUNE_PAYLOADS) -> Tuple[Dict[str, Any], Counter]:
+    """Replay archived days in memory, keeping the races routed to `collection_name`.
+
+    Returns (race documents by id, stats).
+    """
+    extractor = ArchiveExtractor(readers, prune_payloads)
+    formatted_data: Dict[str, Any] = {}
+    stats = Counter()
+    no_limit = {priority: None for priority in Priority}
+    entries = [entry for reader in sorted(readers, key=lambda r: r.day) for entry in reader.entries]
+    try:
+        for tick_time, events, schedules in iter_ticks(entries):
+            scraper.set_clock(lambda: tick_time)
+            for entry in schedules:
+                # the first schedule creates the day, later ones only add races (as load_schedule does)
+                extractor.schedule_entry = entry
+                schedule = scraper.extract_schedule_data(extractor.get_schedule_data(), schedule_date(entry, tick_time))
+                for _id, race in schedule.items():
+                    if scraper.race_collection(race) == collection_name:
+                        formatted_data.setdefault(_id, race)
+            if not formatted_data:
+                stats["ticks_before_schedule"] += 1
+                continue
+
+            extractor.tick_events = events
+            request_scheduler = RequestScheduler(burst=REPLAY_BURST, max_depth=no_limit)
+            scraper.update_race_data_local(request_scheduler, extractor, formatted_data, fetch_workers=1)
+            stats["ticks"] += 1
+    finally:
+        scraper.set_clock()
+    stats.update(extractor.stats)
+    return formatted_data, stats
+
+
+def _last_odds(entry: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    odds = entry.get("odds") or {}
+    return odds[max(odds)] if odds else None
+
+
+def compare_race(replayed: Dict[str, Any], live: Dict[str, Any]) -> List[str]:
+    """Aspects in which a rebuilt race differs from the live one."""
+    diffs = [key for key in ("status", "got_results", "results_abandoned", "odds_closed", "norm_time")
+             if bool(replayed.get(key)) != bool(live.get(key))
+             or (key in ("status", "norm_time") and replayed.get(key) != live.get(key))]
+    replayed_entries = replayed.get("entries") or {}
+    live_entries = live.get("entries") or {}
+    if set(replayed_entries) != set(live_entries):
+        diffs.append("runners")
+    for num in set(replayed_entries) & set(live_entries):
+        ours, theirs = replayed_entries[num], live_entries[num]
+        if any(ours.get(key) != theirs.get(key) for key in ("results_rank", "results_plc")):
+            diffs.append("results")
+        if len(ours.get("odds") or {}) != len(theirs.get("odds") or {}):
+            diffs.append("snapshot_count")
+        if _last_odds(ours) != _last_odds(theirs):
+            diffs.append("final_odds")
+    return sorted(set(diffs))
+
+
+def validate(replayed: Dict[str, Any], live_documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compare rebuilt races with the live-written ones."""
+    live = {str(doc["_id"]): doc for doc in live_documents}
+    mismatches = Counter()
+    examples = []
+    matched = 0
+    for _id in replayed.keys() & live.keys():
+        diffs = compare_race(replayed[_id], live[_id])
+        if not diffs:
+            matched += 1
+            continue
+        mismatches.update(diffs)
+        if len(examples) < MISMATCH_EXAMPLES:
+            examples.append(f"{_id}: {', '.join(diffs)}")
+    return {
+        "compared": len(replayed.keys() & live.keys()),
+        "identical": matched,
+        "only_replayed": len(replayed.keys() - live.keys()),
+        "only_live": len(live.keys() - replayed.keys()),
+        "mismatches": dict(mismatches),
+        "examples": examples,
+    }
+
+
+def replay_day(day: str, archive_dir: str = ARCHIVE_DIR, target_suffix: str = TARGET_SUFFIX, write: bool = True,
+               check: bool = False, prune_payloads: bool = PRUNE_PAYLOADS) -> Dict[str, Any]:
+    """Replay one racing day and write and/or validate its collection. Runs in a worker process."""
+    start = time.perf_counter()
+    day = day_key(day)
+    racing_day = datetime.strptime(day, "%Y%m%d")
+    # the day's schedule is pulled the day before, and its races run on past UTC midnight
+    readers = [ArchiveReader((racing_day + timedelta(days=offset)).strftime("%Y%m%d"), archive_dir)
+               for offset in (-1, 0, 1)]
+    collection_name = scraper.convert_date_to_collection_format(day)
+    try:
+        races, stats = replay_races(readers, collection_name, prune_payloads)
+    finally:
+        for reader in readers:
+            reader.close()
+    result = {
+        "day": day,
+        "responses": sum(len(reader.entries) for reader in readers),
+        "races": len(races),
+        "stats": dict(stats),
+        "replay_seconds": time.perf_counter() - start,
+    }
+    if not races or not (write or check):
+        return result
+
+    mongodb = MongoDBHandler(database_name="tab")
+    if not mongodb.connect():
+        result["error"] = "could not connect to MongoDB"
+        return result
+    try:
+        if write:
+            target = collection_name + target_suffix
+            documents = list(races.values())
+            written = 0
+            for i in range(0, len(documents), WRITE_BATCH_SIZE):
+                written += mongodb.bulk_replace(documents[i:i + WRITE_BATCH_SIZE], collection_name=target) or 0
+            result.update(target=target, written=written)
+        if check:
+            mongodb.set_collection(collection_name)
+            result["validation"] = validate(races, mongodb.get_all_documents() or [])
+    finally:
+        mongodb.close_connection()
+    result["total_seconds"] = time.perf_counter() - start
+    return result
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    stats = result["stats"]
+    rate = result["responses"] / max(result["replay_seconds"], 1e-9)
+    line = (
+        f"{result['day']}: {result['responses']} responses -> {result['races']} races "
+        f"in {stats.get('ticks', 0)} ticks, {result['replay_seconds']:.1f}s ({rate:.0f} responses/s)"
+    )
+    if "error" in result:
+        line += f" | {result['error']}"
+    if "target" in result:
+        line += f" | wrote {result['written']} to {result['target']}"
+    check = result.get("validation")
+    if check:
+        line += (
+            f"\n  validation: {check['identical']}/{check['compared']} identical | "
+            f"only replayed {check['only_replayed']} | only live {check['only_live']} | {check['mismatches']}"
+        )
+        for example in check["examples"]:
+            line += f"\n    {example}"
+    return line
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--archive", default=CLI_ARCHIVE_DIR)
+    parser.add_argument("--day", action="append", help="YYYY-MM-DD, repeatable")
+    parser.add_argument("--all", action="store_true", help="Replay every archived day")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--target-suffix", default=TARGET_SUFFIX,
+                        help="Appended to the day's collection name; empty overwrites the live collection")
+    parser.add_argument("--no-write", action="store_true")
+    parser.add_argument("--validate", action="store_true", help="Compare with the live-written collection")
+    parser.add_argument("--full-payloads", action="store_true", help="Decode full payloads instead of pruned ones")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    days = archived_days(args.archive) if args.all else [day_key(d) for d in args.day or []]
+    if not days:
+        parser.error("give --day or --all")
+    if not args.verbose:
+        # per-race status and results lines from main.py
+        scraper.logger.setLevel(logging.WARNING)
+
+    start = time.perf_counter()
+    jobs = dict(archive_dir=args.archive, target_suffix=args.target_suffix, write=not args.no_write,
+                check=args.validate, prune_payloads=not args.full_payloads)
+    workers = max(1, min(args.workers, len(days)))
+    if workers == 1:
+        results = [replay_day(day, **jobs) for day in days]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(replay_day, day, **jobs) for day in days]
+            results = [future.result() for future in futures]
+
+    for result in results:
+        logger.info(format_result(result))
+    total = sum(r["responses"] for r in results)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Replayed {len(results)} days, {total} responses in {elapsed:.1f}s on {workers} workers")
+
+
+if __name__ == '__main__':
+    main()
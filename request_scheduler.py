@@ -0,0 +1,234 @@
+"""Priority-aware request scheduler in front of TabDataExtractor.
+
+Odds for races about to jump, results for finished races and schedule refreshes
+all share one HTTP path. Requests are queued by priority class, drained most
+urgent first under a global token-bucket rate limit (to stay polite to
+api.tab.co.nz), and low-priority work is shed when the tick deadline is tight.
+"""
+import time
+import heapq
+import threading
+import logging
+import itertools
+from enum import IntEnum
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from deadline import Deadline, DEFAULT_REQUEST_ESTIMATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_PER_SECOND = 10.0
+DEFAULT_BURST = 10
+
+
+class Priority(IntEnum):
+    IMMINENT_ODDS = 0
+    ODDS = 1
+    RESULTS = 2
+    SCHEDULE = 3
+    BACKFILL = 4
+
+
+# Max queued requests per class; further submissions are shed (None = unbounded)
+DEFAULT_MAX_DEPTH = {
+    Priority.IMMINENT_ODDS: None,
+    Priority.ODDS: None,
+    Priority.RESULTS: 200,
+    Priority.SCHEDULE: 5,
+    Priority.BACKFILL: 50,
+}
+
+# Extra budget a class needs left over before it may start, so low-priority
+# work is shed first as the deadline approaches
+PRESSURE_HEADROOM = {
+    Priority.IMMINENT_ODDS: 0.0,
+    Priority.ODDS: 0.0,
+    Priority.RESULTS: 0.5,
+    Priority.SCHEDULE: 2.0,
+    Priority.BACKFILL: 4.0,
+}
+
+
+class TokenBucket:
+    """Global rate limit: `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """Take a token, sleeping for it if needed. False if it would take longer than `max_wait`."""
+        self._refill()
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+            if max_wait is not None and wait > max_wait:
+                return False
+            self._sleep(wait)
+            self._refill()
+        self.tokens -= 1
+        return True
+
+
+@dataclass(order=True)
+class ScheduledRequest:
+    priority: Priority
+    seq: int
+    fn: Callable[..., Any] = field(compare=False)
+    args: tuple = field(compare=False, default=())
+    enqueued_at: float = field(compare=False, default=0.0)
+    result: Any = field(compare=False, default=None)
+    done: bool = field(compare=False, default=False)
+    shed: bool = field(compare=False, default=False)
+
+
+@dataclass
+class ClassStats:
+    submitted: int = 0
+    executed: int = 0
+    shed: int = 0
+    depth: int = 0
+    max_depth: int = 0
+    wait_ms: List[float] = field(default_factory=list)
+
+
+class RequestScheduler:
+    """Queues API calls by Priority and drains them under a rate limit and deadline."""
+
+    def __init__(
+        self,
+        deadline: Optional[Deadline] = None,
+        rate_per_second: float = DEFAULT_RATE_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+        max_depth: Optional[Dict[Priority, Optional[int]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.deadline = deadline
+        self.bucket = TokenBucket(rate_per_second, burst, clock=clock)
+        self.max_depth = max_depth or DEFAULT_MAX_DEPTH
+        self._clock = clock
+        self._queue: List[ScheduledRequest] = []
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self.stats: Dict[Priority, ClassStats] = {p: ClassStats() for p in Priority}
+
+    def submit(self, priority: Priority, fn: Callable[..., Any], *args) -> ScheduledRequest:
+        """Queue `fn(*args)`. The returned request is marked shed if the class queue is full."""
+        with self._lock:
+            stats = self.stats[priority]
+            stats.submitted += 1
+            request = ScheduledRequest(priority, next(self._seq), fn, args, self._clock())
+
+            limit = self.max_depth.get(priority)
+            if limit is not None and stats.depth >= limit:
+                request.shed = True
+                stats.shed += 1
+                return request
+
+            heapq.heappush(self._queue, request)
+            stats.depth += 1
+            stats.max_depth = max(stats.max_depth, stats.depth)
+            return request
+
+    def _can_start(self, priority: Priority) -> bool:
+        if self.deadline is None:
+            return True
+        estimate = DEFAULT_REQUEST_ESTIMATE + PRESSURE_HEADROOM[priority]
+        return self.deadline.can_start(priority.name.lower(), estimate)
+
+    def _dispatch(self) -> Optional[ScheduledRequest]:
+        """Pop the most urgent request that may still start, shedding those that may not.
+
+        Holds the lock while waiting for a rate-limit token, so requests leave
+        in priority order however many workers are draining. None when empty.
+        """
+        with self._lock:
+            while self._queue:
+                request = heapq.heappop(self._queue)
+                stats = self.stats[request.priority]
+                stats.depth -= 1
+
+                max_wait = None
+                if self.deadline is not None:
+                    max_wait = max(0.0, self.deadline.remaining() - self.deadline.reserve - DEFAULT_REQUEST_ESTIMATE)
+                if not self._can_start(request.priority) or not self.bucket.acquire(max_wait):
+                    request.shed = True
+                    stats.shed += 1
+                    continue
+
+                stats.wait_ms.append((self._clock() - request.enqueued_at) * 1000)
+                return request
+        return None
+
+    def _drain(self, on_done: Optional[Callable[[ScheduledRequest], None]]) -> int:
+        executed = 0
+        while True:
+            request = self._dispatch()
+            if request is None:
+                return executed
+            try:
+                request.result = request.fn(*request.args)
+            except Exception as e:
+                logger.error(f"Scheduled {request.priority.name} request failed: {e}", exc_info=True)
+            request.done = True
+            with self._lock:
+                self.stats[request.priority].executed += 1
+            executed += 1
+            if on_done is not None:
+                on_done(request)
+
+    def run(self, workers: int = 1, on_done: Optional[Callable[[ScheduledRequest], None]] = None) -> int:
+        """Execute queued requests most-urgent first. Returns the number executed.
+
+        Args:
+            workers: Threads executing requests concurrently (the rate limit is shared)
+            on_done: Called with each request as it completes, on the worker thread;
+                blocking in it holds that worker back (backpressure)
+        """
+        if workers <= 1:
+            return self._drain(on_done)
+
+        counts = []
+        threads = [
+            threading.Thread(target=lambda: counts.append(self._drain(on_done)), name=f"fetch-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(counts)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Per-class queue depth and wait-time summary."""
+        report = {}
+        for priority, stats in self.stats.items():
+            if not stats.submitted:
+                continue
+            waits = sorted(stats.wait_ms)
+            report[priority.name] = {
+                "submitted": stats.submitted,
+                "executed": stats.executed,
+                "shed": stats.shed,
+                "depth": stats.depth,
+                "max_depth": stats.max_depth,
+                "wait_avg_ms": sum(waits) / len(waits) if waits else 0.0,
+                "wait_max_ms": waits[-1] if waits else 0.0,
+            }
+        return report
+
+    def log_stats(self):
+        for name, stats in self.report().items():
+            logger.info(
+                f"Requests {name}: executed {stats['executed']}/{stats['submitted']} | shed {stats['shed']} | "
+                f"max depth {stats['max_depth']} | wait avg {stats['wait_avg_ms']:.0f}ms max {stats['wait_max_ms']:.0f}ms"
+            )
@@ -0,0 +1,107 @@
+"""Race ownership across several scraper workers.
+
+Each worker keeps a membership lease (`worker:<id>` in tab_control.leases)
+alive by renewing it every tick. The live workers form a consistent hash
+ring, and a race belongs to the worker that owns its meeting_code, so a
+meeting's races are always scraped together. When a worker joins or its lease
+lapses the ring is rebuilt, and only about 1/N of the meetings move.
+During the tick or two where workers disagree about membership, two of
+them may write the same race. Race updates are a compare-and-set on the
+_version each worker read; the loser's update is counted as a conflict (the
+tick's "Race writes" line) and re-applied, and as updates only $set changed
+fields and new odds snapshots keyed by timestamp (main.race_update_ops), both
+workers' snapshots survive.
+
+Enable with SCRAPER_SHARDING=1 (worker id: SCRAPER_WORKER_ID, default the
+hostname). Several local workers against the stub API and a local mongod:
+
+  python tab_api_stub.py serve --synthetic 40x10x14 --port 8080
+  TAB_API_BASE_URL=http://127.0.0.1:8080 SCRAPER_SHARDING=1 SCRAPER_WORKER_ID=w1 \\
+      TAB_CACHE_PHASE_FILE=/tmp/w1.json python main.py --loop
+  (repeat with w2, w3, ... in other shells)
+
+tests/test_sharding.py checks the split and rebalancing automatically.
+"""
+import os
+import socket
+import bisect
+import hashlib
+import logging
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+from pymongo.errors import PyMongoError
+from lease import CONTROL_DATABASE, LEASE_COLLECTION, MongoLease, utc_now
+
+logger = logging.getLogger(__name__)
+
+SHARDING_ENABLED = os.getenv("SCRAPER_SHARDING", "0") == "1"
+WORKER_ID = os.getenv("SCRAPER_WORKER_ID") or socket.gethostname()
+WORKER_LEASE_PREFIX = "worker:"
+WORKER_TTL_SECONDS = 90.0  # a worker missing this long loses its meetings
+VIRTUAL_NODES = 64  # ring points per worker, evens out the split
+
+
+def stable_hash(key: str) -> int:
+    """Process-independent hash (Python's hash() is salted per process)."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to workers."""
+
+    def __init__(self, workers: Iterable[str], vnodes: int = VIRTUAL_NODES):
+        self.workers = sorted(set(workers))
+        points = sorted((stable_hash(f"{worker}#{i}"), worker) for worker in self.workers for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [w for _, w in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, stable_hash(key)) % len(self._hashes)
+        return self._owners[idx]
+
+
+def shard_key(meeting_code: Optional[str]) -> str:
+    """Races are sharded by meeting so one meeting is never split between workers."""
+    return meeting_code or ""
+
+
+class ShardCoordinator:
+    """Membership heartbeat and ownership checks for one worker."""
+
+    def __init__(self, client, worker_id: str = WORKER_ID, ttl_seconds: float = WORKER_TTL_SECONDS,
+                 now: Callable[[], datetime] = utc_now):
+        self.worker_id = worker_id
+        self._now = now
+        self.membership = MongoLease(client, WORKER_LEASE_PREFIX + worker_id, ttl_seconds, owner=worker_id, now=now)
+        self._leases = client[CONTROL_DATABASE][LEASE_COLLECTION]
+        self.ring = HashRing([worker_id])
+
+    def heartbeat(self) -> bool:
+        """Renew membership and rebuild the ring from the live workers."""
+        if not self.membership.try_acquire():
+            logger.error(f"Could not renew membership for worker {self.worker_id}")
+            return False
+        self.ring = HashRing(self.live_workers() + [self.worker_id])
+        return True
+
+    def live_workers(self) -> List[str]:
+        try:
+            docs = self._leases.find({
+                "_id": {"$regex": f"^{WORKER_LEASE_PREFIX}"},
+                "expires_at": {"$gt": self._now()},
+            })
+            return [doc["owner"] for doc in docs]
+        except PyMongoError as e:
+            logger.warning(f"Could not list workers, keeping current ring: {e}")
+            return list(self.ring.workers)
+
+    def owns(self, key: str) -> bool:
+        return self.ring.owner(key) == self.worker_id
+
+    def owned_meetings(self, meeting_codes: Iterable[Optional[str]]) -> List[Optional[str]]:
+        return [code for code in meeting_codes if self.owns(shard_key(code))]
+
+    def summary(self, owned: int, total: int) -> str:
+        return f"Shard {self.worker_id}: {owned}/{total} meetings | workers {len(self.ring.workers)} {self.ring.workers}"
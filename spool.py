@@ -0,0 +1,344 @@
+"""Local write-ahead spool for race updates MongoDB could not take.
+
+When Mongo is unreachable, or a bulk write fails or is slower than
+MONGO_SLOW_WRITE_SECONDS, race updates are appended to a local JSONL spool
+(one fsync per batch) instead of being lost or holding up the tick. Each tick
+that reaches Mongo replays pending records in bulk from a background thread
+and checkpoints how far it got.
+
+Spooled updates are reduced to idempotent leaf $sets keyed by
+race/runner/timestamp (entries.<runner>.odds.<timestamp>, result fields, and
+flags that only ever become true), so replaying a record twice, or after
+newer live writes, gives the same document: exactly-once in effect.
+Races spooled while Mongo was down also carry their schedule fields, inserted
+only if the document does not exist yet ($setOnInsert).
+
+An update whose race document does not exist (yet) is not dropped: it goes
+back on the end of the spool and is retried on later flushes, up to
+SPOOL_MAX_REPLAYS times, before it is counted as orphaned.
+
+One spool directory per scraper worker (TAB_SPOOL_DIR); it must not be shared.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = os.getenv("TAB_SPOOL_DIR", "spool")
+SPOOL_FILE = "spool.jsonl"
+OFFSET_FILE = "spool.offset"
+MONGO_SLOW_WRITE_SECONDS = 2.0  # a bulk write slower than this diverts the rest of the tick to the spool
+# records replayed (and checkpointed) per chunk; each chunk's bulk writes must fit the
+# tick's Mongo socket timeout (main.MONGO_TIMEOUT_MS, 3s), and 1000 merged updates take
+# a few hundred ms on the production mongod
+FLUSH_CHUNK_RECORDS = 1000
+SPOOL_MAX_REPLAYS = 60  # flushes an update may wait for its race document before it is orphaned
+FLUSH_MIN_SECONDS = 1.0  # don't start a chunk with less tick budget than this
+
+# top-level race fields that only ever go from unset/False to True, safe to replay in any order
+STICKY_FLAGS = ("got_results", "odds_closed", "results_abandoned")
+
+Update = Tuple  # (race id, update operators), optionally + the _version read (see MongoDBHandler.bulk_update)
+
+
+def spool_sets(update: Dict[str, Any]) -> Dict[str, Any]:
+    """Idempotent leaf $set paths of a pipeline update (see race_update_ops).
+
+    A whole new entry is split into its fields and one path per odds
+    timestamp, so a replay never overwrites snapshots written since.
+    Non-monotonic top-level fields (status, start time, poll schedule) are
+    dropped; the next live tick re-derives them.
+    """
+    sets = {}
+    for path, value in (update.get("$set") or {}).items():
+        if path.startswith("entries."):
+            if path.count(".") == 1 and isinstance(value, dict):
+                for key, field in value.items():
+                    if key == "odds":
+                        for timestamp, snapshot in (field or {}).items():
+                            sets[f"{path}.odds.{timestamp}"] = snapshot
+                    else:
+                        sets[f"{path}.{key}"] = field
+            else:
+                sets[path] = value
+        elif path in STICKY_FLAGS and value:
+            sets[path] = value
+    return sets
+
+
+class Spool:
+    """Append-only JSONL spool with a byte-offset checkpoint."""
+
+    def __init__(self, directory: str = SPOOL_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, SPOOL_FILE)
+        self.offset_path = os.path.join(directory, OFFSET_FILE)
+        self.directory = directory
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ append
+
+    def _append(self, records: List[Dict[str, Any]]):
+        if not records:
+            return
+        data = "".join(json.dumps(r, separators=(",", ":"), default=str) + "\n" for r in records).encode("utf-8")
+        with self._lock, open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.stats["appended"] += len(records)
+        self.stats["fsyncs"] += 1
+
+    def append_updates(self, collection: str, updates: Iterable[Update]) -> int:
+        """Spool pipeline updates for `collection`; returns how many were taken."""
+        records = []
+        for race_id, update, *_ in updates:  # an expected _version is dropped: replays are idempotent
+            sets = spool_sets(update)
+            if sets:
+                records.append({"c": collection, "id": race_id, "set": sets})
+        self._append(records)
+        return len(records)
+
+    def append_inserts(self, collection: str, documents: Iterable[Dict[str, Any]]):
+        """Spool schedule documents, created on replay only if missing."""
+        records = [
+            {"c": collection, "id": doc["_id"], "insert": {k: v for k, v in doc.items() if k not in ("_id", "entries")}}
+            for doc in documents
+        ]
+        self._append(records)
+
+    # ------------------------------------------------------------------ flush
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_offset(self, offset: int):
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.offset_path)
+
+    def pending(self) -> bool:
+        try:
+            return os.path.getsize(self.path) > self._read_offset()
+        except OSError:
+            return False
+
+    def _read_chunk(self, offset: int, end: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Up to FLUSH_CHUNK_RECORDS complete records between `offset` and `end`, and the offset after them."""
+        records = []
+        with open(self.path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                f.seek(offset)
+                while len(records) < FLUSH_CHUNK_RECORDS and offset < end:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # end of file, or a record still being written
+                    offset += len(line)
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        self.stats["corrupt"] += 1
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return records, offset
+
+    @staticmethod
+    def _merge(records: List[Dict[str, Any]]) -> Dict[str, List[Tuple[Any, Dict[str, Any], bool, Dict[str, Any]]]]:
+        """Collapse records per race (later values win per path) into upserts/updates per collection.
+
+        Each update comes with the merged race, in spool record form, to re-spool it if it matches nothing.
+        """
+        merged: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        for record in records:
+            race = merged.setdefault((record["c"], record["id"]), {"set": {}, "insert": None, "tries": 0})
+            race["set"].update(record.get("set") or {})
+            if record.get("insert") and race["insert"] is None:
+                race["insert"] = record["insert"]
+            race["tries"] = max(race["tries"], record.get("tries", 0))
+
+        by_collection: Dict[str, List[Tuple[Any, Dict[str, Any], bool, Dict[str, Any]]]] = {}
+        for (collection, race_id), race in merged.items():
+            update: Dict[str, Any] = {"$inc": {"_version": 1}}
+            if race["set"]:
+                update["$set"] = race["set"]
+            if race["insert"]:
+                # $setOnInsert may not touch anything $set does
+                roots = {path.split(".")[0] for path in race["set"]}
+                update["$setOnInsert"] = {k: v for k, v in race["insert"].items() if k not in roots and k != "_version"}
+            record = {"c": collection, "id": race_id, "set": race["set"], "tries": race["tries"]}
+            if race["insert"]:
+                record["insert"] = race["insert"]
+            by_collection.setdefault(collection, []).append((race_id, update, race["insert"] is not None, record))
+        return by_collection
+
+    def _respool(self, records: List[Dict[str, Any]]):
+        """Put updates that matched no document back on the spool, or orphan them after SPOOL_MAX_REPLAYS."""
+        retry = []
+        for record in records:
+            record = dict(record, tries=record["tries"] + 1)
+            if record["tries"] >= SPOOL_MAX_REPLAYS:
+                self.stats["orphaned"] += 1
+                logger.warning(f"Orphaning spooled update for race {record['id']} in {record['c']}: "
+                               f"no document after {record['tries']} replays")
+            else:
+                retry.append(record)
+        self._append(retry)
+        self.stats["respooled"] += len(retry)
+
+    def flush(self, bulk_update: Callable[..., Optional[int]], deadline: Optional[Deadline] = None,
+              existing_ids: Optional[Callable[..., Optional[set]]] = None) -> int:
+        """Replay pending records chunk by chunk, checkpointing after each. Returns records replayed.
+
+        `bulk_update(updates, collection_name=..., upsert=...)` is MongoDBHandler.bulk_update,
+        `existing_ids(ids, collection_name=...)` MongoDBHandler.existing_ids. When an
+        update batch matches fewer documents than it holds, the updates of the missing
+        races (all of the batch without `existing_ids`) are re-spooled, see _respool.
+        Stops at the first failed write (the chunk is retried next time) or when
+        `deadline` runs low.
+        """
+        replayed = 0
+        if not os.path.exists(self.path):
+            return replayed
+        offset = self._read_offset()
+        flush_end = os.path.getsize(self.path)  # records re-spooled by this flush wait for the next one
+        while True:
+            if deadline is not None and deadline.remaining() - deadline.reserve < FLUSH_MIN_SECONDS:
+                break
+            records, end = self._read_chunk(offset, flush_end)
+            if not records:
+                break
+
+            unmatched = []
+            for collection, updates in self._merge(records).items():
+                for upsert in (True, False):
+                    batch = [(race_id, update) for race_id, update, is_upsert, _ in updates if is_upsert == upsert]
+                    if not batch:
+                        continue
+                    matched = bulk_update(batch, collection_name=collection, upsert=upsert)
+                    missing = None
+                    if matched is not None and matched < len(batch):
+                        ids = [race_id for race_id, _ in batch]
+                        found = existing_ids(ids, collection_name=collection) if existing_ids else set()
+                        missing = None if found is None else set(ids) - found
+                    if matched is None or (matched < len(batch) and missing is None):
+                        self.stats["flush_failed"] += 1
+                        logger.warning(f"Spool flush to {collection} failed, will retry")
+                        return replayed
+                    if missing:
+                        unmatched.extend(r for race_id, _, is_upsert, r in updates
+                                         if is_upsert == upsert and race_id in missing)
+            self._respool(unmatched)
+
+            offset = end
+            self._write_offset(offset)
+            replayed += len(records)
+            self.stats["replayed"] += len(records)
+
+        self._truncate_if_done()
+        return replayed
+
+    def _truncate_if_done(self):
+        with self._lock, open(self.path, "r+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size == self._read_offset():
+                    f.truncate(0)
+                    os.fsync(f.fileno())
+                    self._write_offset(0)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def start_flush(self, bulk_update: Callable[..., Optional[int]], deadline: Optional[Deadline] = None,
+                    existing_ids: Optional[Callable[..., Optional[set]]] = None) -> threading.Thread:
+        """Flush in a background thread; join it before closing the Mongo connection."""
+        def run():
+            start = time.perf_counter()
+            try:
+                replayed = self.flush(bulk_update, deadline, existing_ids)
+            except Exception as e:
+                logger.error(f"Spool flush failed: {e}", exc_info=True)
+                return
+            if replayed:
+                logger.info(f"Replayed {replayed} spooled records in {time.perf_counter() - start:.2f}s")
+
+        thread = threading.Thread(target=run, name="spool-flush", daemon=True)
+        thread.start()
+        return thread
+
+    # ------------------------------------------------------------------ degraded schedule
+
+    def load_schedule(self, collection: str, max_age_seconds: float) -> Optional[Dict[str, Any]]:
+        """The schedule cached while Mongo was down, if fresh enough."""
+        path = os.path.join(self.directory, f"schedule{collection}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > max_age_seconds:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_schedule(self, collection: str, schedule: Dict[str, Any]):
+        path = os.path.join(self.directory, f"schedule{collection}.json")
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(schedule, f)
+        except OSError as e:
+            logger.warning(f"Could not cache schedule: {e}")
+
+    def summary(self) -> str:
+        s = self.stats
+        return (
+            f"Spool: appended {s['appended']} ({s['fsyncs']} fsyncs) | replayed {s['replayed']} | "
+            f"respooled {s['respooled']} | orphaned {s['orphaned']} | pending {self.pending()}"
+        )
+
+
+class SpoolingWriter:
+    """Pipeline write_batch that diverts to the spool once Mongo fails or is slow this tick."""
+
+    def __init__(self, bulk_update: Callable[[List[Update]], Optional[int]], spool: Spool, collection: str,
+                 slow_seconds: float = MONGO_SLOW_WRITE_SECONDS):
+        self._bulk_update = bulk_update
+        self.spool = spool
+        self.collection = collection
+        self.slow_seconds = slow_seconds
+        self.diverted = False
+
+    def __call__(self, updates: List[Update]) -> Optional[int]:
+        if self.diverted:
+            self.spool.append_updates(self.collection, updates)
+            return len(updates)
+
+        start = time.perf_counter()
+        matched = self._bulk_update(updates)
+        elapsed = time.perf_counter() - start
+        if matched is None:
+            logger.warning("Mongo write failed, spooling the rest of this tick")
+            self.diverted = True
+            self.spool.append_updates(self.collection, updates)
+            return len(updates)
+        if elapsed > self.slow_seconds:
+            logger.warning(f"Mongo write took {elapsed:.1f}s, spooling the rest of this tick")
+            self.diverted = True
+        return matched
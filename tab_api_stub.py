@@ -0,0 +1,344 @@
+"""Local Affiliates v1 stub: record real responses, replay them, or serve synthetic days.
+
+Lets main.py, TabDataExtractor and trigger/scheduler.py run without touching
+api.tab.co.nz (point them at the stub with TAB_API_BASE_URL).
+
+Recording (against the live API):
+  python tab_api_stub.py record --out recordings/2026-05-20 --duration 600
+
+Replay (at 10x speed, 50ms extra latency, 5% errors):
+  python tab_api_stub.py serve --recording recordings/2026-05-20 --speed 10 --latency-ms 50 --error-rate 0.05
+
+Replayed responses take as long as they did when recorded (elapsed_ms), on
+top of any injected latency; --no-recorded-latency serves them at once.
+
+Synthetic day (40 meetings x 10 races x 14 runners):
+  python tab_api_stub.py serve --synthetic 40x10x14
+
+Synthetic races close at their start time and get final results
+SYNTHETIC_RESULTS_DELAY later, so the results path runs too.
+"""
+import os
+import json
+import time
+import uuid
+import random
+import bisect
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+)
+logger = logging.getLogger(__name__)
+
+SCHEDULE_PATH = "/affiliates/v1/racing/meetings"
+EVENT_PATH_PREFIX = "/affiliates/v1/racing/events/"
+RECORDING_FILE = "responses.jsonl"
+SYNTHETIC_RESULTS_DELAY = timedelta(minutes=1)  # after a synthetic race's start
+
+
+# ------------------------------------------------------------------ recording
+
+class ResponseRecorder:
+    """Append-only JSONL log of API responses with request timing.
+
+    Each line: {"t": seconds since recording start, "path": url path,
+    "elapsed_ms": request latency, "status": HTTP status, "body": payload}.
+    """
+
+    def __init__(self, out_dir: str):
+        os.makedirs(out_dir, exist_ok=True)
+        self.path = os.path.join(out_dir, RECORDING_FILE)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, path: str, status: int, elapsed_ms: float, body: Any):
+        line = json.dumps({
+            "t": round(time.time() - self.started, 3),
+            "path": path,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "status": status,
+            "body": body,
+        })
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def record_live(out_dir: str, duration: float, interval: float = 10.0, window_minutes: int = 10):
+    """Poll the live schedule once, then every race near its jump, recording everything."""
+    import requests
+    from tab_data_extractor import BASE_URL, USER_AGENT
+
+    recorder = ResponseRecorder(out_dir)
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+
+    def get(path: str, params: Optional[Dict] = None) -> Optional[Dict]:
+        start = time.perf_counter()
+        try:
+            response = session.get(BASE_URL + path, params=params, timeout=30)
+        except requests.RequestException as e:
+            logger.warning(f"Recording {path} failed: {e}")
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        recorder.record(path, response.status_code, elapsed_ms, body)
+        return body
+
+    schedule = get(SCHEDULE_PATH, {"date": "today"}) or {}
+    races = []
+    for meeting in (schedule.get("data") or {}).get("meetings") or []:
+        for race in meeting.get("races") or []:
+            if race.get("id") and race.get("start_time"):
+                start = datetime.fromisoformat(race["start_time"].replace("Z", "+00:00"))
+                races.append((race["id"], start))
+
+    end = time.time() + duration
+    while time.time() < end:
+        now = datetime.now(timezone.utc)
+        for race_id, start in races:
+            if abs((start - now).total_seconds()) <= window_minutes * 60:
+                get(EVENT_PATH_PREFIX + race_id)
+        time.sleep(interval)
+    logger.info(f"Recording written to {recorder.path}")
+
+
+# ------------------------------------------------------------------ response sources
+
+class Recording:
+    """Recorded responses indexed by path, replayed on a (possibly accelerated) clock."""
+
+    def __init__(self, recording_dir: str):
+        self.by_path: Dict[str, Tuple[List[float], List[Dict]]] = {}
+        with open(os.path.join(recording_dir, RECORDING_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                times, entries = self.by_path.setdefault(entry["path"], ([], []))
+                times.append(entry["t"])
+                entries.append(entry)
+
+    def lookup(self, path: str, elapsed: float) -> Optional[Dict]:
+        """Latest response for `path` recorded at or before `elapsed` replay seconds."""
+        if path not in self.by_path:
+            return None
+        times, entries = self.by_path[path]
+        idx = bisect.bisect_right(times, elapsed) - 1
+        return entries[max(idx, 0)]
+
+
+def synthetic_day(meetings: int, races: int, runners: int, start: Optional[datetime] = None,
+                  seed: int = 0) -> Dict[str, Any]:
+    """Generate a v1-shaped day: {"schedule": payload, "events": {race_id: payload}}.
+
+    Races are spread from `start` (default: now) at 5 minute intervals per
+    meeting so there is always something near its jump.
+    """
+    rng = random.Random(seed)
+    start = start or datetime.now(timezone.utc).replace(tzinfo=None)
+    schedule_meetings = []
+    events = {}
+    for m in range(meetings):
+        meeting_races = []
+        for r in range(races):
+            race_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            start_time = start + timedelta(minutes=5 * r + m % 5, seconds=rng.randint(0, 59))
+            start_iso = start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            meeting_races.append({
+                "id": race_id,
+                "name": f"Race {r + 1}",
+                "race_number": r + 1,
+                "start_time": start_iso,
+                "distance": rng.choice([1000, 1200, 1400, 1600, 2000]),
+                "track_condition": rng.choice(["Good", "Soft", "Heavy"]),
+                "weather": rng.choice(["Fine", "Overcast"]),
+            })
+            event_runners = []
+            for n in range(1, runners + 1):
+                fixed_win = round(rng.uniform(1.4, 60.0), 2)
+                event_runners.append({
+                    "runner_number": n,
+                    "name": f"Runner {m}-{r}-{n}",
+                    "barrier": n,
+                    "jockey": f"Jockey {n}",
+                    "trainer_name": f"Trainer {n}",
+                    "weight": 54 + n % 6,
+                    "is_scratched": rng.random() < 0.05,
+                    "odds": {"fixed_win": fixed_win, "fixed_place": round(1 + (fixed_win - 1) / 3.5, 2)},
+                })
+            events[race_id] = {
+                "race": {"id": race_id, "start_time": start_iso, "status": "Open"},
+                "runners": event_runners,
+                "results": [],
+            }
+        schedule_meetings.append({
+            "name": f"Meeting {m + 1}",
+            "meeting": f"M{m + 1:03d}",
+            "races": meeting_races,
+        })
+    return {"schedule": {"meetings": schedule_meetings}, "events": events}
+
+
+def finish_synthetic_race(event: Dict[str, Any], rng: Optional[random.Random] = None):
+    """Close a synthetic event and give it final results."""
+    rng = rng or random.Random(0)
+    runners = [r for r in event["runners"] if not r["is_scratched"]]
+    order = sorted(runners, key=lambda r: r["odds"]["fixed_win"] * rng.uniform(0.5, 1.5))
+    event["race"]["status"] = "Final"
+    event["results"] = [
+        {"runner_number": r["runner_number"], "name": r["name"], "position": i + 1, "margin_length": 0.5 * i}
+        for i, r in enumerate(order[:3])
+    ]
+
+
+def advance_synthetic_race(event: Dict[str, Any], now: datetime, rng: Optional[random.Random] = None,
+                           results_delay: timedelta = SYNTHETIC_RESULTS_DELAY):
+    """Move a synthetic event along its day: closed from its start, final `results_delay` later."""
+    if event["race"]["status"] == "Final":
+        return
+    start = datetime.fromisoformat(event["race"]["start_time"].replace("Z", "+00:00")).replace(tzinfo=None)
+    if now >= start + results_delay:
+        finish_synthetic_race(event, rng)
+    elif now >= start:
+        event["race"]["status"] = "Closed"
+
+
+# ------------------------------------------------------------------ server
+
+class StubConfig:
+    def __init__(self, recording: Optional[Recording] = None, synthetic: Optional[Dict[str, Any]] = None,
+                 speed: float = 1.0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0, recorded_latency: bool = True,
+                 advance_races: bool = True):
+        self.recording = recording
+        self.synthetic = synthetic
+        self.speed = speed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.recorded_latency = recorded_latency  # replay each response's recorded elapsed_ms
+        self.advance_races = advance_races  # close and result synthetic races as their start passes
+        self.started = time.time()
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def replay_elapsed(self) -> float:
+        return (time.time() - self.started) * self.speed
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Any):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Cache-Control", "max-age=30")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        config = self.config
+        config.requests += 1
+        path = urlparse(self.path).path
+
+        delay_ms = config.latency_ms + config.rng.uniform(0, config.jitter_ms)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        if config.rng.random() < config.error_rate:
+            config.errors += 1
+            self._send(503, {"error": "injected"})
+            return
+
+        if config.recording is not None:
+            entry = config.recording.lookup(path, config.replay_elapsed())
+            if entry is None:
+                self._send(404, {"error": "not recorded"})
+                return
+            if config.recorded_latency and entry.get("elapsed_ms"):
+                time.sleep(entry["elapsed_ms"] / 1000)
+            self._send(entry["status"], entry["body"])
+            return
+
+        day = config.synthetic
+        race_id = path[len(EVENT_PATH_PREFIX):]
+        if path == SCHEDULE_PATH:
+            self._send(200, {"data": day["schedule"]})
+        elif path.startswith(EVENT_PATH_PREFIX) and race_id in day["events"]:
+            event = day["events"][race_id]
+            with config.lock:
+                if config.advance_races:
+                    advance_synthetic_race(event, datetime.now(timezone.utc).replace(tzinfo=None), config.rng)
+                body = json.loads(json.dumps({"data": event}))
+            self._send(200, body)
+        else:
+            self._send(404, {"error": "unknown path"})
+
+
+def start_stub_server(config: StubConfig, port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub in a daemon thread; its URL is http://127.0.0.1:<server.server_address[1]>."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    record = sub.add_parser("record", help="Record live API responses")
+    record.add_argument("--out", required=True)
+    record.add_argument("--duration", type=float, default=600)
+    record.add_argument("--interval", type=float, default=10)
+
+    serve = sub.add_parser("serve", help="Serve recorded or synthetic responses")
+    serve.add_argument("--recording")
+    serve.add_argument("--synthetic", help="MEETINGSxRACESxRUNNERS, e.g. 40x10x14")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--speed", type=float, default=1.0)
+    serve.add_argument("--latency-ms", type=float, default=0.0)
+    serve.add_argument("--jitter-ms", type=float, default=0.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--no-recorded-latency", action="store_true", help="Serve recorded responses at once")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_live(args.out, args.duration, args.interval)
+        return
+
+    recording = Recording(args.recording) if args.recording else None
+    synthetic = None
+    if recording is None:
+        meetings, races, runners = (int(x) for x in (args.synthetic or "10x8x12").split("x"))
+        synthetic = synthetic_day(meetings, races, runners)
+    config = StubConfig(recording, synthetic, args.speed, args.latency_ms, args.jitter_ms, args.error_rate,
+                        recorded_latency=not args.no_recorded_latency)
+    server = start_stub_server(config, args.port)
+    logger.info(f"Stub API on http://127.0.0.1:{server.server_address[1]} (TAB_API_BASE_URL)")
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Served {config.requests} requests ({config.errors} injected errors)")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
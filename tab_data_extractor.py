@@ -6,31 +6,270 @@ live at https://api.tab.co.nz/affiliates/v1/ — public, unauthenticated, with a
 30-second cache.
 """
 
+import os
 import json
+import time
+import random
+import logging
+import threading
 import requests
-from typing import Dict, Optional
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from deadline import Deadline
+import payload_decoder
+
+logger = logging.getLogger(__name__)
 
 USER_AGENT = "Mozilla/5.0"
+# Point at a local stub server for testing, e.g. http://localhost:8080
+BASE_URL = os.getenv("TAB_API_BASE_URL", "https://api.tab.co.nz")
+REQUEST_TIMEOUT = 30  # seconds, upper bound when no deadline applies
+MIN_REQUEST_TIMEOUT = 0.5  # not worth starting a request with less budget than this
+
+# Hedged requests: if the first request has not returned within the observed
+# p95 latency, a duplicate is sent on a second connection and whichever
+# finishes first wins
+HEDGE_DEFAULT_DELAY = 1.0  # seconds, used until enough latencies are observed
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Retries with jittered exponential backoff, kept inside the tick deadline
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 0.2  # seconds
+RETRY_BACKOFF_MAX = 2.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# Circuit breaker: after this many consecutive failed calls, fail fast for
+# BREAKER_RESET_SECONDS, then let a single probe through
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+# Single-flight: concurrent requests for the same event/schedule share one HTTP
+# call, and a successful payload is reused for MEMO_TTL_SECONDS (well inside the
+# API's own 30 second cache, so nothing staler than the API would serve)
+MEMO_TTL_SECONDS = float(os.getenv("TAB_MEMO_TTL_SECONDS", "2"))
+
+# Decode only the fields the scraper reads (needs msgspec, see payload_decoder)
+PRUNE_PAYLOADS = os.getenv("TAB_PRUNE_PAYLOADS", "1") != "0"
+
+
+class RetryableError(Exception):
+    """Response worth retrying (5xx, 429 or a body that is not JSON)."""
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe -> closed on success."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a request may go out. In half-open state only one probe is in flight."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                logger.info("Circuit breaker half-open, probing API")
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker closed, API recovered")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    logger.warning(f"Circuit breaker open after {self.consecutive_failures} failures")
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+
+    def record_abandoned(self):
+        """A call cut short by its caller (e.g. the deadline) says nothing about the API: counted neither way."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # let the probe go: opened_at is already reset_seconds back, so the next call probes again
+                self.state = self.OPEN
+
+
+# Shared by every extractor in the process, so a long-running scheduler keeps
+# failing fast across extractor instances while the API is down
+API_BREAKER = CircuitBreaker()
 
 
 class TabDataExtractor:
-    def __init__(self):
-        self.base_url = "https://api.tab.co.nz"
+    def __init__(self, deadline: Optional[Deadline] = None, base_url: str = BASE_URL,
+                 breaker: CircuitBreaker = API_BREAKER, prune_payloads: bool = PRUNE_PAYLOADS,
+                 memo_ttl: float = MEMO_TTL_SECONDS, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            deadline: Optional tick deadline; requests then time out with the
+                remaining budget instead of REQUEST_TIMEOUT
+            base_url: API root, overridable for a local stub server
+            breaker: Circuit breaker guarding the API
+            prune_payloads: Decode schedule/event payloads down to the fields
+                the scraper uses; disable to get the full API response
+            memo_ttl: Seconds a fetched payload is reused for repeat requests
+                (0 disables the memo; in-flight requests are still shared)
+            clock: Monotonic clock for memo expiry
+        """
+        self.deadline = deadline
+        self.prune_payloads = prune_payloads
+        self.breaker = breaker
+        self.failures = Counter()
+        self.base_url = base_url
         self.endpoints = {
             "schedule": "/affiliates/v1/racing/meetings",
             "event": "/affiliates/v1/racing/events/{race_id}",
         }
         self._headers = {"User-Agent": USER_AGENT}
+        # Keep-alive session so repeated event fetches reuse a warm connection
+        self._session = requests.Session()
+        self._session.headers.update(self._headers)
+        # Separate connection for hedges, so a stuck primary connection is not reused
+        self._hedge_session = requests.Session()
+        self._hedge_session.headers.update(self._headers)
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._stats_lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "saved_ms": []}
+        self.memo_ttl = memo_ttl
+        self._clock = clock
+        self._flight_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._memo: Dict[str, Tuple[float, Any]] = {}
+        self.flight_stats = Counter()
+        # Called as hook(url, response) after every successful response
+        self.response_hooks: List[Callable[[str, requests.Response], None]] = []
 
-    def fetch_json_data(self, url: str, params: Optional[Dict] = None) -> Optional[Dict]:
-        """Fetch JSON from URL with User-Agent header. Returns None on error."""
-        try:
-            response = requests.get(url, headers=self._headers, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error fetching data from {url}: {str(e)}")
+    def p95_latency(self) -> float:
+        """p95 of recent successful request latencies (seconds)."""
+        with self._stats_lock:
+            samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def fetch_json_data(self, url: str, params: Optional[Dict] = None,
+                        session: Optional[requests.Session] = None, kind: Optional[str] = None) -> Optional[Dict]:
+        """Fetch JSON from URL with bounded, jittered retries.
+
+        `kind` (payload_decoder.SCHEDULE/EVENT) selects field-pruned decoding.
+
+        Returns None on error, while the circuit breaker is open, or when the
+        deadline leaves no room; each case is counted in self.failures.
+        """
+        return self._use_response(url, self._fetch_response(url, params, session, kind))
+
+    def _fetch_response(self, url: str, params: Optional[Dict], session: Optional[requests.Session],
+                        kind: Optional[str]) -> Optional[Tuple[Dict, requests.Response, float]]:
+        """fetch_json_data without the latency sample and response hooks: (payload, response, seconds) or None."""
+        if self.deadline is not None and self.deadline.remaining() < MIN_REQUEST_TIMEOUT:
+            self._count_failure("deadline")
+            logger.debug(f"Skipping {url}: deadline exhausted")
+            return None
+
+        if not self.breaker.allow():
+            self._count_failure("breaker_open")
+            return None
+
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            timeout = REQUEST_TIMEOUT
+            if self.deadline is not None:
+                # retries only start with at least MIN_REQUEST_TIMEOUT left (see backoff below)
+                timeout = max(MIN_REQUEST_TIMEOUT, self.deadline.timeout(REQUEST_TIMEOUT))
+
+            try:
+                start = time.perf_counter()
+                response = (session or self._session).get(url, params=params, timeout=timeout)
+                if response.status_code in RETRYABLE_STATUS:
+                    raise RetryableError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                try:
+                    payload = payload_decoder.decode(response.content, kind, self.prune_payloads)
+                except ValueError as e:
+                    raise RetryableError(f"invalid JSON: {e}")
+            except requests.HTTPError as e:
+                # 4xx: the API answered, retrying will not help
+                self.breaker.record_success()
+                self._count_failure(f"http_{e.response.status_code if e.response is not None else 'error'}")
+                logger.warning(f"Error fetching data from {url}: {e}")
+                return None
+            except (requests.RequestException, RetryableError) as e:
+                self._count_failure(self._failure_kind(e))
+                logger.info(f"Attempt {attempt}/{RETRY_ATTEMPTS} failed for {url}: {e}")
+                backoff = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (attempt - 1)))
+                if attempt == RETRY_ATTEMPTS:
+                    break
+                if self.deadline is not None and self.deadline.remaining() - backoff < MIN_REQUEST_TIMEOUT:
+                    # the tick ran out, not the API: only exhausted retries count towards the breaker
+                    self.breaker.record_abandoned()
+                    self._count_failure("deadline_truncated")
+                    logger.warning(f"Giving up on {url} after {attempt} attempts, deadline reached")
+                    return None
+                time.sleep(backoff)
+                continue
+
+            self.breaker.record_success()
+            return payload, response, time.perf_counter() - start
+
+        self.breaker.record_failure()
+        self._count_failure("gave_up")
+        logger.warning(f"Giving up on {url} after retries")
+        return None
+
+    def _use_response(self, url: str, fetched: Optional[Tuple[Dict, requests.Response, float]]) -> Optional[Dict]:
+        """Record a _fetch_response result's latency, pass its response to the hooks and return its payload."""
+        if fetched is None:
             return None
+        payload, response, seconds = fetched
+        with self._stats_lock:
+            self.latencies.append(seconds)
+        for hook in self.response_hooks:
+            try:
+                hook(url, response)
+            except Exception as e:
+                logger.warning(f"Response hook failed for {url}: {e}")
+        return payload
+
+    @staticmethod
+    def _failure_kind(error: Exception) -> str:
+        if isinstance(error, requests.Timeout):
+            return "timeout"
+        if isinstance(error, requests.ConnectionError):
+            return "connection"
+        if isinstance(error, RetryableError):
+            return "retryable_response"
+        return "request_error"
+
+    def _count_failure(self, kind: str):
+        with self._stats_lock:
+            self.failures[kind] += 1
+
+    def failure_report(self) -> str:
+        with self._stats_lock:
+            counts = " ".join(f"{k}={v}" for k, v in sorted(self.failures.items())) or "none"
+        return f"API failures: {counts} | breaker {self.breaker.state} (opened {self.breaker.times_opened}x)"
 
     @staticmethod
     def _unwrap(payload: Optional[Dict]) -> Optional[Dict]:
@@ -39,23 +278,146 @@ class TabDataExtractor:
             return None
         return payload.get("data")
 
+    def _single_flight(self, key: str, fetch: Callable[[], Optional[Dict]]) -> Optional[Dict]:
+        """Run `fetch` once for concurrent or repeated calls with the same key.
+
+        A fresh memoised payload is returned straight away, a caller arriving
+        while the same key is in flight waits for that request, and otherwise
+        the caller fetches. Failures (None) are never memoised. Payloads are
+        shared between callers, so they must not be mutated.
+        """
+        with self._flight_lock:
+            now = self._clock()
+            memo = self._memo.get(key)
+            if memo is not None and memo[0] > now:
+                self.flight_stats["memo_hit"] += 1
+                return memo[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self._inflight[key] = flight
+                self.flight_stats["miss"] += 1
+            else:
+                self.flight_stats["coalesced"] += 1
+
+        if not leader:
+            return flight.result()
+
+        result = None
+        try:
+            result = fetch()
+        finally:
+            with self._flight_lock:
+                del self._inflight[key]
+                now = self._clock()
+                for stale in [k for k, (expires, _) in self._memo.items() if expires <= now]:
+                    del self._memo[stale]
+                if result is not None and self.memo_ttl > 0:
+                    self._memo[key] = (now + self.memo_ttl, result)
+            flight.set_result(result)
+        return result
+
+    def coalesce_report(self) -> str:
+        with self._flight_lock:
+            stats = Counter(self.flight_stats)
+        total = sum(stats.values())
+        shared = stats["memo_hit"] + stats["coalesced"]
+        rate = shared / total * 100 if total else 0.0
+        return (
+            f"Single-flight: {stats['miss']} fetched | {stats['coalesced']} coalesced | "
+            f"{stats['memo_hit']} memo hits ({rate:.1f}% of {total} requests shared)"
+        )
+
     def get_schedule_data(self, date: str = "today") -> Optional[Dict]:
         """List all race meetings for `date` (default today). Returns dict with `meetings`."""
         url = self.base_url + self.endpoints["schedule"]
-        return self._unwrap(self.fetch_json_data(url, params={"date": date}))
+        return self._single_flight(
+            f"schedule:{date}",
+            lambda: self._unwrap(self.fetch_json_data(url, params={"date": date}, kind=payload_decoder.SCHEDULE)),
+        )
 
-    def get_event_data(self, race_id: str) -> Optional[Dict]:
-        """Fetch a single race event (runners + odds + results)."""
+    def get_event_data(self, race_id: str, hedge: bool = False) -> Optional[Dict]:
+        """Fetch a single race event (runners + odds + results).
+
+        With `hedge`, a duplicate request is sent if the first is slower than
+        the observed p95 latency; use it for the final snapshots before a jump.
+        Repeat requests for the same race share one fetch (see _single_flight).
+        """
         url = self.base_url + self.endpoints["event"].format(race_id=race_id)
-        return self._unwrap(self.fetch_json_data(url))
+        if hedge:
+            fetch = lambda: self._unwrap(self.fetch_json_data_hedged(url, kind=payload_decoder.EVENT))
+        else:
+            fetch = lambda: self._unwrap(self.fetch_json_data(url, kind=payload_decoder.EVENT))
+        return self._single_flight(f"event:{race_id}", fetch)
+
+    def fetch_json_data_hedged(self, url: str, params: Optional[Dict] = None,
+                               kind: Optional[str] = None) -> Optional[Dict]:
+        """fetch_json_data with a hedge request after p95 latency; first successful response wins.
+
+        Only the winning response is recorded and passed to the response hooks, so a
+        hedged fetch counts once, like any other.
+        """
+        if self._hedge_pool is None:
+            self._hedge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedge")
+
+        start = time.perf_counter()
+        delay = self.p95_latency()
+        primary = self._hedge_pool.submit(self._fetch_response, url, params, None, kind)
+        with self._stats_lock:
+            self.hedge_stats["requests"] += 1
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return self._use_response(url, primary.result())
+
+        hedge = self._hedge_pool.submit(self._fetch_response, url, params, self._hedge_session, kind)
+        with self._stats_lock:
+            self.hedge_stats["hedged"] += 1
+
+        pending = {primary, hedge}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            finished = done.pop()
+            result = finished.result()
+            if result is not None:
+                if finished is hedge:
+                    self._record_hedge_win(primary, start)
+                break
+        return self._use_response(url, result)
+
+    def _record_hedge_win(self, primary, start: float):
+        """Once the losing primary completes, record how much the hedge saved."""
+        won_at = time.perf_counter()
+        with self._stats_lock:
+            self.hedge_stats["hedge_won"] += 1
+
+        def record(_):
+            with self._stats_lock:
+                self.hedge_stats["saved_ms"].append((time.perf_counter() - won_at) * 1000)
+
+        primary.add_done_callback(record)
+
+    def hedge_report(self) -> str:
+        with self._stats_lock:
+            stats = dict(self.hedge_stats)
+            saved = list(stats["saved_ms"])
+        requests_made = stats["requests"]
+        rate = stats["hedged"] / requests_made * 100 if requests_made else 0.0
+        avg_saved = sum(saved) / len(saved) if saved else 0.0
+        return (
+            f"Hedging: {stats['hedged']}/{requests_made} hedged ({rate:.1f}%) | "
+            f"hedge won {stats['hedge_won']} | avg tail saved {avg_saved:.0f}ms | p95 {self.p95_latency() * 1000:.0f}ms"
+        )
 
     def save_to_file(self, data: Dict, filename: str) -> None:
         try:
             with open(filename, "w", encoding="utf-8") as f:
                 json.dump(data, f, indent=4)
-            print(f"Data successfully saved to {filename}")
+            logger.info(f"Data successfully saved to {filename}")
         except IOError as e:
-            print(f"Error saving data to file: {str(e)}")
+            logger.error(f"Error saving data to file: {str(e)}")
 
 
 def main():
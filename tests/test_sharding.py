@@ -0,0 +1,223 @@
+"""Several sharded workers against tab_api_stub: meetings and fetches split disjointly and rebalance.
+
+Workers share one mongomock client and run their ticks concurrently in threads.
+With TAB_TEST_MONGODB_URI set, the same check also runs one process per worker
+against that mongod. It drops the tab and tab_control databases there, so point
+it at a throwaway server, e.g. `docker run -p 27018:27017 mongo` and
+TAB_TEST_MONGODB_URI=mongodb://localhost:27018/.
+"""
+import os
+import threading
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Set
+
+import pytest
+
+import main as scraper
+from mongodb_handler import MongoDBHandler
+from request_scheduler import RequestScheduler
+from sharding import WORKER_TTL_SECONDS, ShardCoordinator, shard_key
+from tab_api_stub import StubConfig, start_stub_server, synthetic_day
+from tab_data_extractor import CircuitBreaker, TabDataExtractor
+
+MEETINGS = 24
+MONGODB_URI = os.getenv("TAB_TEST_MONGODB_URI")
+
+
+def handler_for(client) -> MongoDBHandler:
+    mongodb = MongoDBHandler(database_name="tab")
+    mongodb.client = client
+    mongodb.db = client["tab"]
+    return mongodb
+
+
+def extractor_for(base_url: str, fetched: Set[str]) -> TabDataExtractor:
+    """An extractor adding the id of every race it fetches to `fetched`."""
+    data_extractor = TabDataExtractor(base_url=base_url, breaker=CircuitBreaker(), memo_ttl=0)
+    event_path = data_extractor.endpoints["event"].format(race_id="")
+    data_extractor.response_hooks.append(
+        lambda url, response: fetched.add(url.rsplit("/", 1)[-1]) if event_path in url else None
+    )
+    return data_extractor
+
+
+def worker_tick(client, coordinator: ShardCoordinator, base_url: str) -> Set[str]:
+    """One sharded tick: the ids of the races the worker fetched."""
+    fetched: Set[str] = set()
+    scraper.extract_and_update_races(handler_for(client), extractor_for(base_url, fetched), RequestScheduler(),
+                                     coordinator)
+    return fetched
+
+
+def expected_fetches(client, now: datetime) -> Set[str]:
+    """Races an unsharded tick at `now` would fetch."""
+    formatted_data, _ = scraper.read_active_races(handler_for(client), now)
+    due, _ = scraper.select_results_races(formatted_data, now)
+    return set(scraper.select_odds_races(formatted_data, now)) | set(due)
+
+
+def meeting_of(client) -> Dict[str, str]:
+    return {doc["_id"]: doc["meeting_code"]
+            for name in client["tab"].list_collection_names()
+            for doc in client["tab"][name].find({}, {"meeting_code": 1})}
+
+
+def owners(coordinators: List[ShardCoordinator], meeting_codes) -> Dict[str, List[str]]:
+    """meeting code -> workers claiming it."""
+    return {code: [c.worker_id for c in coordinators if c.owns(shard_key(code))] for code in meeting_codes}
+
+
+def assert_partitioned(fetched: Dict[str, Set[str]], expected: Set[str], coordinators, meeting_codes, client):
+    claims = owners(coordinators, meeting_codes)
+    assert all(len(workers) == 1 for workers in claims.values()), claims
+    ids = [race_id for races in fetched.values() for race_id in races]
+    assert len(ids) == len(set(ids)), "a race was fetched by two workers"
+    assert set(ids) == expected
+    meetings = meeting_of(client)
+    for worker_id, races in fetched.items():
+        assert all(claims[meetings[race_id]] == [worker_id] for race_id in races)
+
+
+def run_ticks(client, coordinators: List[ShardCoordinator], base_url: str) -> Dict[str, Set[str]]:
+    """Tick every worker concurrently, as separate scrapers would."""
+    fetched: Dict[str, Set[str]] = {}
+
+    def tick(coordinator):
+        fetched[coordinator.worker_id] = worker_tick(client, coordinator, base_url)
+
+    threads = [threading.Thread(target=tick, args=(c,)) for c in coordinators]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return fetched
+
+
+def heartbeat(coordinators: List[ShardCoordinator]):
+    # twice: in the first round early workers have not seen the later ones yet
+    for _ in range(2):
+        for coordinator in coordinators:
+            assert coordinator.heartbeat()
+
+
+def seed_day(client, base_url: str, now: datetime):
+    date = now.strftime(scraper.DATE_FORMAT)
+    schedule = TabDataExtractor(base_url=base_url, breaker=CircuitBreaker()).get_schedule_data(date)
+    assert scraper.load_schedule(handler_for(client), schedule, date) is not None
+
+
+@pytest.fixture
+def now():
+    frozen = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    scraper.set_clock(lambda: frozen)
+    yield frozen
+    scraper.set_clock()
+
+
+@pytest.fixture
+def stub_url(now):
+    day = synthetic_day(meetings=MEETINGS, races=3, runners=6, start=now - timedelta(minutes=3))
+    server = start_stub_server(StubConfig(synthetic=day, advance_races=False))
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def client(monkeypatch, stub_url, now):
+    mongomock = pytest.importorskip("mongomock")
+
+    # mongomock cannot run pymongo's UpdateOne through bulk_write; apply them one by one
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = type("BulkWriteResult", (), {"matched_count": 0, "upserted_count": 0})()
+        for op in requests:
+            update = self.update_one(op._filter, op._doc, upsert=op._upsert)
+            result.matched_count += update.matched_count
+            result.upserted_count += update.upserted_id is not None
+        return result
+
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write, raising=False)
+    mongo_client = mongomock.MongoClient()
+    seed_day(mongo_client, stub_url, now)
+    return mongo_client
+
+
+def test_workers_fetch_disjoint_shards(client, stub_url, now):
+    coordinators = [ShardCoordinator(client, f"w{i}") for i in range(1, 4)]
+    heartbeat(coordinators)
+    expected = expected_fetches(client, now)
+    assert expected
+
+    fetched = run_ticks(client, coordinators, stub_url)
+
+    assert_partitioned(fetched, expected, coordinators, set(meeting_of(client).values()), client)
+    assert sum(bool(races) for races in fetched.values()) > 1, "one worker fetched everything"
+
+
+def test_shards_rebalance_when_workers_leave_and_join(client, stub_url, now):
+    lease_clock = [datetime.now(timezone.utc).replace(tzinfo=None)]
+    coordinators = {w: ShardCoordinator(client, w, now=lambda: lease_clock[0]) for w in ("w1", "w2", "w3")}
+    heartbeat(list(coordinators.values()))
+    meeting_codes = set(meeting_of(client).values())
+    before = {code: workers[0] for code, workers in owners(list(coordinators.values()), meeting_codes).items()}
+
+    # w3 stops heartbeating: once its membership lapses the others take over only its meetings
+    lease_clock[0] += timedelta(seconds=WORKER_TTL_SECONDS + 1)
+    remaining = [coordinators["w1"], coordinators["w2"]]
+    heartbeat(remaining)
+    after_leave = {code: workers[0] for code, workers in owners(remaining, meeting_codes).items()}
+    moved = {code for code in meeting_codes if after_leave[code] != before[code]}
+    assert moved == {code for code, worker in before.items() if worker == "w3"}
+    assert_partitioned(run_ticks(client, remaining, stub_url), expected_fetches(client, now), remaining,
+                       meeting_codes, client)
+
+    # w4 joins: it takes meetings from the others, and nothing moves between w1 and w2
+    joined = remaining + [ShardCoordinator(client, "w4", now=lambda: lease_clock[0])]
+    heartbeat(joined)
+    after_join = {code: workers[0] for code, workers in owners(joined, meeting_codes).items()}
+    moved = {code for code in meeting_codes if after_join[code] != after_leave[code]}
+    assert moved and all(after_join[code] == "w4" for code in moved)
+    assert_partitioned(run_ticks(client, joined, stub_url), expected_fetches(client, now), joined,
+                       meeting_codes, client)
+
+
+def process_worker(uri: str, worker_id: str, base_url: str, now: datetime, barrier, results):
+    """A worker process: join, wait for the others, heartbeat again and tick once."""
+    from pymongo import MongoClient
+
+    scraper.set_clock(lambda: now)
+    client = MongoClient(uri)
+    coordinator = ShardCoordinator(client, worker_id)
+    coordinator.heartbeat()
+    barrier.wait()
+    coordinator.heartbeat()
+    results.put((worker_id, sorted(worker_tick(client, coordinator, base_url)),
+                 sorted(code for code in set(meeting_of(client).values()) if coordinator.owns(shard_key(code)))))
+
+
+@pytest.mark.skipif(not MONGODB_URI, reason="set TAB_TEST_MONGODB_URI to a throwaway mongod")
+def test_worker_processes_fetch_disjoint_shards(stub_url, now):
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGODB_URI)
+    client.drop_database("tab")
+    client.drop_database("tab_control")
+    seed_day(client, stub_url, now)
+    expected = expected_fetches(client, now)
+
+    context = multiprocessing.get_context("spawn")
+    workers = [f"p{i}" for i in range(1, 4)]
+    barrier = context.Barrier(len(workers))
+    results = context.Queue()
+    processes = [context.Process(target=process_worker, args=(MONGODB_URI, w, stub_url, now, barrier, results))
+                 for w in workers]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=60) for _ in workers]
+    for process in processes:
+        process.join(10)
+
+    owned = [code for _, _, codes in outcomes for code in codes]
+    assert len(owned) == len(set(owned)) and set(owned) == set(meeting_of(client).values())
+    fetched = [race_id for _, races, _ in outcomes for race_id in races]
+    assert len(fetched) == len(set(fetched)) and set(fetched) == expected
@@ -0,0 +1,104 @@
+"""Retry and circuit-breaker behaviour of TabDataExtractor against tab_api_stub's fault injection."""
+from datetime import datetime, timezone
+
+import pytest
+
+import tab_data_extractor
+from deadline import Deadline
+from tab_api_stub import StubConfig, start_stub_server, synthetic_day
+from tab_data_extractor import CircuitBreaker, TabDataExtractor
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(tab_data_extractor, "RETRY_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(tab_data_extractor, "RETRY_BACKOFF_MAX", 0.02)
+
+
+@pytest.fixture
+def stub():
+    """Start a stub server; yields a function taking StubConfig kwargs and returning (config, base url)."""
+    servers = []
+
+    def start(**kwargs):
+        day = synthetic_day(meetings=1, races=2, runners=6, start=datetime.now(timezone.utc).replace(tzinfo=None))
+        config = StubConfig(synthetic=day, **kwargs)
+        server = start_stub_server(config)
+        servers.append(server)
+        return config, f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def extractor(base_url, **kwargs):
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=2, reset_seconds=60))
+    return TabDataExtractor(base_url=base_url, memo_ttl=0, **kwargs)
+
+
+def test_retries_recover_from_injected_errors(stub):
+    config, url = stub(error_rate=0.3, seed=1)
+    data_extractor = extractor(url)
+
+    fetched = [data_extractor.get_schedule_data(f"2026-05-{day:02d}") for day in range(1, 21)]
+
+    assert config.errors > 0
+    assert data_extractor.failures["retryable_response"] == config.errors
+    assert sum(schedule is not None for schedule in fetched) == 20 - data_extractor.failures["gave_up"]
+    assert data_extractor.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_exhausted_retries_open_the_breaker(stub):
+    config, url = stub(error_rate=1.0)
+    data_extractor = extractor(url)
+
+    assert data_extractor.get_schedule_data() is None
+    assert config.requests == tab_data_extractor.RETRY_ATTEMPTS
+    assert data_extractor.breaker.state == CircuitBreaker.CLOSED
+
+    assert data_extractor.get_schedule_data() is None
+    assert data_extractor.breaker.state == CircuitBreaker.OPEN
+    assert data_extractor.failures["gave_up"] == 2
+
+    # open: fails fast without reaching the API
+    requests_before = config.requests
+    assert data_extractor.get_schedule_data() is None
+    assert config.requests == requests_before
+    assert data_extractor.failures["breaker_open"] == 1
+
+
+def test_deadline_truncated_retries_do_not_count_towards_the_breaker(stub, monkeypatch):
+    config, url = stub(error_rate=1.0)
+    # the first backoff already leaves less than MIN_REQUEST_TIMEOUT of the deadline
+    monkeypatch.setattr(tab_data_extractor, "RETRY_BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(tab_data_extractor, "RETRY_BACKOFF_MAX", 1.0)
+    monkeypatch.setattr(tab_data_extractor.random, "uniform", lambda low, high: high)
+    data_extractor = extractor(url, deadline=Deadline(1.2))
+
+    for _ in range(3):
+        assert data_extractor.get_schedule_data() is None
+
+    assert config.requests == 3
+    assert data_extractor.failures["deadline_truncated"] == 3
+    assert data_extractor.failures["gave_up"] == 0
+    assert data_extractor.breaker.consecutive_failures == 0
+    assert data_extractor.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_truncated_half_open_probe_lets_the_next_call_probe(stub, monkeypatch):
+    config, url = stub(error_rate=1.0)
+    monkeypatch.setattr(tab_data_extractor.random, "uniform", lambda low, high: 1.0)
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 31.0
+
+    data_extractor = extractor(url, breaker=breaker, deadline=Deadline(1.2))
+    assert data_extractor.get_schedule_data() is None
+    assert data_extractor.failures["deadline_truncated"] == 1
+
+    config.error_rate = 0.0
+    data_extractor.deadline = None
+    assert data_extractor.get_schedule_data() is not None
+    assert breaker.state == CircuitBreaker.CLOSED
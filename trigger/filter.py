@@ -0,0 +1,195 @@
+"""Shared favourite filter used by the live scheduler and analysis backtests.
+
+A rule set is a list of reject conditions over a feature vector built from the
+favourite, second and third favourite (sorted by fixed win odds). A race is bet
+on only when no condition matches. Missing features reject the race, so a rule
+that needs tote prices never fires on fixed-odds-only data.
+
+Rule sets live in filter_rules.json so the rule that was backtested in
+analysis/main.py is exactly the one the scheduler runs live. The file's
+`active` set stays the backtested favourite_place until the fixed-odds
+variant has been backtested over v1 data (v1 events carry no tote prices, so
+favourite_place rejects them); TAB_RULE_SET selects another set per
+environment (e.g. favourite_place_fixed).
+"""
+import os
+import json
+import operator
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter_rules.json")
+RULE_SET = os.getenv("TAB_RULE_SET", "")  # overrides the rules file's `active` entry
+
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+POSITIONS = ("fav", "second", "third")
+PRICES = ("win", "plc", "ffwin", "ffplc")
+
+# derived feature -> (numerator, operator, denominator)
+DERIVED_FEATURES: Dict[str, Tuple[str, str, str]] = {
+    "win_plc_ratio": ("fav_win", "/", "fav_plc"),
+    "second_favourite_diff": ("fav_win", "-", "second_win"),
+    "third_favourite_diff": ("fav_win", "-", "third_win"),
+    "second_favourite_ffdiff": ("fav_ffwin", "-", "second_ffwin"),
+    "third_favourite_ffdiff": ("fav_ffwin", "-", "third_ffwin"),
+    "second_favourite_ratio": ("fav_win", "/", "second_win"),
+    "third_favourite_ratio": ("fav_win", "/", "third_win"),
+    "second_favourite_ffwin_ratio": ("fav_ffwin", "/", "second_ffwin"),
+    "third_favourite_ffwin_ratio": ("fav_ffwin", "/", "third_ffwin"),
+    "second_favourite_ffplc_ratio": ("fav_ffplc", "/", "second_ffplc"),
+    "third_favourite_ffplc_ratio": ("fav_ffplc", "/", "third_ffplc"),
+    "tote_fixed_win_ratio": ("fav_win", "/", "fav_ffwin"),
+    "tote_fixed_plc_ratio": ("fav_plc", "/", "fav_ffplc"),
+}
+
+BASE_FEATURES = tuple(f"{position}_{price}" for position in POSITIONS for price in PRICES)
+FEATURES = BASE_FEATURES + tuple(DERIVED_FEATURES)
+
+
+def snapshot_prices(snapshot: Optional[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+    """Normalise an odds snapshot (legacy win/plc/ffwin/ffplc or v1 fixed_win/fixed_place)."""
+    snapshot = snapshot or {}
+    return {
+        "win": snapshot.get("win"),
+        "plc": snapshot.get("plc"),
+        "ffwin": snapshot.get("ffwin", snapshot.get("fixed_win")),
+        "ffplc": snapshot.get("ffplc", snapshot.get("fixed_place")),
+    }
+
+
+def event_runner_prices(event: Optional[Dict[str, Any]]) -> List[Dict[str, Optional[float]]]:
+    """Prices for every unscratched runner in a v1 event payload."""
+    prices = []
+    for runner in (event or {}).get("runners") or []:
+        if runner.get("is_scratched"):
+            continue
+        prices.append(snapshot_prices(runner.get("odds")))
+    return prices
+
+
+def _derive(numerator: Optional[float], op: str, denominator: Optional[float]) -> Optional[float]:
+    if numerator is None or denominator is None:
+        return None
+    if op == "-":
+        return numerator - denominator
+    if not denominator:
+        return None
+    return numerator / denominator
+
+
+def favourite_features(runner_prices: List[Dict[str, Optional[float]]]) -> Optional[Dict[str, Optional[float]]]:
+    """Build the feature vector from per-runner prices. None if fewer than 3 priced runners."""
+    priced = [p for p in runner_prices if p.get("ffwin")]
+    if len(priced) < len(POSITIONS):
+        return None
+    priced.sort(key=lambda p: p["ffwin"])
+
+    features: Dict[str, Optional[float]] = {}
+    for position, prices in zip(POSITIONS, priced):
+        for price in PRICES:
+            features[f"{position}_{price}"] = prices.get(price)
+    for name, (numerator, op, denominator) in DERIVED_FEATURES.items():
+        features[name] = _derive(features[numerator], op, features[denominator])
+    return features
+
+
+@dataclass(frozen=True)
+class Condition:
+    feature: str
+    op: str
+    value: float
+
+
+class RuleSet:
+    """A named list of reject conditions, compiled once for repeated evaluation."""
+
+    def __init__(self, name: str, conditions: List[Condition], description: str = ""):
+        for condition in conditions:
+            if condition.feature not in FEATURES:
+                raise ValueError(f"Unknown feature in rule set {name}: {condition.feature}")
+            if condition.op not in OPERATORS:
+                raise ValueError(f"Unknown operator in rule set {name}: {condition.op}")
+        self.name = name
+        self.description = description
+        self.conditions = conditions
+        self._compiled = tuple((c.feature, OPERATORS[c.op], c.value) for c in conditions)
+
+    @classmethod
+    def from_config(cls, name: str, config: Dict[str, Any]) -> "RuleSet":
+        conditions = [Condition(c["feature"], c["op"], c["value"]) for c in config.get("reject", [])]
+        return cls(name, conditions, config.get("description", ""))
+
+    def evaluate(self, features: Optional[Dict[str, Optional[float]]]) -> bool:
+        """True to bet, False if any reject condition matches or a feature is missing."""
+        if features is None:
+            return False
+        for feature, op, value in self._compiled:
+            current = features.get(feature)
+            if current is None or op(current, value):
+                return False
+        return True
+
+    def evaluate_frame(self, frame):
+        """Vectorised evaluate over a DataFrame with one row per race and BASE_FEATURES columns.
+
+        Derived feature columns are added when missing. Returns a boolean Series.
+        """
+        frame = add_derived_columns(frame)
+        bet = frame["fav_ffwin"].notna()
+        for feature, op, value in self._compiled:
+            column = frame[feature]
+            bet &= column.notna() & ~op(column, value)
+        return bet
+
+
+def add_derived_columns(frame):
+    """Return a copy of `frame` with any missing DERIVED_FEATURES columns computed."""
+    frame = frame.copy()
+    for name, (numerator, op, denominator) in DERIVED_FEATURES.items():
+        if name in frame:
+            continue
+        if op == "-":
+            frame[name] = frame[numerator] - frame[denominator]
+        else:
+            frame[name] = frame[numerator] / frame[denominator].where(frame[denominator] != 0)
+    return frame
+
+
+def load_rule_set(name: Optional[str] = None, rules_file: str = DEFAULT_RULES_FILE) -> RuleSet:
+    """Load rule set `name` (default: TAB_RULE_SET, else the file's `active` entry) from a JSON rules file."""
+    with open(rules_file, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    name = name or RULE_SET or config["active"]
+    if name not in config["rule_sets"]:
+        raise KeyError(f"Rule set {name} not found in {rules_file}")
+    return RuleSet.from_config(name, config["rule_sets"][name])
+
+
+class Filter:
+    """Live decision wrapper used by trigger/scheduler.py."""
+
+    def __init__(self, rule_set: Optional[str] = None, rules_file: str = DEFAULT_RULES_FILE):
+        self.rule_set = load_rule_set(rule_set, rules_file)
+
+    def filter_odds(self, event: Optional[Dict[str, Any]]) -> bool:
+        """Decide on a v1 event payload. True means bet on the favourite to place."""
+        return self.rule_set.evaluate(favourite_features(event_runner_prices(event)))
+
+
+def favourite_runner(event: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The unscratched v1 runner with the shortest fixed win price."""
+    runners = [
+        r for r in (event or {}).get("runners") or []
+        if not r.get("is_scratched") and snapshot_prices(r.get("odds"))["ffwin"]
+    ]
+    if not runners:
+        return None
+    return min(runners, key=lambda r: snapshot_prices(r.get("odds"))["ffwin"])
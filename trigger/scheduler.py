@@ -1,21 +1,53 @@
+import os
 import time
 import json
+import uuid
 import logging
+import threading
+import requests
 import schedule
 from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Dict, Optional
 
-from filter import Filter
+from filter import Filter, favourite_runner
 from tab_data_extractor import TabDataExtractor
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from web_navigator import TAB_BASE_URL, SessionPool, click_bet, login, race_page_url
 #TODO: need to get meeting name
 
 DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+TRIGGER_SERVER_URL = os.getenv("TRIGGER_SERVER_URL", "http://trigger_server:3000")
+# With TAB_USERNAME/TAB_PASSWORD set, bets are clicked here through a pool of warm
+# logged-in browsers (needs Chrome and chromedriver) instead of by the trigger server's client
+TAB_USERNAME = os.getenv("TAB_USERNAME", "")
+TAB_PASSWORD = os.getenv("TAB_PASSWORD", "")
+BROWSER_POOL_SIZE = int(os.getenv("TAB_BROWSER_POOL_SIZE", "2"))
+BROWSER_HEALTH_CHECK_SECONDS = int(os.getenv("TAB_BROWSER_HEALTH_CHECK_SECONDS", "60"))
+
+def now_utc() -> datetime:
+    """Naive UTC datetime — v1 start_time is UTC regardless of container TZ."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def utc_timestamp(time_str: str) -> float:
+    """Epoch seconds of a naive UTC DATETIME_FORMAT string."""
+    return datetime.strptime(time_str, DATETIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+def iso_utc_to_datetime(iso_str: str) -> datetime:
+    """Parse a v1 ISO 8601 start_time into a naive UTC datetime."""
+    dt = datetime.fromisoformat(iso_str.replace("Z", "+00:00"))
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
 
 @dataclass
 class TimingSchedule:
-    norm_time: str
+    norm_time: str  # trigger time, start_time - run_offset_time
     meeting_name: str
     id: str
+    start_time: Optional[str] = None  # actual v1 start_time (UTC)
 
 class OneTimeScheduler:
     def __init__(self, log_level=logging.INFO):
@@ -33,13 +65,29 @@ class OneTimeScheduler:
         self.schedule_file_name = "timing_schedule.json"
         self.debug_file_name = "test_output.json"
         self.run_offset_time = 10 # seconds
+        # Earlier checkpoints (seconds before the jump) at which event data is
+        # prefetched so the final decision only needs one fresh fetch + a diff
+        self.prefetch_offsets = [120, 30]
+        # race_id -> runner_number -> latest parsed runner state
+        self.race_state: Dict[str, Dict[str, Dict]] = {}
+        # race_id -> filter decision on race_state, reused when the final fetch changes no runner
+        self.race_decision: Dict[str, bool] = {}
         # self.schedule_file = Path(self.schedule_file_name)
         self.running = True
         self.current_jobs = {}
+        # race_id -> TimingSchedule for O(1) lookups
+        self.timing_schedule: Dict[str, TimingSchedule] = {}
         self.last_file_check = datetime.now()
         self.file_check_interval = 600  # Check for schedule updates every 600 seconds
         self.tab_data_extractor = TabDataExtractor()
         self.filter = Filter()
+        self.session_pool: Optional[SessionPool] = None
+        if TAB_USERNAME and TAB_PASSWORD:
+            self.session_pool = SessionPool(
+                base_url=TAB_BASE_URL,
+                size=BROWSER_POOL_SIZE,
+                login_fn=partial(login, username=TAB_USERNAME, password=TAB_PASSWORD),
+            )
             
     def should_check_schedule(self):
         """Determine if it's time to check for schedule updates."""
@@ -52,36 +100,116 @@ class OneTimeScheduler:
     def is_future_time(self, time_str):
         """Check if the given time is in the future for the specified date."""
         task_datetime = datetime.strptime(time_str, DATETIME_FORMAT)
-        return task_datetime > datetime.now()
+        return task_datetime > now_utc()
     
-    def pull_and_reformat_tab_scheule(self):
-        timing_schedule = []
-        schedule = self.tab_data_extractor.get_schedule_data()
-        for meeting in schedule["meetings"]:
-            for race in meeting["races"]:
+    def pull_and_reformat_tab_scheule(self) -> Dict[str, TimingSchedule]:
+        """Pull today's v1 schedule into a dict keyed by race id."""
+        timing_schedule: Dict[str, TimingSchedule] = {}
+        schedule_data = self.tab_data_extractor.get_schedule_data()
+        if schedule_data is None:
+            self.logger.warning("Schedule fetch failed, keeping previous schedule")
+            return self.timing_schedule
+
+        for meeting in schedule_data.get("meetings") or []:
+            for race in meeting.get("races") or []:
+                race_id = race.get("id")
+                start_iso = race.get("start_time")
+                if not race_id or not start_iso:
+                    continue
+                try:
+                    start_time = iso_utc_to_datetime(start_iso)
+                except (TypeError, ValueError):
+                    continue
 
                 # offset execution time by run_offset_time
-                race_time = datetime.strptime(race["norm_time"], DATETIME_FORMAT)
-                race_time = race_time - timedelta(seconds=self.run_offset_time)
-                race_time = race_time.strftime(DATETIME_FORMAT)
-
-                timing_schedule.append(
-                    TimingSchedule(
-                            norm_time=race_time,
-                            meeting_name=meeting["name"],
-                            id=race["id"]
-                        )
-                    )
+                trigger_time = start_time - timedelta(seconds=self.run_offset_time)
+
+                timing_schedule[race_id] = TimingSchedule(
+                    norm_time=trigger_time.strftime(DATETIME_FORMAT),
+                    meeting_name=meeting.get("name"),
+                    id=race_id,
+                    start_time=start_time.strftime(DATETIME_FORMAT),
+                )
         self.logger.info(f"schedule_len {len(timing_schedule)}")
         return timing_schedule
     
-    def pull_race_odds(self, race_id):
-        odds = self.tab_data_extractor.get_odds_data()
-        for meeting in odds["meetings"]:
-            for race in meeting["races"]:
-                if race["id"] == race_id:
-                    return race
-        return None
+    @staticmethod
+    def offset_time_str(time_str, seconds):
+        """Shift a DATETIME_FORMAT string back by `seconds`."""
+        shifted = datetime.strptime(time_str, DATETIME_FORMAT) - timedelta(seconds=seconds)
+        return shifted.strftime(DATETIME_FORMAT)
+
+    @staticmethod
+    def parse_runners(event) -> Dict[str, Dict]:
+        """Reduce an event payload to the runner fields the decision uses."""
+        runners = {}
+        for runner in (event or {}).get("runners") or []:
+            num = runner.get("runner_number")
+            if num is None:
+                continue
+            odds = runner.get("odds") or {}
+            runners[str(num)] = {
+                "is_scratched": runner.get("is_scratched", False),
+                "fixed_win": odds.get("fixed_win"),
+                "fixed_place": odds.get("fixed_place"),
+            }
+        return runners
+
+    @staticmethod
+    def diff_runner_state(previous: Dict[str, Dict], current: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Return runners whose state changed (or appeared) since `previous`."""
+        return {
+            num: state for num, state in current.items()
+            if previous.get(num) != state
+        }
+
+    def fetch_race_state(self, race_id, hedge=False) -> Optional[Dict]:
+        """Fetch one event and refresh the in-memory runner state for it."""
+        event = self.pull_race_odds(race_id, hedge)
+        if event is None:
+            return None
+        self.race_state[race_id] = self.parse_runners(event)
+        return event
+
+    def decide(self, race_id, event, changed) -> bool:
+        """Filter decision for a freshly fetched event, re-evaluated only if a runner changed."""
+        if not changed and race_id in self.race_decision:
+            return self.race_decision[race_id]
+        self.race_decision[race_id] = self.filter.filter_odds(event)
+        return self.race_decision[race_id]
+
+    def prefetch_race(self, race_id, checkpoint):
+        """Warm the connection and runner cache ahead of the trigger."""
+        fetch_start = time.perf_counter()
+        previous_state = self.race_state.get(race_id, {})
+        event = self.fetch_race_state(race_id)
+        fetch_ms = (time.perf_counter() - fetch_start) * 1000
+        if event is None:
+            self.logger.warning(f"prefetch T-{checkpoint}s failed for race_id: {race_id}")
+        else:
+            changed = self.diff_runner_state(previous_state, self.race_state[race_id])
+            decision = self.decide(race_id, event, changed)
+            self.logger.info(f"prefetch T-{checkpoint}s race_id: {race_id} ({fetch_ms:.0f}ms) | bet {decision}")
+
+        if self.session_pool is not None and race_id in self.timing_schedule:
+            # the pool's maintenance thread parks a browser on the race page, so a bet needs only
+            # the final clicks; queued rather than loaded here, keeping page loads off this thread
+            race = self.timing_schedule[race_id]
+            self.session_pool.request_prenavigate(
+                race_page_url(race.meeting_name, race_id), utc_timestamp(race.norm_time)
+            )
+
+        job_key = f"{race_id}_prefetch_{checkpoint}"
+        if job_key in self.current_jobs:
+            schedule.cancel_job(self.current_jobs[job_key])
+            del self.current_jobs[job_key]
+
+    def pull_race_odds(self, race_id, hedge=False) -> Optional[Dict]:
+        """Fetch a single scheduled race directly from the v1 event endpoint."""
+        if race_id not in self.timing_schedule:
+            self.logger.warning(f"race_id not in schedule: {race_id}")
+            return None
+        return self.tab_data_extractor.get_event_data(race_id, hedge=hedge)
     
     def update_schedule(self):
         """Update the schedule with new trigger times."""
@@ -92,13 +220,13 @@ class OneTimeScheduler:
         self.current_jobs.clear()
         
         # Load new schedule
-        races = self.pull_and_reformat_tab_scheule()
+        self.timing_schedule = self.pull_and_reformat_tab_scheule()
 
         # with open(self.schedule_file_name, 'w') as f:
         #     json.dump(races, f, indent=4)
         
         # Schedule each task for specified dates
-        for race_info in races:
+        for race_info in self.timing_schedule.values():
             # Only schedule if the time hasn't passed yet
             trigger_date_time = race_info.norm_time
             race_id = race_info.id
@@ -111,6 +239,22 @@ class OneTimeScheduler:
                 job_key = f"{race_id}_{meeting_name}_{trigger_time}"
                 self.logger.info(job_key)
                 self.current_jobs[job_key] = job
+
+                self.schedule_prefetches(race_id, trigger_date_time)
+
+    def schedule_prefetches(self, race_id, trigger_date_time):
+        """Schedule prefetch jobs at each earlier checkpoint still in the future."""
+        for checkpoint in self.prefetch_offsets:
+            if checkpoint <= self.run_offset_time:
+                continue
+            prefetch_date_time = self.offset_time_str(trigger_date_time, checkpoint - self.run_offset_time)
+            if not self.is_future_time(prefetch_date_time):
+                continue
+            prefetch_time = prefetch_date_time.split(" ")[-1]
+            job = schedule.every().day.at(prefetch_time).do(
+                self.prefetch_race, race_id, checkpoint,
+            )
+            self.current_jobs[f"{race_id}_prefetch_{checkpoint}"] = job
                     
     def run_task(self, race_id, meeting_name, trigger_time):
         """Execute the task and remove it from schedule after completion."""
@@ -118,13 +262,40 @@ class OneTimeScheduler:
 
         # Add your task logic here
         self.logger.info(f"analysing race_id: {race_id}")
-        odds = self.pull_race_odds(race_id)
+        # wall-clock stage timestamps, shared with trigger_server under trace_id
+        trace_id = uuid.uuid4().hex
+        stages = {"odds_requested": time.time()}
+        decision_start = time.perf_counter()
+        previous_state = self.race_state.get(race_id, {})
+        odds = self.fetch_race_state(race_id, hedge=True)
+        fetch_done = time.perf_counter()
+        stages["odds_received"] = time.time()
         # with open(self.debug_file_name, 'w') as f:
         #     json.dump(odds, f, indent=4)
 
-        race_good = self.filter.filter_odds(odds)
-        if race_good:
-            self.logger.info(f"bet on")
+        race_good = False
+        if odds is None:
+            self.logger.warning(f"final fetch failed for race_id: {race_id}")
+        else:
+            changed = self.diff_runner_state(previous_state, self.race_state[race_id])
+            self.logger.info(f"{len(changed)} runners changed since last prefetch")
+            # unchanged runners since the prefetch: its decision stands without re-running the filter
+            race_good = self.decide(race_id, odds, changed)
+            stages["filter_done"] = time.time()
+            if race_good:
+                self.logger.info(f"bet on")
+                self.activate_trigger(odds, meeting_name, race_id, trace_id, stages)
+        decision_done = time.perf_counter()
+        self.logger.info(
+            f"decision latency race_id: {race_id} "
+            f"fetch {(fetch_done - decision_start) * 1000:.0f}ms | "
+            f"total {(decision_done - decision_start) * 1000:.0f}ms | "
+            f"warm {bool(previous_state)} | trace_id {trace_id}"
+        )
+        self.logger.info(self.tab_data_extractor.hedge_report())
+        self.logger.info(self.tab_data_extractor.coalesce_report())
+        self.race_state.pop(race_id, None)
+        self.race_decision.pop(race_id, None)
 
         # Remove the job after it runs or if the date has passed
         job_key = f"{race_id}_{meeting_name}_{trigger_time}"
@@ -132,8 +303,66 @@ class OneTimeScheduler:
             schedule.cancel_job(self.current_jobs[job_key])
             del self.current_jobs[job_key]
             
+    def activate_trigger(self, odds, meeting_name, race_id, trace_id, stages):
+        """Fire the trigger server for the favourite, handing over the trace so far."""
+        favourite = favourite_runner(odds)
+        if favourite is None:
+            self.logger.warning(f"no favourite to bet on for race_id: {race_id}")
+            return
+        url = f"{TRIGGER_SERVER_URL}/activate/{favourite['runner_number']}/{meeting_name}/{race_id}/"
+        # with a browser pool the bet is clicked here; the trigger server only traces it
+        body = {"trace_id": trace_id, "stages": stages, "client_bet": self.session_pool is None}
+
+        def post_activation():
+            try:
+                response = requests.post(url, json=body, timeout=2)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.logger.error(f"Error activating trigger for race_id {race_id}: {e}")
+
+        if self.session_pool is None:
+            post_activation()  # the trigger server's client places the bet
+            return
+        # the trace is sent alongside the click rather than ahead of it
+        activation = threading.Thread(target=post_activation, name="trace-activate", daemon=True)
+        activation.start()
+        placed = self.place_bet(meeting_name, race_id, trace_id)
+        activation.join()  # the trigger server must know the trace before its outcome
+        self.report_bet(race_id, trace_id, placed)
+
+    def place_bet(self, meeting_name, race_id, trace_id) -> int:
+        """Click the bet in a warm pooled browser. Returns 1 if placed, else 0."""
+        driver = None
+        placed = 0
+        try:
+            # never launch here: a cold browser and login would miss the jump anyway
+            driver = self.session_pool.acquire(race_page_url(meeting_name, race_id), launch=False)
+            if driver is None:
+                self.logger.error(f"No warm browser to place bet for race_id {race_id}")
+            else:
+                seconds = click_bet(driver)
+                placed = 1
+                self.logger.info(f"bet placed race_id: {race_id} ({seconds * 1000:.0f}ms) | trace_id {trace_id}")
+        except (TimeoutException, WebDriverException) as e:
+            self.logger.error(f"Error placing bet for race_id {race_id}: {e}")
+        finally:
+            if driver is not None:
+                self.session_pool.release(driver)
+        return placed
+
+    def report_bet(self, race_id, trace_id, placed):
+        """Report a bet's outcome to the trigger server under its trace."""
+        try:
+            response = requests.post(f"{TRIGGER_SERVER_URL}/success/{placed}/", params={"traceId": trace_id}, timeout=2)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.logger.error(f"Error reporting bet for race_id {race_id}: {e}")
+
     def run(self):
         """Main loop to run the scheduler."""
+        if self.session_pool is not None:
+            # launches and health checks run in the background, away from the job loop
+            self.session_pool.start_maintenance(BROWSER_HEALTH_CHECK_SECONDS)
         self.update_schedule()
         
         while self.running:
@@ -150,6 +379,8 @@ class OneTimeScheduler:
     def stop(self):
         """Stop the scheduler."""
         self.running = False
+        if self.session_pool is not None:
+            self.session_pool.close()
 
 if __name__ == "__main__":    
     # Initialize and run scheduler
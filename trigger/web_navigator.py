@@ -3,14 +3,22 @@ from selenium.webdriver.chrome.options import Options
 import pickle
 import os
 import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import (
     TimeoutException,
     NoSuchElementException,
-    StaleElementReferenceException
+    StaleElementReferenceException,
+    WebDriverException
 )
 from selenium.webdriver.chrome.service import Service
 
@@ -29,20 +37,23 @@ class SessionManager:
         # Create profile directory if it doesn't exist
         Path(profile_dir).mkdir(parents=True, exist_ok=True)
 
-    def create_browser_with_profile(self) -> webdriver.Chrome:
+    def create_browser_with_profile(self, user_data_dir: Optional[str] = None) -> webdriver.Chrome:
         """
         Create a Chrome browser instance with a saved profile.
+
+        Args:
+            user_data_dir (str, optional): Chrome data dir. Each concurrently
+                running browser needs its own, so pooled drivers pass one in.
         
         Returns:
             webdriver.Chrome: Browser instance with profile loaded
         """
         options = webdriver.ChromeOptions()
-        options.add_argument(f"user-data-dir={self.profile_dir}")
+        options.add_argument(f"--user-data-dir={user_data_dir or self.profile_dir}")
         
         # Additional options for stability
         options.add_argument("--no-sandbox")
         options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--user-data-dir=chrome-data")
 
         if self.headless:
             options.add_argument("headless")
@@ -78,6 +89,364 @@ class SessionManager:
                     except Exception as e:
                         print(f"Error loading cookie: {e}")
 
+TAB_BASE_URL = "https://www.tab.co.nz"
+LOGIN_BUTTON_XPATH = "//*[@data-testid='header-login']"
+ACCOUNT_XPATH = "//*[@data-testid='brand-bar-account']"
+BET_BUTTON_XPATH = "//*[@data-testid='bet-button']"
+BET_CONFIRMED_XPATH = "//*[@data-testid='bet-confirmed']"
+# a reservation outlives its trigger time by this long, covering the final fetch before the click
+RESERVATION_GRACE_SECONDS = 60
+
+
+def is_logged_in(driver: webdriver.Chrome) -> bool:
+    """Check for the account element without waiting."""
+    return bool(driver.find_elements(By.XPATH, ACCOUNT_XPATH))
+
+
+def login(driver: webdriver.Chrome, username: str, password: str, timeout: int = 120):
+    """
+    Log in from the currently loaded page.
+
+    Args:
+        driver: WebDriver on a TAB page with the header login button
+        username (str): Login username
+        password (str): Login password
+        timeout (int): Seconds to wait for the account element after submitting
+    """
+    login_button = driver.find_element(By.XPATH, LOGIN_BUTTON_XPATH)
+    login_button.click()
+    WebDriverWait(driver, 30).until(
+            EC.presence_of_element_located((By.ID, "username"))
+        )
+
+    # Perform login
+    username_field = driver.find_element(By.ID, "username")  # Replace with actual ID
+    password_field = driver.find_element(By.ID, "password")  # Replace with actual ID
+
+    username_field.send_keys(username)
+    password_field.send_keys(password)
+
+    # Find and click login button
+    login_button = driver.find_element(By.ID, "accept")  # Replace with actual ID
+    login_button.click()
+
+    WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.XPATH, ACCOUNT_XPATH))
+        )
+
+
+class SessionPool:
+    """
+    Pool of pre-launched, logged-in headless drivers kept warm for time-critical bets.
+
+    Drivers are launched up front, restore the saved cookies (logging in only
+    when the cookies have expired) and are reserved per upcoming race: one
+    driver is parked on each race page, taking a free driver or one held for a
+    later race, so acquiring it at trigger time leaves only the final clicks.
+    Launches, health checks and queued pre-navigations run on a maintenance
+    thread, so a slow login never holds up the caller.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        size: int = 2,
+        session_mgr: Optional[SessionManager] = None,
+        login_fn: Optional[Callable[[webdriver.Chrome], None]] = None,
+    ):
+        """
+        Args:
+            base_url (str): Page loaded on launch to restore cookies against
+            size (int): Number of drivers kept warm
+            session_mgr (SessionManager, optional): Profile and cookie handling
+            login_fn (callable, optional): Logs a driver in when cookies are stale
+        """
+        self.base_url = base_url
+        self.size = size
+        self.session_mgr = session_mgr or SessionManager(headless=True)
+        self.login_fn = login_fn
+        self._lock = threading.Lock()
+        self._idle: List[webdriver.Chrome] = []
+        self._pages = {}  # id(driver) -> pre-navigated url
+        self._reserved: Dict[int, Tuple[float, str]] = {}  # id(driver) -> (race due time, url)
+        self._pending: Deque[Tuple[str, Optional[float]]] = deque()  # pre-navigations for the maintenance thread
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._maintenance: Optional[threading.Thread] = None
+        self._launched = 0
+        self._starting = 0  # drivers being launched by start(), counted towards the pool size
+
+    def _launch(self) -> webdriver.Chrome:
+        # reserve the profile dir under the lock: concurrent launches must not share one
+        with self._lock:
+            user_data_dir = os.path.join(self.session_mgr.profile_dir, f"pool_{self._launched}")
+            self._launched += 1
+        driver = self.session_mgr.create_browser_with_profile(user_data_dir=user_data_dir)
+        driver.get(self.base_url)
+        self.session_mgr.load_cookies(driver)
+        driver.refresh()
+
+        if self.login_fn and not is_logged_in(driver):
+            self.login_fn(driver)
+            self.session_mgr.save_cookies(driver)
+        self._pages[id(driver)] = self.base_url
+        return driver
+
+    @staticmethod
+    def is_healthy(driver: webdriver.Chrome) -> bool:
+        """A driver is healthy if its session answers and the page has loaded."""
+        try:
+            return driver.execute_script("return document.readyState") == "complete"
+        except WebDriverException:
+            return False
+
+    def _quit(self, driver: webdriver.Chrome):
+        self._pages.pop(id(driver), None)
+        self._reserved.pop(id(driver), None)
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+
+    def start(self):
+        """Launch drivers until the pool is full."""
+        with self._lock:
+            missing = max(self.size - len(self._idle) - self._starting, 0)
+            self._starting += missing
+        # launched outside the lock, so acquire() is not held up by Chrome starting
+        try:
+            for _ in range(missing):
+                driver = self._launch()
+                with self._lock:
+                    self._idle.append(driver)
+                    self._starting -= 1
+                    missing -= 1
+        finally:
+            with self._lock:
+                self._starting -= missing
+
+    def health_check(self):
+        """Replace dead idle drivers and top the pool back up."""
+        with self._lock:
+            idle = list(self._idle)
+        # checked outside the lock: a hung session must not block acquire()
+        unhealthy = [driver for driver in idle if not self.is_healthy(driver)]
+        with self._lock:
+            # a driver acquired meanwhile is checked again by acquire() itself
+            unhealthy = [driver for driver in unhealthy if driver in self._idle]
+            for driver in unhealthy:
+                self._idle.remove(driver)
+        for driver in unhealthy:
+            print("Replacing unhealthy driver")
+            self._quit(driver)
+        self.start()
+
+    def _expire_reservations(self):
+        now = time.time()
+        for key, (due, _) in list(self._reserved.items()):
+            if due + RESERVATION_GRACE_SECONDS < now:
+                del self._reserved[key]
+
+    def prenavigate(self, url: str, due: Optional[float] = None):
+        """
+        Park one idle driver on `url` for a race triggering at `due` (epoch seconds).
+
+        Reuses a driver already on the page; otherwise takes a free driver, or
+        the one held for the latest race after `due`. Drivers holding a sooner
+        race are left alone. The page load runs outside the lock.
+        """
+        due = float("inf") if due is None else due
+        with self._lock:
+            self._expire_reservations()
+            if any(reserved_url == url for _, reserved_url in self._reserved.values()):
+                return
+            driver = next((d for d in self._idle if self._pages.get(id(d)) == url), None)
+            if driver is not None:
+                self._reserved[id(driver)] = (due, url)
+                return
+            free = [d for d in self._idle if id(d) not in self._reserved]
+            later = [d for d in self._idle if id(d) in self._reserved and self._reserved[id(d)][0] > due]
+            if free:
+                driver = free[0]
+            elif later:
+                driver = max(later, key=lambda d: self._reserved[id(d)][0])
+            else:
+                print(f"No free driver to pre-navigate to {url}")
+                return
+            # out of the pool while loading, so acquire() never takes a half-loaded page
+            self._idle.remove(driver)
+            self._reserved[id(driver)] = (due, url)
+        try:
+            driver.get(url)
+            self._pages[id(driver)] = url
+        except WebDriverException as e:
+            print(f"Error pre-navigating to {url}: {e}")
+        with self._lock:
+            self._idle.append(driver)
+
+    def request_prenavigate(self, url: str, due: Optional[float] = None):
+        """Queue prenavigate(url, due) for the maintenance thread and return immediately."""
+        with self._lock:
+            self._pending.append((url, due))
+        self._wake.set()
+
+    def start_maintenance(self, interval: float = 60):
+        """Fill the pool, then health-check it every `interval` seconds, on a background thread."""
+        self._stop.clear()
+        self._maintenance = threading.Thread(
+            target=self._maintain, args=(interval,), name="session-pool", daemon=True
+        )
+        self._maintenance.start()
+
+    def _maintain(self, interval: float):
+        next_check = 0.0
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                # queued pre-navigations first: they are due before the next trigger
+                while True:
+                    with self._lock:
+                        if not self._pending:
+                            break
+                        url, due = self._pending.popleft()
+                    self.prenavigate(url, due)
+                if time.monotonic() >= next_check:
+                    self.health_check()
+                    next_check = time.monotonic() + interval
+            # launch and login failures are retried on the next check rather than ending the thread
+            except Exception as e:
+                print(f"Session pool maintenance error: {e}")
+                next_check = time.monotonic() + interval
+            self._wake.wait(max(next_check - time.monotonic(), 0))
+
+    def acquire(self, url: Optional[str] = None, launch: bool = True) -> Optional[webdriver.Chrome]:
+        """
+        Take a driver, preferring one already sitting on `url`.
+
+        Falls back to navigating a warm driver not held for another race, and
+        to launching a new one only when the pool is empty. With `launch`
+        False, returns None instead of launching.
+        """
+        with self._lock:
+            driver = next((d for d in self._idle if self._pages.get(id(d)) == url), None)
+            if driver is None:
+                free = [d for d in self._idle if id(d) not in self._reserved]
+                driver = (free or self._idle or [None])[0]
+            if driver is not None:
+                self._idle.remove(driver)
+                self._reserved.pop(id(driver), None)
+        if driver is not None and not self.is_healthy(driver):
+            self._quit(driver)
+            driver = None
+        if driver is None:
+            if not launch:
+                return None
+            driver = self._launch()
+        if url and self._pages.get(id(driver)) != url:
+            try:
+                driver.get(url)
+            except WebDriverException:
+                self._quit(driver)
+                raise
+            self._pages[id(driver)] = url
+        return driver
+
+    def release(self, driver: webdriver.Chrome):
+        """Return a driver to the pool, refreshing the saved cookies."""
+        if not self.is_healthy(driver):
+            self._quit(driver)
+            return
+        try:
+            self.session_mgr.save_cookies(driver)
+        except WebDriverException as e:
+            print(f"Error saving cookies: {e}")
+        with self._lock:
+            self._idle.append(driver)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        with self._lock:
+            for driver in self._idle:
+                self._quit(driver)
+            self._idle = []
+
+
+def race_page_url(meeting_name: str, race_id: str, base_url: str = TAB_BASE_URL) -> str:
+    """TAB race page, e.g. https://www.tab.co.nz/racing/pakenham/<race id>."""
+    slug = "-".join((meeting_name or "").lower().split())
+    return f"{base_url}/racing/{slug}/{race_id}"
+
+
+def click_bet(driver: webdriver.Chrome, timeout: float = 5) -> float:
+    """
+    Perform the final bet clicks on a pre-navigated race page.
+
+    Returns:
+        float: Seconds from call to the confirmation element appearing
+    """
+    start = time.perf_counter()
+    driver.find_element(By.XPATH, BET_BUTTON_XPATH).click()
+    WebDriverWait(driver, timeout).until(
+        EC.presence_of_element_located((By.XPATH, BET_CONFIRMED_XPATH))
+    )
+    return time.perf_counter() - start
+
+
+STUB_BET_PAGE = """<!DOCTYPE html>
+<html><body>
+<button data-testid="bet-button"
+        onclick="var d=document.createElement('div');d.setAttribute('data-testid','bet-confirmed');document.body.appendChild(d);">
+Place bet</button>
+</body></html>
+"""
+
+
+@contextmanager
+def stub_bet_page_server(directory: str = "stub_bet_page", port: int = 0):
+    """Serve a local stub race page with a bet button; yields its URL."""
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    with open(os.path.join(directory, "index.html"), "w", encoding="utf-8") as f:
+        f.write(STUB_BET_PAGE)
+
+    handler = partial(SimpleHTTPRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/index.html"
+    finally:
+        server.shutdown()
+
+
+def measure_trigger_to_click(runs: int = 5, pool_size: int = 1) -> List[float]:
+    """
+    Time trigger -> acquire warm driver -> click -> confirmation against the stub page.
+
+    Returns:
+        list: Per-run latency in milliseconds
+    """
+    latencies = []
+    with stub_bet_page_server() as url:
+        pool = SessionPool(base_url=url, size=pool_size)
+        pool.start()
+        try:
+            for _ in range(runs):
+                pool.prenavigate(url)
+                trigger = time.perf_counter()
+                driver = pool.acquire(url)
+                click_bet(driver)
+                latencies.append((time.perf_counter() - trigger) * 1000)
+                driver.refresh()
+                pool.release(driver)
+        finally:
+            pool.close()
+
+    for latency in latencies:
+        print(f"trigger -> click: {latency:.1f}ms")
+    return latencies
+
+
 def example_login_flow(url: str, username: str, password: str):
     """
     Example of how to use SessionManager for login persistence.
@@ -103,32 +472,11 @@ def example_login_flow(url: str, username: str, password: str):
         
         # # Refresh page to apply cookies
         # driver.refresh()
-        
-        login_button = driver.find_element(By.XPATH, "//*[@data-testid='header-login']")
-
 
         # Check if we need to login (you'll need to implement this based on the website)
-        if login_button:
-            login_button.click()
-            elem = WebDriverWait(driver, 30).until(
-                    EC.presence_of_element_located((By.ID, "username"))
-                )
-
-            # Perform login
-            username_field = driver.find_element(By.ID, "username")  # Replace with actual ID
-            password_field = driver.find_element(By.ID, "password")  # Replace with actual ID
-            
-            username_field.send_keys(username)
-            password_field.send_keys(password)
-            
-            # Find and click login button
-            login_button = driver.find_element(By.ID, "accept")  # Replace with actual ID
-            login_button.click()
-
-            elem = WebDriverWait(driver, 120).until(
-                    EC.presence_of_element_located((By.XPATH, "//*[@data-testid='brand-bar-account']"))
-                )
-            
+        if not is_logged_in(driver):
+            login(driver, username, password)
+
             # Save cookies after successful login
             session_mgr.save_cookies(driver)
         
@@ -137,6 +485,35 @@ def example_login_flow(url: str, username: str, password: str):
     finally:
         driver.quit()
 
+
+def example_pool_flow(race_url: str, username: str, password: str):
+    """
+    Example of keeping logged-in drivers warm and parked on the next race.
+
+    Args:
+        race_url (str): Upcoming race page to pre-navigate to
+        username (str): Login username
+        password (str): Login password
+    """
+    pool = SessionPool(
+        base_url=TAB_BASE_URL,
+        login_fn=partial(login, username=username, password=password),
+    )
+    pool.start()
+    try:
+        # ahead of the trigger time
+        pool.health_check()
+        pool.prenavigate(race_url)
+
+        # at trigger time only the final clicks remain
+        driver = pool.acquire(race_url)
+        try:
+            click_bet(driver)
+        finally:
+            pool.release(driver)
+    finally:
+        pool.close()
+
 # Example usage
 if __name__ == "__main__":
     # Replace with actual values
@@ -144,4 +521,4 @@ if __name__ == "__main__":
         url="https://www.tab.co.nz/racing/pakenham/0c5d7d31-b7fa-437d-8986-4129be69eb3b",
         username="khi48",
         password="OptimalPa33word!"
-    )
\ No newline at end of file
+    )
@@ -1,7 +1,11 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 from flask_cors import CORS
+from datetime import datetime, timezone
 import threading
+import json
 import time
+import math
+import os
 
 app = Flask(__name__)
 CORS(app)
@@ -12,17 +16,137 @@ state = {
     'horse_number': None,
     'meeting_name': None,
     'race_id': None,
+    'trace_id': None,
     'success': -1,
     'additional_data': {}
 }
 
+# Latency tracing: trace_id -> {'race_id', 'date', 'stages': {stage: epoch seconds}}
+# Scheduler stages arrive with the activate call, the rest are stamped here.
+# All hosts share one machine clock, so wall-clock timestamps are comparable.
+# Traces and stamps are appended to TRACE_FILE and reloaded on start, so a
+# restart keeps the latency history.
+STAGES = [
+    'odds_requested',
+    'odds_received',
+    'filter_done',
+    'trigger_activated',
+    'client_polled',
+    'bet_confirmed',
+]
+TRACE_RETENTION_DAYS = 2
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+traces = {}
+traces_lock = threading.Lock()
+
+
+def utc_date(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d')
+
+
+def persist(record):
+    """Append a trace or stage record to TRACE_FILE. Call with traces_lock held."""
+    try:
+        with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+    except OSError as e:
+        print(f"Could not persist trace: {e}")
+
+
+def load_traces():
+    """Rebuild `traces` from TRACE_FILE, dropping expired ones, and rewrite the file compacted."""
+    cutoff = time.time() - TRACE_RETENTION_DAYS * 24 * 3600
+    loaded = {}
+    try:
+        with open(TRACE_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line
+                if 'stage' in record:
+                    if record['trace_id'] in loaded:
+                        loaded[record['trace_id']]['stages'].setdefault(record['stage'], record['t'])
+                else:
+                    loaded[record.pop('trace_id')] = record
+    except OSError:
+        pass
+    with traces_lock:
+        traces.clear()
+        traces.update((t, trace) for t, trace in loaded.items() if trace['created'] >= cutoff)
+        tmp = TRACE_FILE + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for trace_id, trace in traces.items():
+                    f.write(json.dumps({'trace_id': trace_id, **trace}) + '\n')
+            os.replace(tmp, TRACE_FILE)
+        except OSError as e:
+            print(f"Could not compact {TRACE_FILE}: {e}")
+
+
+def record_stage(trace_id, stage) -> bool:
+    """Stamp `stage` on a trace once; later repeats (e.g. extra polls) are ignored. False if no such trace."""
+    if not trace_id:
+        return False
+    with traces_lock:
+        trace = traces.get(trace_id)
+        if trace is None:
+            return False
+        if stage not in trace['stages']:
+            trace['stages'][stage] = time.time()
+            persist({'trace_id': trace_id, 'stage': stage, 't': trace['stages'][stage]})
+        return True
+
+
+def prune_traces():
+    cutoff = time.time() - TRACE_RETENTION_DAYS * 24 * 3600
+    with traces_lock:
+        for trace_id in [t for t, trace in traces.items() if trace['created'] < cutoff]:
+            del traces[trace_id]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_report(date):
+    """p50/p95/p99 milliseconds for each hop (and end to end) across traces on `date`."""
+    hops = list(zip(STAGES, STAGES[1:])) + [(STAGES[0], STAGES[-1])]
+    samples = {f'{start}->{end}': [] for start, end in hops}
+    with traces_lock:
+        day_traces = [t for t in traces.values() if t['date'] == date]
+    for trace in day_traces:
+        stages = trace['stages']
+        for start, end in hops:
+            if start in stages and end in stages:
+                samples[f'{start}->{end}'].append((stages[end] - stages[start]) * 1000)
+
+    report = {}
+    for hop, values in samples.items():
+        values.sort()
+        report[hop] = {
+            'count': len(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+    return {'date': date, 'traces': len(day_traces), 'hops_ms': report}
+
+
 @app.route('/trigger')
 def get_trigger():
+    if state['trigger']:
+        record_stage(state['trace_id'], 'client_polled')
     return jsonify({
         'trigger': state['trigger'],
         'horseNumber': state['horse_number'],
         'meetingName': state['meeting_name'],
         'raceId': state['race_id'],
+        'traceId': state['trace_id'],
     })
 
 @app.route('/data')
@@ -31,10 +155,16 @@ def get_data():
         'horseNumber': state['horse_number'],
         'meeting': state['meeting_name'],
         'raceId': state['race_id'],
+        'traceId': state['trace_id'],
         'success': state['success'],
         'additionalData': state['additional_data']
     })
 
+@app.route('/latency')
+def get_latency():
+    date = request.args.get('date', utc_date(time.time()))
+    return jsonify(latency_report(date))
+
 def reset_trigger():
     """Reset trigger state after a delay"""
     time.sleep(1)
@@ -42,19 +172,41 @@ def reset_trigger():
 
 @app.route('/activate/<horse_number>/<meeting_name>/<race_id>/', methods=['POST'])
 def activate_trigger(horse_number, meeting_name, race_id):
-    state['trigger'] = True
+    body = request.get_json(silent=True) or {}
+    now = time.time()
+    trace_id = body.get('trace_id') or f'server-{now:.6f}'
+    stages = {k: v for k, v in (body.get('stages') or {}).items() if k in STAGES}
+    stages['trigger_activated'] = now
+    with traces_lock:
+        traces[trace_id] = {'race_id': race_id, 'date': utc_date(now), 'created': now, 'stages': stages}
+        persist({'trace_id': trace_id, **traces[trace_id]})
+    prune_traces()
+
+    # false when the scheduler clicks the bet itself (its browser pool): trace only, no client trigger
+    state['trigger'] = bool(body.get('client_bet', True))
     state['horse_number'] = horse_number
     state['meeting_name'] = meeting_name
     state['race_id'] = race_id
+    state['trace_id'] = trace_id
     threading.Thread(target=reset_trigger).start()
-    return jsonify({'status': 'success', 'message': f'Trigger activated for horse: {horse_number} with meeting_name: {meeting_name} and race_id: {race_id}'})
+    return jsonify({'status': 'success', 'traceId': trace_id, 'message': f'Trigger activated for horse: {horse_number} with meeting_name: {meeting_name} and race_id: {race_id}'})
 
 @app.route('/success/<success_state>/', methods=['POST'])
 def success(success_state):
+    # clients echo the traceId /trigger gave them, so a confirmation is never pinned on the wrong trigger
+    trace_id = request.args.get('traceId')
+    if not trace_id:
+        # older clients do not send one: assume the current trigger, as before traces existed
+        trace_id = state['trace_id']
+        app.logger.warning(f"POST /success without traceId is deprecated, assuming current trace {trace_id}")
+        record_stage(trace_id, 'bet_confirmed')
+    elif not record_stage(trace_id, 'bet_confirmed'):
+        return jsonify({'status': 'error', 'message': f'Unknown traceId: {trace_id}'}), 404
     state['success'] = int(success_state)
-    return jsonify({'status': success_state})
+    return jsonify({'status': success_state, 'traceId': trace_id})
 
 def main():
+    load_traces()
     try:
         # Changed host to '0.0.0.0' to allow external access
         app.run(host='0.0.0.0', port=3000)
@@ -62,4 +214,4 @@ def main():
         print(f"Server error: {e}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()